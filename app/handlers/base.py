@@ -30,15 +30,19 @@ except ImportError:
 
 import bson
 import httplib
+import itertools
 import tornado
 import tornado.escape
 import tornado.gen
 import tornado.web
 import types
 
+import handlers.common.cache
 import handlers.common.query
 import handlers.common.request
+import handlers.common.results
 import handlers.common.token
+import handlers.dbindexes
 import handlers.response as hresponse
 import models
 import utils
@@ -58,6 +62,36 @@ STATUS_MESSAGES = {
     506: "Wrong response type from database"
 }
 
+# Responses with more documents than this are streamed to the client.
+STREAM_MIN_RESULTS = 1000
+# How many documents are serialized and sent at a time when streaming.
+STREAM_BATCH_SIZE = 500
+
+# The collections whose GET responses are never cached: the tokens would be
+# stored in Redis.
+NOT_CACHED_COLLECTIONS = [models.TOKEN_COLLECTION]
+
+
+def _dump_json(obj):
+    """Serialize an object as a JSON string."""
+    return json.dumps(
+        obj,
+        default=bson.json_util.default,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+
+
+def _next_batch(cursor, size):
+    """Retrieve the next documents of a cursor.
+
+    :param cursor: The database cursor.
+    :param size: The maximum number of documents to retrieve.
+    :type size: int
+    :return A list of documents, empty when the cursor is exhausted.
+    """
+    return list(itertools.islice(cursor, size))
+
 
 # pylint: disable=unused-argument
 # pylint: disable=too-many-public-methods
@@ -94,6 +128,26 @@ class BaseHandler(tornado.web.RequestHandler):
         """The Redis connection."""
         return self.settings["redis_connection"]
 
+    @property
+    def token_cache(self):
+        """The in-memory token cache, if enabled."""
+        return self.settings.get("token_cache", None)
+
+    @property
+    def response_cache(self):
+        """The Redis cache of the GET responses, if enabled."""
+        return self.settings.get("response_cache", None)
+
+    @property
+    def result_waiter(self):
+        """The waiter of the Celery task results, if enabled."""
+        return self.settings.get("result_waiter", None)
+
+    @property
+    def query_shapes(self):
+        """The recorder of the query shapes, if enabled."""
+        return self.settings.get("query_shapes", None)
+
     @property
     def log(self):
         """The logger of this object."""
@@ -132,6 +186,19 @@ class BaseHandler(tornado.web.RequestHandler):
                 status_code, "Unknown status code returned")
         return message
 
+    def _set_response_headers(self, status_code, reason, headers):
+        """Set the status and the headers of the response."""
+        self.set_status(status_code=status_code, reason=reason)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.set_header("Access-Control-Allow-Headers", "authorization")
+        origin = self.request.headers.get("Origin", None)
+        if origin:
+            self.set_header("Access-Control-Allow-Origin", origin)
+
+        if headers:
+            for key, val in headers.iteritems():
+                self.add_header(key, val)
+
     def write(self, future):
         """Write the response back to the requestor."""
         status_code = 200
@@ -153,27 +220,76 @@ class BaseHandler(tornado.web.RequestHandler):
             reason = self._get_status_message(status_code)
             to_dump = dict(code=status_code, reason=reason)
 
-        result = json.dumps(
-            to_dump,
-            default=bson.json_util.default,
-            ensure_ascii=False,
-            separators=(",", ":")
-        )
+        result = _dump_json(to_dump)
 
-        self.set_status(status_code=status_code, reason=reason)
+        self._set_response_headers(status_code, reason, headers)
         self._write_buffer.append(tornado.escape.utf8(result))
-        self.set_header("Content-Type", "application/json; charset=UTF-8")
-        self.set_header("Access-Control-Allow-Headers", "authorization")
-        origin = self.request.headers.get("Origin", None)
-        if origin:
-            self.set_header("Access-Control-Allow-Origin", origin)
-
-        if headers:
-            for key, val in headers.iteritems():
-                self.add_header(key, val)
 
         self.finish()
 
+    @tornado.gen.coroutine
+    def write_stream(self, response):
+        """Write a response back to the requestor, streaming its result.
+
+        The documents of the result cursor are retrieved and serialized
+        `STREAM_BATCH_SIZE` at a time, and each batch is flushed to the
+        client before the next one is retrieved: the memory used does not
+        depend on the number of documents.
+
+        :param response: The response with the result cursor.
+        :type response: `HandlerResponse`
+        """
+        to_dump = response.to_dict()
+        cursor = to_dump.pop("result")
+
+        self._set_response_headers(
+            response.status_code,
+            response.reason or self._get_status_message(response.status_code),
+            response.headers)
+
+        # Write everything but the closing brace, and then the result list.
+        self._write_buffer.append(
+            tornado.escape.utf8(_dump_json(to_dump)[:-1] + ',"result":['))
+
+        first = True
+        streamed = 0
+        last = None
+        try:
+            while True:
+                batch = yield utils.db.run_async(
+                    _next_batch, cursor, STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                streamed += len(batch)
+                last = batch[-1]
+
+                chunk = ",".join(
+                    _dump_json(self._get_result_document(doc))
+                    for doc in batch)
+                if not first:
+                    chunk = "," + chunk
+                first = False
+
+                self._write_buffer.append(tornado.escape.utf8(chunk))
+                yield tornado.gen.Task(self.flush)
+        except Exception, ex:
+            # The status has already been sent, the only way to signal the
+            # error is to drop the connection.
+            self.log.error("Error streaming the response")
+            self.log.exception(ex)
+            self.request.connection.stream.close()
+        else:
+            trailer = "]"
+            if response.keyset_sort and response.limit and \
+                    streamed == response.limit:
+                trailer += ',"next":' + _dump_json(
+                    handlers.common.query.get_after_token(
+                        last, response.keyset_sort))
+            self._write_buffer.append(tornado.escape.utf8(trailer + "}"))
+            self.finish()
+        finally:
+            cursor.close()
+
     def write_error(self, status_code, **kwargs):
         if kwargs.get("message", None):
             status_message = kwargs["message"]
@@ -198,6 +314,7 @@ class BaseHandler(tornado.web.RequestHandler):
         if valid_token:
             kwargs["token"] = token
             response = self._put(*args, **kwargs)
+            self._invalidate_cache(response)
         else:
             response = hresponse.HandlerResponse(403)
 
@@ -237,6 +354,7 @@ class BaseHandler(tornado.web.RequestHandler):
     @tornado.gen.coroutine
     def post(self, *args, **kwargs):
         future = yield self.executor.submit(self.execute_post, *args, **kwargs)
+        future = yield self._wait_task(future)
         self.write(future)
 
     def is_valid_json(self, json_obj, **kwargs):
@@ -265,6 +383,7 @@ class BaseHandler(tornado.web.RequestHandler):
 
                         response = self._post(*args, **kwargs)
                         response.errors = errors
+                        self._invalidate_cache(response)
                     else:
                         response = hresponse.HandlerResponse(400)
                         response.reason = "Provided JSON is not valid"
@@ -325,6 +444,7 @@ class BaseHandler(tornado.web.RequestHandler):
 
             if del_id:
                 response = self._delete(del_id, **kwargs)
+                self._invalidate_cache(response)
             else:
                 response = hresponse.HandlerResponse(400)
                 response.reason = "No ID value specified"
@@ -349,8 +469,15 @@ class BaseHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def get(self, *args, **kwargs):
-        future = yield self.executor.submit(self.execute_get, *args, **kwargs)
-        self.write(future)
+        if self._is_generic_get(kwargs):
+            future = yield self.execute_get_async(*args, **kwargs)
+        else:
+            future = yield self.executor.submit(
+                self.execute_get, *args, **kwargs)
+        if isinstance(future, hresponse.HandlerResponse) and future.stream:
+            yield self.write_stream(future)
+        else:
+            self.write(future)
 
     def execute_get(self, *args, **kwargs):
         """This is the actual GET operation.
@@ -374,6 +501,49 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return response
 
+    def _is_generic_get(self, kwargs):
+        """Check if a GET request is served by the generic implementation.
+
+        Only the generic implementation can be run with `execute_get_async`,
+        subclasses overriding it are run in the executor.
+
+        :param kwargs: The arguments of the request.
+        :type kwargs: dict
+        :return True or False.
+        """
+        names = ["execute_get", "_find_documents"]
+        names.append("_get_one" if kwargs.get("id", None) else "_get")
+        handler_class = type(self)
+
+        return all(
+            getattr(handler_class, name) == getattr(BaseHandler, name)
+            for name in names
+        )
+
+    @tornado.gen.coroutine
+    def execute_get_async(self, *args, **kwargs):
+        """Asynchronous version of `execute_get`.
+
+        The database operations are run by the database thread pool: the
+        IOLoop is not blocked and the executor is left to the other requests.
+        """
+        response = None
+        valid_token, token = yield utils.db.run_async(
+            self.validate_req_token, "GET")
+
+        if valid_token:
+            kwargs["token"] = token
+            get_id = kwargs.get("id", None)
+
+            if get_id:
+                response = yield self._get_one_async(get_id, **kwargs)
+            else:
+                response = yield self._get_async(**kwargs)
+        else:
+            response = hresponse.HandlerResponse(403)
+
+        raise tornado.gen.Return(response)
+
     def _get_one(self, doc_id, **kwargs):
         """Get just one single document from the collection.
 
@@ -410,6 +580,38 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return response
 
+    @tornado.gen.coroutine
+    def _get_one_async(self, doc_id, **kwargs):
+        """Asynchronous version of `_get_one`.
+
+        :return A `HandlerResponse` object.
+        """
+        response = hresponse.HandlerResponse()
+
+        try:
+            obj_id = bson.objectid.ObjectId(doc_id)
+        except bson.errors.InvalidId, ex:
+            self.log.exception(ex)
+            self.log.error("Provided doc ID '%s' is not valid", doc_id)
+            response.status_code = 400
+            response.reason = "Wrong ID value provided"
+            raise tornado.gen.Return(response)
+
+        result = yield utils.db.find_one2_async(
+            self.collection,
+            {models.ID_KEY: obj_id},
+            fields=handlers.common.query.get_query_fields(
+                self.get_query_arguments)
+        )
+
+        if result:
+            response.result = result
+        else:
+            response.status_code = 404
+            response.reason = "Resource '%s' not found" % doc_id
+
+        raise tornado.gen.Return(response)
+
     def _get(self, **kwargs):
         """Get all the documents in the collection.
 
@@ -420,41 +622,405 @@ class BaseHandler(tornado.web.RequestHandler):
         It should return a `HandlerResponse` object, with the `result`
         attribute set with the operation results.
 
+        :return A `HandlerResponse` object.
+        """
+        try:
+            query_args = self._get_find_query_args()
+        except ValueError, ex:
+            response = hresponse.HandlerResponse(400)
+            response.reason = str(ex)
+            return response
+
+        return self._get_cached(
+            self._get_collection_name(),
+            query_args,
+            kwargs.get("token"), self._find_documents, *query_args)
+
+    @tornado.gen.coroutine
+    def _get_async(self, **kwargs):
+        """Asynchronous version of `_get`.
+
+        :return A `HandlerResponse` object.
+        """
+        try:
+            query_args = self._get_find_query_args()
+        except ValueError, ex:
+            response = hresponse.HandlerResponse(400)
+            response.reason = str(ex)
+            raise tornado.gen.Return(response)
+
+        response = None
+        collection_name = self._get_collection_name()
+        cache = self._get_response_cache(collection_name)
+
+        if cache is not None:
+            key = self._get_cache_key(query_args, kwargs.get("token"))
+            response = yield utils.db.run_async(
+                cache.get, collection_name, key)
+
+        if response is None:
+            response = yield self._find_documents_async(*query_args)
+            if cache is not None and self._is_cacheable(response):
+                yield utils.db.run_async(
+                    cache.put, collection_name, key, response)
+
+        raise tornado.gen.Return(response)
+
+    def _get_find_query_args(self):
+        """Retrieve the arguments of `_find_documents` from the query string.
+
+        :return A tuple with the `_get_query_args` values, the count value and
+        the keyset pagination values.
+        """
+        after = handlers.common.query.get_after_value(self.get_query_arguments)
+        return self._get_query_args() + (
+            handlers.common.query.get_count_value(self.get_query_arguments),
+            after)
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-branches
+    def _find_documents(self, spec, sort, fields, skip, limit, aggregate,
+                        count=True, after=None):
+        """Find the documents in the collection matching the query values.
+
+        The returned count is the number of documents in the result.  The
+        counting strategy is chosen to avoid a second query when possible.
+
+        With keyset pagination, the documents are sorted by the requested
+        keys and their ID, and the page starts after the sort values in
+        `after`: its cost does not depend on how deep the page is.  The
+        response then carries the token of the next page, if the page is
+        full.
+
+        :param count: If the documents should be counted.
+        :type count: bool
+        :param after: The keyset pagination values, or None.
+        :type after: list
+        :return A `HandlerResponse` object.
+        """
+        response = hresponse.HandlerResponse()
+
+        # Aggregations are not recorded: their pipeline is not the find
+        # query the shape describes.
+        if aggregate:
+            response.result = [
+                self._get_result_document(doc)
+                for doc in utils.db.aggregate(
+                    self.collection,
+                    aggregate,
+                    match=spec,
+                    sort=sort,
+                    fields=fields,
+                    limit=limit,
+                    **self._get_aggregate_options()
+                )
+            ]
+        else:
+            try:
+                spec, sort, fields, strategy = self._get_find_values(
+                    spec, sort, fields, limit, count, after)
+            except ValueError, ex:
+                response.status_code = 400
+                response.reason = str(ex)
+                return response
+
+            self._record_query_shape(spec, sort)
+            result, count = utils.db.find_and_count(
+                self.collection,
+                limit,
+                skip,
+                spec=spec,
+                fields=fields,
+                sort=sort,
+                count=strategy
+            )
+            self._set_find_result(
+                response, result, count, skip, limit, after, sort)
+
+        response.limit = limit
+        return response
+
+    # pylint: disable=too-many-arguments
+    @tornado.gen.coroutine
+    def _find_documents_async(self, spec, sort, fields, skip, limit,
+                              aggregate, count=True, after=None):
+        """Asynchronous version of `_find_documents`.
+
+        Results that are not streamed are retrieved by the database thread
+        pool, so that they are not read from the cursor on the IOLoop.
+
         :return A `HandlerResponse` object.
         """
         response = hresponse.HandlerResponse()
-        spec, sort, fields, skip, limit, aggregate = self._get_query_args()
 
         if aggregate:
-            response.result = utils.db.aggregate(
+            result = yield utils.db.aggregate_async(
                 self.collection,
                 aggregate,
                 match=spec,
                 sort=sort,
                 fields=fields,
-                limit=limit
+                limit=limit,
+                **self._get_aggregate_options()
             )
+            response.result = [
+                self._get_result_document(doc) for doc in result]
         else:
-            result, count = utils.db.find_and_count(
+            try:
+                spec, sort, fields, strategy = self._get_find_values(
+                    spec, sort, fields, limit, count, after)
+            except ValueError, ex:
+                response.status_code = 400
+                response.reason = str(ex)
+                raise tornado.gen.Return(response)
+
+            self._record_query_shape(spec, sort, run_async=True)
+            result, count = yield utils.db.find_and_count_async(
                 self.collection,
                 limit,
                 skip,
                 spec=spec,
                 fields=fields,
-                sort=sort
+                sort=sort,
+                count=strategy,
+                prefetch=STREAM_MIN_RESULTS
             )
+            self._set_find_result(
+                response, result, count, skip, limit, after, sort)
 
-            if count > 0:
-                response.result = result
+        response.limit = limit
+        raise tornado.gen.Return(response)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _get_find_values(spec, sort, fields, limit, count, after):
+        """Get the query values and the count strategy of a find operation.
+
+        :return A tuple with the `spec`, `sort` and `fields` values and the
+        count strategy.
+        :raise ValueError if the keyset pagination values are not valid.
+        """
+        if after is not None:
+            sort = handlers.common.query.get_keyset_sort(sort)
+            spec = handlers.common.query.add_keyset_spec(spec, sort, after)
+
+            if isinstance(fields, types.ListType):
+                fields = fields + [key for key, _ in sort if key not in fields]
+
+        if not count:
+            strategy = utils.db.COUNT_NONE
+        elif 0 < limit <= STREAM_MIN_RESULTS:
+            strategy = utils.db.COUNT_PAGE
+        elif not spec:
+            strategy = utils.db.COUNT_ESTIMATED
+        else:
+            strategy = utils.db.COUNT_EXACT
+
+        return spec, sort, fields, strategy
+
+    # pylint: disable=too-many-arguments
+    def _set_find_result(self, response, result, count, skip, limit, after,
+                         sort):
+        """Set the result of a find operation in a response.
+
+        The documents of a result that is not streamed are converted with
+        `_get_result_document`, the streamed ones are converted while they
+        are written.
+
+        :param response: The response to update.
+        :type response: `HandlerResponse`
+        """
+        if count is None:
+            response.stream = not 0 < limit <= STREAM_MIN_RESULTS
+            response.result = result
+        elif count > 0:
+            response.stream = count > STREAM_MIN_RESULTS
+            response.result = result
+        else:
+            response.result = []
+
+        if not response.stream:
+            response.result = [
+                self._get_result_document(doc) for doc in response.result]
+
+        if after is not None and limit:
+            if response.stream:
+                response.keyset_sort = sort
+            elif len(response.result) == limit:
+                response.next_token = handlers.common.query.get_after_token(
+                    response.result[-1], sort)
+
+        response.skip = skip
+        response.count = count
+
+    def _get_result_document(self, document):
+        """Convert a document found by a GET request before it is sent.
+
+        Subclasses can override this method to change the documents returned
+        by the generic implementation, this one returns them unchanged.
+
+        :param document: The document as found in the database.
+        :type document: dict
+        :return The document to send.
+        """
+        return document
+
+    def _get_collection_name(self):
+        """The name of the collection of this handler, or None."""
+        collection = self.collection
+        return getattr(collection, "name", collection)
+
+    def _acquire_task(self):
+        """Reserve a place for a request waiting for a Celery task.
+
+        :return A 2-tuple: if the result should be waited for by the thread
+        running the request, or by the handler with the result waiter; None,
+        or a `HandlerResponse` object if too many requests are already
+        waiting.
+        """
+        waiter = self.result_waiter
+        if waiter is None:
+            return True, None
+
+        if not waiter.acquire():
+            response = hresponse.HandlerResponse(503)
+            response.reason = "Too many requests waiting for a task result"
+            return False, response
+
+        return False, None
+
+    @tornado.gen.coroutine
+    def _wait_task(self, response):
+        """Wait for the Celery task of a response without blocking a thread.
+
+        The place reserved with `_acquire_task` is released.
+
+        :param response: The response returned by the request.
+        :return The `HandlerResponse` object created from the task result,
+        or `response` if it is not waiting for a task.
+        """
+        if not isinstance(response, hresponse.HandlerResponse) or \
+                response.task is None:
+            raise tornado.gen.Return(response)
+
+        waiter = self.result_waiter
+        timeout = self.settings.get("task_result_timeout", None)
+
+        try:
+            ready = yield waiter.wait(response.task, timeout)
+            if ready:
+                value = yield utils.db.run_async(
+                    handlers.common.results.get_value, response.task)
+                response = response.task_callback(value)
             else:
-                response.result = []
+                response = hresponse.HandlerResponse(504)
+                response.reason = "Timed out waiting for the task result"
+        finally:
+            waiter.release()
+
+        raise tornado.gen.Return(response)
+
+    def _record_query_shape(self, spec, sort, run_async=False):
+        """Record the shape of a query on the handler collection.
+
+        :param spec: The query spec.
+        :type spec: dict
+        :param sort: The sort keys and directions.
+        :type sort: list
+        :param run_async: If the shape should be recorded in the database
+        thread pool, without waiting for it.
+        :type run_async: bool
+        """
+        recorder = self.query_shapes
+        collection = self.collection
+        if recorder is None or not hasattr(collection, "database"):
+            return
 
-            response.skip = skip
-            response.count = count
+        if run_async:
+            utils.db.run_async(recorder.record, collection, spec, sort)
+        else:
+            recorder.record(collection, spec, sort)
+
+    def _get_aggregate_options(self):
+        """The options of the aggregations on the handler collection.
+
+        :return A dictionary with the `indexes` of the collection and the
+        `allow_disk_use` setting.
+        """
+        return {
+            "indexes": handlers.dbindexes.INDEX_SPECS.get(
+                self._get_collection_name()),
+            "allow_disk_use": self.settings.get(
+                "aggregate_allow_disk_use", False),
+        }
+
+    def _get_cached(self, collection_name, query, token, func, *args):
+        """Get a response from the cache, or create it and cache it.
+
+        :param collection_name: The name of the collection the response is
+        based on.
+        :type collection_name: str
+        :param query: The normalized query values.
+        :param token: The token of the request.
+        :param func: The function that creates the response.
+        :type func: function
+        :param args: The arguments of `func`.
+        :return A `HandlerResponse` object.
+        """
+        cache = self._get_response_cache(collection_name)
+        if cache is None:
+            return func(*args)
+
+        key = self._get_cache_key(query, token)
+        response = cache.get(collection_name, key)
+        if response is None:
+            response = func(*args)
+            if self._is_cacheable(response):
+                cache.put(collection_name, key, response)
 
-        response.limit = limit
         return response
 
+    def _get_response_cache(self, collection_name):
+        """Get the cache of the GET responses based on a collection.
+
+        :param collection_name: The name of the collection.
+        :type collection_name: str
+        :return The `ResponseCache` object, or None if the responses are not
+        cached.
+        """
+        if not collection_name or collection_name in NOT_CACHED_COLLECTIONS:
+            return None
+        return self.response_cache
+
+    def _get_cache_key(self, query, token):
+        """Get the key of a response in the cache."""
+        return self.response_cache.get_key(
+            query, handlers.common.cache.get_scope(token))
+
+    @staticmethod
+    def _is_cacheable(response):
+        """Check if a response can be stored in the cache."""
+        return all([
+            response.status_code == 200,
+            not response.headers, not response.stream])
+
+    def _invalidate_cache(self, response, *collection_names):
+        """Drop the cached responses if the collection has been modified.
+
+        :param response: The response of the POST, PUT or DELETE operation.
+        :type response: `HandlerResponse`
+        :param collection_names: The names of the other collections modified
+        by the operation.
+        :type collection_names: list
+        """
+        cache = self.response_cache
+        if cache is not None and response.status_code in [200, 201, 202]:
+            collection_names = [
+                name for name in
+                (self._get_collection_name(),) + collection_names if name]
+            if collection_names:
+                cache.invalidate(*collection_names)
+
     def _get_query_args(self, method="GET"):
         """Retrieve all the arguments from the query string.
 
@@ -497,7 +1063,8 @@ class BaseHandler(tornado.web.RequestHandler):
                 method,
                 req_token,
                 remote_ip,
-                self._token_validation_func(), self.db, master_key=master_key
+                self._token_validation_func(), self.db, master_key=master_key,
+                cache=self.token_cache
             )
 
             if not valid_token:
@@ -22,11 +22,16 @@ try:
 except ImportError:
     import json
 
+import concurrent.futures
+import functools
+
 import handlers.base as hbase
 import handlers.common.request
+import handlers.common.results
 import handlers.response as hresponse
 import models
 import taskqueue.tasks.common as taskq
+import utils.batch.common
 import utils.validator as validator
 
 
@@ -63,11 +68,7 @@ class BatchHandler(hbase.BaseHandler):
                             json_obj,
                             models.BATCH_KEY,
                             self._valid_keys("POST")):
-                        response = hresponse.HandlerResponse(200)
-                        response.result = \
-                            self.prepare_and_perform_batch_ops(
-                                json_obj, self.settings["dboptions"]
-                            )
+                        response = self._perform_batch_ops(json_obj)
                     else:
                         response = hresponse.HandlerResponse(400)
                         response.reason = "Provided JSON is not valid"
@@ -84,18 +85,90 @@ class BatchHandler(hbase.BaseHandler):
 
         return response
 
-    @staticmethod
-    def prepare_and_perform_batch_ops(json_obj, db_options):
-        """Perform the operation defined in the JSON object.
+    def _perform_batch_ops(self, json_obj):
+        """Perform the batch operations, or start them.
 
-        The JSON oject must be a valid batch operations object.
+        The operations quick enough are run in the web process, in the
+        database thread pool.  The other ones are run with Celery, and are
+        published first so that both run at the same time: with the result
+        waiter, the returned response waits for their results, they are not
+        waited for in the executor.
 
         :param json_obj: The JSON object that defines all the bath operations
         to perform.
         :type json_obj: dict
-        :param db_options: The mongodb database connection parameters.
-        :type db_options: dict
+        :return A `HandlerResponse` object.
         """
-        return taskq.run_batch_group(
-            json_obj.get(models.BATCH_KEY), db_options
-        )
+        db_options = self.settings["dboptions"]
+        operations = json_obj.get(models.BATCH_KEY)
+        max_limit = self.settings.get("batch_in_process_limit", 0)
+
+        local = []
+        remote = []
+        for index, operation in enumerate(operations):
+            if max_limit > 0 and utils.batch.common.is_in_process_operation(
+                    operation, max_limit):
+                local.append(index)
+            else:
+                remote.append(index)
+
+        wait = True
+        remote_result = None
+        if remote:
+            wait, response = self._acquire_task()
+            if response is not None:
+                return response
+
+            try:
+                remote_result = taskq.apply_batch_group(
+                    [operations[index] for index in remote], db_options)
+            except Exception:
+                if not wait:
+                    self.result_waiter.release()
+                raise
+
+        try:
+            local_results = utils.batch.common.run_batch_operations(
+                [operations[index] for index in local],
+                db_options,
+                self.db,
+                timeout=self.settings.get("task_result_timeout", None))
+        except concurrent.futures.TimeoutError:
+            if not wait:
+                self.result_waiter.release()
+            response = hresponse.HandlerResponse(504)
+            response.reason = "Timed out running the batch operations"
+            return response
+
+        merge_results = functools.partial(
+            _get_batch_response, local, local_results, remote)
+        if not remote:
+            return merge_results([])
+
+        return handlers.common.results.get_task_response(
+            remote_result, merge_results, wait=wait)
+
+
+def _get_batch_response(local, local_results, remote, remote_results):
+    """Create the response of the batch operations.
+
+    :param local: The indexes of the operations run in the web process.
+    :type local: list
+    :param local_results: The results of the operations run in the web
+    process.
+    :type local_results: list
+    :param remote: The indexes of the operations run with Celery.
+    :type remote: list
+    :param remote_results: The results of the operations run with Celery.
+    :type remote_results: list
+    :return A `HandlerResponse` object, with the results in the order of
+    the operations.
+    """
+    results = [None] * (len(local) + len(remote))
+    for indexes, values in [(local, local_results), (remote, remote_results)]:
+        for index, value in zip(indexes, values):
+            results[index] = value
+
+    response = hresponse.HandlerResponse(200)
+    response.result = results
+    return response
@@ -21,10 +21,12 @@
 """The request handler for bisect URLs."""
 
 import bson
+import functools
 import tornado.gen
 
 import handlers.base as hbase
 import handlers.common.query
+import handlers.common.results
 import handlers.response as hresponse
 import models
 import taskqueue.tasks
@@ -42,6 +44,7 @@ class BisectHandler(hbase.BaseHandler):
     @tornado.gen.coroutine
     def get(self, *args, **kwargs):
         future = yield self.executor.submit(self.execute_get, *args, **kwargs)
+        future = yield self._wait_task(future)
         self.write(future)
 
     @property
@@ -166,6 +169,82 @@ class BisectHandler(hbase.BaseHandler):
 
         return response
 
+    def _bisect(self, id_key, spec, bisect_func, fields=None):
+        """Get the bisect data of a document, or calculate it.
+
+        The bisect data already calculated is searched in the bisect
+        collection, otherwise a bisect task is started.  With the result
+        waiter, the task result is not waited for in the executor.
+
+        :param id_key: The key of the document ID in the spec.
+        :type id_key: str
+        :param spec: The query spec.
+        :type spec: dict
+        :param bisect_func: The function starting the bisect task.
+        :type bisect_func: function
+        :param fields: A `fields` data structure with the fields to return or
+        exclude. Default to None.
+        :type fields: list or dict
+        :return A `HandlerResponse` object.
+        """
+        doc_id = spec.get(id_key, None)
+        if not doc_id:
+            response = hresponse.HandlerResponse(400)
+            response.reason = "Missing '%s' key" % id_key
+            return response
+
+        try:
+            spec[id_key] = bson.objectid.ObjectId(doc_id)
+        except (bson.errors.InvalidId, TypeError):
+            self.log.error("Wrong ID '%s' value passed as object ID", doc_id)
+            response = hresponse.HandlerResponse(400)
+            response.reason = "Wrong ID value passed as object ID"
+            return response
+
+        bisect_result = utils.db.find_one2(
+            self.db[self.collection], spec, fields=fields)
+        if bisect_result:
+            response = hresponse.HandlerResponse()
+            response.result = bisect_result
+            return response
+
+        wait, response = self._acquire_task()
+        if response is None:
+            try:
+                response = bisect_func(
+                    doc_id,
+                    self.settings["dboptions"],
+                    fields=fields,
+                    compare_to=spec.get(models.COMPARE_TO_KEY, None),
+                    wait=wait)
+            except Exception:
+                if not wait:
+                    self.result_waiter.release()
+                raise
+
+        return response
+
+
+def _get_bisect_response(not_found_reason, value):
+    """Create the response of a build bisect task.
+
+    :param not_found_reason: The reason of the response if the build is not
+    found.
+    :type not_found_reason: str
+    :param value: The status code and the result of the task.
+    :type value: tuple
+    :return A `HandlerResponse` object.
+    """
+    response = hresponse.HandlerResponse()
+
+    response.status_code, response.result = value
+    if response.status_code == 404:
+        response.reason = not_found_reason
+    elif response.status_code == 400:
+        response.reason = "Defconfig cannot be bisected: is it failed?"
+
+    return response
+
 
 def execute_build_bisect(doc_id, db_options, **kwargs):
     """Execute the build bisect operation.
@@ -177,39 +256,30 @@ def execute_build_bisect(doc_id, db_options, **kwargs):
     :param fields: A `fields` data structure with the fields to return or
     exclude. Default to None.
     :type fields: list or dict
+    :param wait: If the task result should be waited for, default to True.
+    Otherwise the returned response waits for it.
+    :type wait: bool
     :return A `HandlerResponse` object.
     """
-    response = hresponse.HandlerResponse()
-
     result = taskt.defconfig_bisect.apply_async(
         [doc_id, db_options, kwargs.get("fields", None)])
-    while not result.ready():
-        pass
 
-    response.status_code, response.result = result.get()
-    if response.status_code == 404:
-        response.reason = "Defconfig not found"
-    elif response.status_code == 400:
-        response.reason = "Defconfig cannot be bisected: is it failed?"
-
-    return response
+    return handlers.common.results.get_task_response(
+        result,
+        functools.partial(_get_bisect_response, "Defconfig not found"),
+        wait=kwargs.get("wait", True))
 
 
 def execute_build_bisect_compared_to(doc_id, db_options, **kwargs):
-    response = hresponse.HandlerResponse()
     compare_to = kwargs.get("compare_to", None)
     fields = kwargs.get("fields", None)
 
     result = taskt.defconfig_bisect_compared_to.apply_async(
         [doc_id, compare_to, db_options, fields])
-    while not result.ready():
-        pass
 
-    response.status_code, response.result = result.get()
-    if response.status_code == 404:
-        response.reason = (
-            "Defconfig bisection compared to '%s' not found" % compare_to)
-    elif response.status_code == 400:
-        response.reason = "Defconfig cannot be bisected: is it failed?"
-
-    return response
+    return handlers.common.results.get_task_response(
+        result,
+        functools.partial(
+            _get_bisect_response,
+            "Defconfig bisection compared to '%s' not found" % compare_to),
+        wait=kwargs.get("wait", True))
@@ -0,0 +1,206 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Cache the responses of the GET requests in Redis."""
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import bson.json_util
+import hashlib
+import redis
+import threading
+import time
+
+import handlers.response as hresponse
+import utils
+
+# Prefix of the Redis hashes holding the cached responses of a collection.
+RESPONSE_CACHE_PREFIX = "kernelci-response"
+
+
+def _collection_key(collection_name):
+    """Get the name of the Redis hash used for a collection."""
+    return "{:s}:{:s}".format(RESPONSE_CACHE_PREFIX, collection_name)
+
+
+def invalidate(redis_conn, *collection_names):
+    """Drop all the cached responses of some collections.
+
+    This has to be called every time the documents of a collection are
+    created, updated or deleted.
+
+    :param redis_conn: The Redis connection.
+    :param collection_names: The names of the collections.
+    :type collection_names: str
+    """
+    if redis_conn is None or not collection_names:
+        return
+
+    try:
+        redis_conn.delete(*[_collection_key(n) for n in collection_names])
+    except redis.exceptions.RedisError, ex:
+        utils.LOG.error(
+            "Error invalidating cached responses for %s",
+            ", ".join(collection_names))
+        utils.LOG.exception(ex)
+
+
+def get_scope(token):
+    """Get the scope of a token, used as part of the cache key.
+
+    :param token: The token of the request.
+    :type token: `models.token.Token`
+    :return The scope as a string.
+    """
+    properties = getattr(token, "properties", None)
+    if not properties:
+        return ""
+    return "".join(str(prop) for prop in properties)
+
+
+class ResponseCache(object):
+    """Cache of `HandlerResponse` objects stored in Redis.
+
+    Responses are grouped in one Redis hash per collection, so that all the
+    responses of a collection are invalidated at once when its documents
+    change.  Each response expires after `ttl` seconds.
+
+    The hits and misses are counted per process, and exported by the
+    /metrics handler.
+    """
+
+    def __init__(self, redis_conn, ttl=30):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis_conn
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(query, scope=""):
+        """Create the key of a response from the normalized query.
+
+        :param query: The query values, any structure that can be
+        serialized as JSON.
+        :param scope: The scope of the token used for the request.
+        :type scope: str
+        :return The key as a string.
+        """
+        data = json.dumps(
+            [query, scope],
+            default=bson.json_util.default,
+            separators=(",", ":"), sort_keys=True)
+        return hashlib.sha1(data).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_prometheus_text(self):
+        """Export the hit and miss counters.
+
+        :return The counters in the Prometheus text format.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        lines = []
+        for name, value, metric_help in [
+                ("hits", hits, "Number of GET responses found in the cache"),
+                ("misses", misses,
+                 "Number of GET responses not found in the cache")]:
+            metric = "kernelci_response_cache_{}_total".format(name)
+            lines.append("# HELP {} {}".format(metric, metric_help))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+
+        return "\n".join(lines) + "\n"
+
+    def get(self, collection_name, key):
+        """Get a cached response.
+
+        :param collection_name: The name of the collection.
+        :type collection_name: str
+        :param key: The key of the response.
+        :type key: str
+        :return A `HandlerResponse` object or None.
+        """
+        response = None
+        hash_key = _collection_key(collection_name)
+
+        try:
+            cached = self._redis.hget(hash_key, key)
+            if cached is not None:
+                cached = json.loads(
+                    cached, object_hook=bson.json_util.object_hook)
+                if cached["expires"] > time.time():
+                    response = hresponse.HandlerResponse(cached["code"])
+                    response.count = cached.get("count")
+                    response.limit = cached.get("limit")
+                    response.skip = cached.get("skip")
+                    response.result = cached.get("result")
+                    response.next_token = cached.get("next")
+                else:
+                    self._redis.hdel(hash_key, key)
+        except (redis.exceptions.RedisError, ValueError, KeyError), ex:
+            utils.LOG.error("Error reading cached response")
+            utils.LOG.exception(ex)
+            response = None
+
+        self._count(response is not None)
+        return response
+
+    def put(self, collection_name, key, response):
+        """Store a response in the cache.
+
+        :param collection_name: The name of the collection.
+        :type collection_name: str
+        :param key: The key of the response.
+        :type key: str
+        :param response: The response to store.
+        :type response: `HandlerResponse`
+        """
+        cached = response.to_dict()
+        cached["expires"] = time.time() + self.ttl
+        hash_key = _collection_key(collection_name)
+
+        try:
+            pipe = self._redis.pipeline()
+            pipe.hset(
+                hash_key,
+                key,
+                json.dumps(
+                    cached,
+                    default=bson.json_util.default, separators=(",", ":")))
+            pipe.expire(hash_key, self.ttl)
+            pipe.execute()
+        except (redis.exceptions.RedisError, TypeError), ex:
+            utils.LOG.error("Error storing cached response")
+            utils.LOG.exception(ex)
+
+    def invalidate(self, *collection_names):
+        """Drop all the cached responses of some collections.
+
+        :param collection_names: The names of the collections.
+        :type collection_names: str
+        """
+        invalidate(self._redis, *collection_names)
@@ -17,7 +17,9 @@
 
 """Handlers functions to work on query args."""
 
+import base64
 import bson
+import bson.json_util
 import datetime
 import pymongo
 import types
@@ -191,6 +193,22 @@ def get_aggregate_value(query_args_func):
     return aggregate
 
 
+def get_count_value(query_args_func):
+    """Get the value of the count key.
+
+    Clients can pass `count=false` to skip counting the results.
+
+    :param query_args_func: A function used to return a list of the query
+    arguments.
+    :type query_args_func: function
+    :return False if the results should not be counted, True otherwise.
+    """
+    count = query_args_func(models.COUNT_KEY)
+    if count and isinstance(count, types.ListType):
+        return count[-1].lower() not in ["false", "0", "no"]
+    return True
+
+
 def get_query_spec(query_args_func, valid_keys):
     """Get values from the query string to build a `spec` data structure.
 
@@ -531,6 +549,127 @@ def get_skip_and_limit(query_args_func):
     return skip, limit
 
 
+def get_after_value(query_args_func):
+    """Get the keyset pagination values from the `after` query argument.
+
+    An empty `after` argument requests the first page.
+
+    :param query_args_func: A function used to return a list of query
+    arguments.
+    :type query_args_func: function
+    :return None if keyset pagination is not requested, otherwise the list
+    of the sort values of the last document of the previous page (an empty
+    list for the first page).
+    :raise ValueError if the value is not a valid token.
+    """
+    after = query_args_func(models.AFTER_KEY)
+    if not after or not isinstance(after, types.ListType):
+        return None
+
+    token = after[-1]
+    if not token:
+        return []
+
+    try:
+        values = bson.json_util.loads(
+            base64.urlsafe_b64decode(token.encode("ascii")))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError("Invalid after value: %s" % token)
+
+    if not isinstance(values, types.ListType):
+        raise ValueError("Invalid after value: %s" % token)
+
+    return values
+
+
+def get_keyset_sort(sort):
+    """Make a sort data structure usable for keyset pagination.
+
+    The document ID is added as the last sort key, to have a strict order.
+
+    :param sort: The sort data structure.
+    :type sort: list
+    :return The new sort data structure.
+    """
+    sort = list(sort or [])
+    if models.ID_KEY not in [key for key, _ in sort]:
+        order = sort[-1][1] if sort else pymongo.ASCENDING
+        sort.append((models.ID_KEY, order))
+    return sort
+
+
+def add_keyset_spec(spec, sort, values):
+    """Add the conditions to get the documents after some sort values.
+
+    Null and missing values are sorted before all the others: the
+    conditions are written explicitly for them, as the comparison operators
+    only match values of the same type.
+
+    :param spec: The spec data structure.
+    :type spec: dict
+    :param sort: The keyset sort data structure.
+    :type sort: list
+    :param values: The sort values of the last document of a page.
+    :type values: list
+    :return The new spec data structure.
+    :raise ValueError if the values don't match the sort keys.
+    """
+    if not values:
+        return spec
+
+    if len(values) != len(sort):
+        raise ValueError("Invalid after value for this sort")
+
+    conditions = []
+    for idx, (key, order) in enumerate(sort):
+        value = values[idx]
+        condition = dict((sort[i][0], values[i]) for i in range(idx))
+        if order == pymongo.ASCENDING:
+            if value is None:
+                condition[key] = {"$ne": None}
+            else:
+                condition[key] = {"$gt": value}
+        elif value is None:
+            # Nothing is sorted after null in descending order.
+            continue
+        elif key == models.ID_KEY:
+            condition[key] = {"$lt": value}
+        else:
+            condition["$or"] = [{key: {"$lt": value}}, {key: None}]
+        conditions.append(condition)
+
+    if not conditions:
+        raise ValueError("Invalid after value for this sort")
+
+    keyset = {"$or": conditions}
+    if spec:
+        keyset = {"$and": [spec, keyset]}
+    return keyset
+
+
+def get_after_token(document, sort):
+    """Create the keyset pagination token of a document.
+
+    :param document: The last document of a page.
+    :type document: dict
+    :param sort: The keyset sort data structure.
+    :type sort: list
+    :return The token as a string.  The missing sort keys are stored as
+    null values, as they are sorted like them.
+    """
+    values = []
+    for key, _ in sort:
+        value = document
+        for part in key.split("."):
+            if not isinstance(value, types.DictionaryType):
+                value = None
+                break
+            value = value.get(part)
+        values.append(value)
+
+    return base64.urlsafe_b64encode(bson.json_util.dumps(values))
+
+
 def get_values(query_args_func, valid_keys):
     spec = get_query_spec(query_args_func, valid_keys)
 
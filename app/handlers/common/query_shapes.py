@@ -0,0 +1,331 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Record the shapes of the queries and suggest the indexes they need.
+
+The shape of a query is made of the keys of its spec, with the kind of
+condition on each key, and of its sort keys: the values are left out.  The
+number of queries of each shape is counted in Redis, and a sample of them is
+explained to count the ones scanning the whole collection or sorting the
+documents in memory, and which indexes are used.
+
+The report compares the recorded shapes with `handlers.dbindexes.INDEX_SPECS`
+to suggest the missing indexes and flag the unused ones.
+"""
+
+import bson.son
+import json
+import pymongo
+import pymongo.errors
+import random
+import redis
+import types
+
+import handlers.dbindexes
+import utils
+import utils.db
+
+# Prefix of the Redis hashes with the shape counters of a collection.
+QUERY_SHAPES_PREFIX = "kernelci-query-shapes"
+# Prefix of the Redis hashes with the index usage of a collection.
+INDEX_USAGE_PREFIX = "kernelci-index-usage"
+
+# The counters of a shape.
+QUERIES = "queries"
+SAMPLED = "sampled"
+COLLSCAN = "collscan"
+SORT = "in_memory_sort"
+
+# The kinds of conditions of a query spec.
+EQUAL = "eq"
+IN = "in"
+RANGE = "range"
+OTHER = "other"
+
+RANGE_OPERATORS = frozenset(["$gt", "$gte", "$lt", "$lte"])
+
+
+def _shapes_key(collection_name):
+    return "{:s}:{:s}".format(QUERY_SHAPES_PREFIX, collection_name)
+
+
+def _usage_key(collection_name):
+    return "{:s}:{:s}".format(INDEX_USAGE_PREFIX, collection_name)
+
+
+def _get_condition_kind(key, value):
+    """Get the kind of condition of a query spec key."""
+    if key.startswith("$"):
+        return OTHER
+    if not isinstance(value, types.DictionaryType):
+        return EQUAL
+    operators = set(value)
+    if operators == set(["$in"]):
+        return IN
+    if operators and operators <= RANGE_OPERATORS:
+        return RANGE
+    return OTHER
+
+
+def get_shape(spec, sort=None):
+    """Get the shape of a query.
+
+    :param spec: The query spec.
+    :type spec: dict
+    :param sort: The sort keys and directions.
+    :type sort: list
+    :return The shape as a string.
+    """
+    shape = {
+        "match": sorted(
+            [key, _get_condition_kind(key, value)]
+            for key, value in (spec or {}).iteritems()),
+        "sort": [[key, order] for key, order in sort or []],
+    }
+    return json.dumps(shape, separators=(",", ":"), sort_keys=True)
+
+
+def _get_plan_stages(plan):
+    """Get the stages of a query plan and the names of the indexes used.
+
+    :param plan: The query plan, or part of it.
+    :return A generator of (stage, index name) tuples.
+    """
+    if isinstance(plan, types.DictionaryType):
+        if "stage" in plan:
+            yield plan["stage"], plan.get("indexName")
+        for value in plan.itervalues():
+            for stage in _get_plan_stages(value):
+                yield stage
+    elif isinstance(plan, types.ListType):
+        for value in plan:
+            for stage in _get_plan_stages(value):
+                yield stage
+
+
+def explain(collection, spec, sort=None):
+    """Explain the plan of a query, without running it.
+
+    :param collection: The collection.
+    :type collection: `pymongo.collection.Collection`
+    :param spec: The query spec.
+    :type spec: dict
+    :param sort: The sort keys and directions.
+    :type sort: list
+    :return A 2-tuple: the set of the plan stages; the set of the names of
+    the indexes used.
+    """
+    command = bson.son.SON([("find", collection.name), ("filter", spec)])
+    if sort:
+        command["sort"] = bson.son.SON(sort)
+
+    result = collection.database.command(
+        "explain", command, verbosity="queryPlanner")
+    stages = list(_get_plan_stages(
+        result.get("queryPlanner", {}).get("winningPlan", {})))
+
+    return (
+        set(stage for stage, _ in stages),
+        set(index for _, index in stages if index))
+
+
+class QueryShapeRecorder(object):
+    """Count the queries by shape, and explain a sample of them.
+
+    :param redis_conn: The Redis connection.
+    :param sample_rate: The fraction of the queries to explain.
+    :type sample_rate: float
+    """
+
+    def __init__(self, redis_conn, sample_rate=0.01):
+        self.sample_rate = sample_rate
+        self._redis = redis_conn
+
+    def record(self, collection, spec, sort=None):
+        """Record a query.
+
+        :param collection: The collection.
+        :type collection: `pymongo.collection.Collection`
+        :param spec: The query spec.
+        :type spec: dict
+        :param sort: The sort keys and directions.
+        :type sort: list
+        """
+        shape = get_shape(spec, sort)
+        shapes_key = _shapes_key(collection.name)
+
+        try:
+            pipe = self._redis.pipeline()
+            pipe.hincrby(shapes_key, QUERIES + ":" + shape, 1)
+
+            if random.random() < self.sample_rate:
+                stages, indexes = explain(collection, spec or {}, sort)
+                pipe.hincrby(shapes_key, SAMPLED + ":" + shape, 1)
+                if "COLLSCAN" in stages:
+                    pipe.hincrby(shapes_key, COLLSCAN + ":" + shape, 1)
+                if "SORT" in stages:
+                    pipe.hincrby(shapes_key, SORT + ":" + shape, 1)
+                for index in indexes:
+                    pipe.hincrby(_usage_key(collection.name), index, 1)
+
+            pipe.execute()
+        except (redis.exceptions.RedisError, pymongo.errors.PyMongoError), ex:
+            utils.LOG.error("Error recording the query shape %s", shape)
+            utils.LOG.exception(ex)
+
+    def reset(self, collection_name):
+        """Drop the recorded shapes and index usage of a collection.
+
+        :param collection_name: The name of the collection.
+        :type collection_name: str
+        """
+        self._redis.delete(
+            _shapes_key(collection_name), _usage_key(collection_name))
+
+
+def get_shapes(redis_conn, collection_name):
+    """Get the recorded shapes of a collection.
+
+    :param redis_conn: The Redis connection.
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :return A list of dictionaries with the `match` and `sort` of the shape
+    and its counters, most frequent first.
+    """
+    shapes = {}
+    for field, value in redis_conn.hgetall(
+            _shapes_key(collection_name)).iteritems():
+        counter, shape = field.split(":", 1)
+        if shape not in shapes:
+            shapes[shape] = json.loads(shape)
+            shapes[shape].update(
+                (name, 0) for name in [QUERIES, SAMPLED, COLLSCAN, SORT])
+        shapes[shape][counter] = int(value)
+
+    return sorted(shapes.itervalues(), key=lambda shape: -shape[QUERIES])
+
+
+def get_index_usage(redis_conn, collection_name):
+    """Get how many sampled queries used each index of a collection.
+
+    :param redis_conn: The Redis connection.
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :return A dictionary with the index names as keys.
+    """
+    return dict(
+        (name, int(value))
+        for name, value in redis_conn.hgetall(
+            _usage_key(collection_name)).iteritems())
+
+
+def suggest_index(shape):
+    """Suggest an index for a query shape.
+
+    The keys matched by equality come first, then the sort keys and then
+    the keys matched with `$in` or with a range.
+
+    :param shape: The query shape, as returned by `get_shapes`.
+    :type shape: dict
+    :return The index as a list of (key, direction) tuples.
+    """
+    equal = [key for key, kind in shape["match"] if kind == EQUAL]
+    index = [(key, pymongo.ASCENDING) for key in equal]
+    index.extend(
+        (key, order) for key, order in shape["sort"] if key not in equal)
+    index.extend(
+        (key, pymongo.ASCENDING)
+        for key, kind in shape["match"] if kind in (IN, RANGE) and
+        key not in [index_key for index_key, _ in index])
+    return index
+
+
+def _has_index(shape, indexes):
+    """Check if one of the indexes serves a query shape.
+
+    The index must start with the keys matched by equality, in any order,
+    followed by the sort keys.  Without a sort, it must start with the keys
+    matched by equality, or with one of the other matched keys.
+    """
+    equal = set(key for key, kind in shape["match"] if kind == EQUAL)
+    sort = [(key, order) for key, order in shape["sort"] if key not in equal]
+    others = set(key for key, kind in shape["match"] if kind in (IN, RANGE))
+
+    for index in indexes:
+        keys = [key for key, _ in index]
+        if set(keys[:len(equal)]) != equal:
+            continue
+        rest = list(index[len(equal):])
+        if sort:
+            if utils.db.sort_uses_index(sort, None, [rest]):
+                return True
+        elif equal or (rest and rest[0][0] in others):
+            return True
+
+    return False
+
+
+def get_report(redis_conn, index_specs=None):
+    """Create the report of the missing and unused indexes.
+
+    An index is suggested for each shape that scanned the collection or
+    sorted the documents in memory, if there is no such index.  The indexes
+    of a collection are flagged as unused if the sampled queries of the
+    collection never used them, except the ones the application needs
+    anyway: see `handlers.dbindexes.is_required_index`.
+
+    :param redis_conn: The Redis connection.
+    :param index_specs: The indexes of each collection, defaults to
+    `handlers.dbindexes.INDEX_SPECS`.
+    :type index_specs: dict
+    :return A dictionary with the collection names as keys, and as values
+    dictionaries with the `shapes`, the `missing` and the `unused` indexes.
+    """
+    if index_specs is None:
+        index_specs = handlers.dbindexes.INDEX_SPECS
+
+    report = {}
+    for collection_name, indexes in sorted(index_specs.iteritems()):
+        shapes = get_shapes(redis_conn, collection_name)
+        if not shapes:
+            continue
+
+        missing = []
+        for shape in shapes:
+            if not shape[COLLSCAN] and not shape[SORT]:
+                continue
+            index = suggest_index(shape)
+            if index and index not in missing and \
+                    not _has_index(shape, indexes):
+                missing.append(index)
+
+        unused = []
+        if any(shape[SAMPLED] for shape in shapes):
+            usage = get_index_usage(redis_conn, collection_name)
+            unused = [
+                index for index in indexes
+                if not usage.get(handlers.dbindexes.get_index_name(index)) and
+                not handlers.dbindexes.is_required_index(
+                    collection_name, index)
+            ]
+
+        report[collection_name] = {
+            "shapes": shapes,
+            "missing": missing,
+            "unused": unused,
+        }
+
+    return report
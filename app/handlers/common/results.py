@@ -0,0 +1,282 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Wait for the results of Celery tasks without blocking a thread.
+
+The Redis result backend of Celery publishes the result of a task on the
+channel named after the task result key when it stores it.  A single thread
+subscribes to the channels of the tasks being waited for, and resolves the
+Tornado futures of the requests on the IOLoop when all their results are
+stored.
+"""
+
+import Queue
+import threading
+import time
+
+import redis
+import tornado.concurrent
+import tornado.ioloop
+
+import handlers.response as hresponse
+import utils
+
+# How long the listening thread waits for a command when idle, in seconds.
+POLL_INTERVAL = 1
+# How long the listening thread waits for a message, in seconds: new
+# subscriptions are made in between.
+MESSAGE_TIMEOUT = 0.05
+
+
+def get_value(result):
+    """Get the value of a Celery result, or of a group of results.
+
+    :param result: The Celery result.
+    :type result: `celery.result.AsyncResult` or `celery.result.ResultSet`
+    :return The value of the result, or the list of values of a group.
+    """
+    join_native = getattr(result, "join_native", None)
+    if join_native is not None:
+        return join_native()
+    return result.get()
+
+
+def get_task_response(result, callback, wait=True):
+    """Create the response of a request waiting for a Celery task.
+
+    :param result: The Celery result of the task.
+    :param callback: The function creating the response from the value of
+    the result.
+    :type callback: function
+    :param wait: If the result should be waited for now, blocking the thread,
+    or by the handler with a `ResultWaiter`.
+    :type wait: bool
+    :return A `HandlerResponse` object.
+    """
+    if wait:
+        return callback(get_value(result))
+
+    response = hresponse.HandlerResponse()
+    response.task = result
+    response.task_callback = callback
+    return response
+
+
+def _get_task_ids(result):
+    """Get the IDs of the tasks of a result, or of a group of results."""
+    results = getattr(result, "results", None)
+    if results is None:
+        return [result.id]
+    return [child.id for child in results]
+
+
+class _Waiting(object):
+    """A request waiting for some results."""
+
+    def __init__(self, keys, io_loop):
+        self.keys = set(keys)
+        self.io_loop = io_loop
+        self.future = tornado.concurrent.Future()
+        self.timeout = None
+
+
+class ResultWaiter(object):
+    """Wait for Celery results stored in a Redis result backend.
+
+    The number of requests waiting at the same time is limited by
+    `max_in_flight`: the handlers must call `acquire` before starting a
+    task, and `release` when they are done with its result.
+
+    :param redis_conn: The Redis connection of the result backend.
+    :param get_key: The function returning the key of a task result from
+    the task ID.
+    :type get_key: function
+    :param max_in_flight: The maximum number of requests waiting.
+    :type max_in_flight: int
+    """
+
+    def __init__(self, redis_conn, get_key, max_in_flight=50):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._get_key = get_key
+        self._redis = redis_conn
+        self._lock = threading.Lock()
+        self._commands = Queue.Queue()
+        self._waiting = {}
+        self._thread = None
+
+    def acquire(self):
+        """Reserve a place for a request waiting for a result.
+
+        :return True if the request can start its task, False if too many
+        requests are already waiting.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        """Release the place reserved with `acquire`."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def wait(self, result, timeout=None):
+        """Wait for a Celery result, or for a group of results.
+
+        This must be called from the IOLoop thread.
+
+        :param result: The Celery result.
+        :type result: `celery.result.AsyncResult` or `celery.result.ResultSet`
+        :param timeout: How long to wait, in seconds.
+        :type timeout: int
+        :return A future resolved with True when the results are stored, or
+        with False if the timeout expires first.
+        """
+        keys = [self._get_key(task_id) for task_id in _get_task_ids(result)]
+        waiting = _Waiting(keys, tornado.ioloop.IOLoop.current())
+
+        if timeout:
+            waiting.timeout = waiting.io_loop.add_timeout(
+                time.time() + timeout, lambda: self._expire(waiting))
+
+        with self._lock:
+            for key in keys:
+                self._waiting.setdefault(key, set()).add(waiting)
+            self._start()
+
+        self._commands.put(("subscribe", keys))
+        return waiting.future
+
+    def close(self):
+        """Stop the listening thread.
+
+        The requests still waiting are resolved when their timeout expires.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._commands.put(("stop", None))
+            thread.join()
+
+    def _start(self):
+        """Start the listening thread, with the lock held."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="ResultWaiter")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _resolve(self, waiting, ready):
+        """Resolve the future of a request, on its IOLoop."""
+        if waiting.timeout is not None:
+            waiting.io_loop.remove_timeout(waiting.timeout)
+        if not waiting.future.done():
+            waiting.future.set_result(ready)
+
+    def _expire(self, waiting):
+        """Stop waiting for the results of a request."""
+        done = []
+        with self._lock:
+            for key in waiting.keys:
+                waiters = self._waiting.get(key)
+                if waiters is not None:
+                    waiters.discard(waiting)
+                    if not waiters:
+                        del self._waiting[key]
+                        done.append(key)
+
+        if done:
+            self._commands.put(("unsubscribe", done))
+        waiting.timeout = None
+        self._resolve(waiting, False)
+
+    def _set_ready(self, key):
+        """Mark a result as stored.
+
+        :return True if the result was waited for, and its channel can be
+        unsubscribed from.
+        """
+        with self._lock:
+            waiters = self._waiting.pop(key, None)
+            for waiting in waiters or []:
+                waiting.keys.discard(key)
+                if not waiting.keys:
+                    waiting.io_loop.add_callback(
+                        self._resolve, waiting, True)
+        return waiters is not None
+
+    def _run_commands(self, pubsub, block):
+        """Subscribe to and unsubscribe from the result channels.
+
+        The results stored before the subscription are looked for once
+        subscribed.
+
+        :return False if the thread has to stop.
+        """
+        commands = []
+        try:
+            commands.append(self._commands.get(block, POLL_INTERVAL))
+            while True:
+                commands.append(self._commands.get_nowait())
+        except Queue.Empty:
+            pass
+
+        for command, keys in commands:
+            if command == "subscribe":
+                with self._lock:
+                    keys = [key for key in keys if key in self._waiting]
+                if keys:
+                    pubsub.subscribe(*keys)
+                    for key in keys:
+                        if self._redis.exists(key):
+                            self._set_ready(key)
+                            pubsub.unsubscribe(key)
+            elif command == "unsubscribe":
+                pubsub.unsubscribe(*keys)
+            else:
+                return False
+
+        return True
+
+    def _run(self):
+        """Listen to the result channels."""
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+
+        while True:
+            try:
+                if not self._run_commands(
+                        pubsub, block=not pubsub.subscribed):
+                    pubsub.close()
+                    break
+
+                if pubsub.subscribed:
+                    message = pubsub.get_message(timeout=MESSAGE_TIMEOUT)
+                    if message and message["type"] == "message" and \
+                            self._set_ready(message["channel"]):
+                        pubsub.unsubscribe(message["channel"])
+            except redis.exceptions.RedisError, ex:
+                utils.LOG.error("Error waiting for the task results")
+                utils.LOG.exception(ex)
+
+                pubsub.reset()
+                time.sleep(POLL_INTERVAL)
+                with self._lock:
+                    keys = self._waiting.keys()
+                if keys:
+                    self._commands.put(("subscribe", keys))
@@ -0,0 +1,119 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import bson
+import datetime
+import fakeredis
+import logging
+import mock
+import unittest
+
+import handlers.common.cache as hcache
+import handlers.response as hresponse
+import models.token as mtoken
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        logging.disable(logging.CRITICAL)
+        self.redisdb = fakeredis.FakeStrictRedis()
+        self.cache = hcache.ResponseCache(self.redisdb, ttl=30)
+
+    def tearDown(self):
+        super(TestResponseCache, self).tearDown()
+        logging.disable(logging.NOTSET)
+        self.redisdb.flushall()
+
+    def _response(self):
+        response = hresponse.HandlerResponse()
+        response.result = [{
+            "_id": bson.objectid.ObjectId("5c4b1ea1b2d5d0b43a0f6f7a"),
+            "created_on": datetime.datetime(
+                2019, 1, 25, 13, 10, tzinfo=bson.tz_util.utc),
+            "job": "mainline"
+        }]
+        response.count = 1
+        response.limit = 10
+        response.skip = 0
+        return response
+
+    def test_get_key(self):
+        key = self.cache.get_key([{"job": "a", "kernel": "b"}, None, 0])
+        self.assertEqual(
+            key, self.cache.get_key([{"kernel": "b", "job": "a"}, None, 0]))
+        self.assertNotEqual(
+            key, self.cache.get_key([{"job": "a", "kernel": "c"}, None, 0]))
+        self.assertNotEqual(
+            key,
+            self.cache.get_key(
+                [{"job": "a", "kernel": "b"}, None, 0], scope="0010"))
+
+    def test_get_scope(self):
+        token = mtoken.Token()
+        token.is_get_token = True
+
+        self.assertEqual("", hcache.get_scope(None))
+        self.assertEqual("0010000000000000", hcache.get_scope(token))
+
+    def test_get_miss(self):
+        self.assertIsNone(self.cache.get("job", "key"))
+        self.assertEqual(0, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_put_get(self):
+        response = self._response()
+        self.cache.put("job", "key", response)
+
+        cached = self.cache.get("job", "key")
+        self.assertIsInstance(cached, hresponse.HandlerResponse)
+        self.assertDictEqual(response.to_dict(), cached.to_dict())
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(0, self.cache.misses)
+        self.assertIsNone(self.cache.get("build", "key"))
+
+    def test_put_get_next_token(self):
+        response = self._response()
+        response.next_token = "next-page"
+        self.cache.put("job", "key", response)
+
+        self.assertEqual("next-page", self.cache.get("job", "key").next_token)
+
+    def test_get_expired(self):
+        self.cache.put("job", "key", self._response())
+
+        with mock.patch("time.time") as mock_time:
+            mock_time.return_value = 2 ** 40
+            self.assertIsNone(self.cache.get("job", "key"))
+
+        self.assertIsNone(self.redisdb.hget("kernelci-response:job", "key"))
+
+    def test_invalidate(self):
+        self.cache.put("job", "key", self._response())
+        self.cache.put("build", "key", self._response())
+
+        self.cache.invalidate("job")
+
+        self.assertIsNone(self.cache.get("job", "key"))
+        self.assertIsNotNone(self.cache.get("build", "key"))
+
+    def test_invalidate_redis_error(self):
+        redis_conn = mock.MagicMock()
+        redis_conn.delete.side_effect = hcache.redis.exceptions.RedisError
+
+        hcache.invalidate(redis_conn, "job")
+        redis_conn.delete.assert_called_once_with("kernelci-response:job")
@@ -30,13 +30,18 @@ from bson import (
 from handlers.common.query import (
     _valid_value,
     add_created_on_date,
+    add_keyset_spec,
     calculate_date_range,
+    get_after_token,
+    get_after_value,
     get_aggregate_value,
     get_all_query_values,
     get_and_add_date_range,
     get_and_add_gte_lt_keys,
     get_and_add_time_range,
+    get_count_value,
     get_created_on_date,
+    get_keyset_sort,
     get_query_fields,
     get_query_sort,
     get_query_spec,
@@ -287,6 +292,93 @@ class TestCommonQuery(unittest.TestCase):
         self.assertEqual({}, get_query_spec(query_args_func, ()))
         self.assertEqual({}, get_query_spec(query_args_func, ""))
 
+    def test_get_keyset_sort(self):
+        self.assertEqual([("_id", 1)], get_keyset_sort(None))
+        self.assertEqual(
+            [("created_on", -1), ("_id", -1)],
+            get_keyset_sort([("created_on", -1)]))
+        self.assertEqual(
+            [("_id", 1), ("name", -1)],
+            get_keyset_sort([("_id", 1), ("name", -1)]))
+
+    def test_add_keyset_spec(self):
+        sort = [("created_on", -1), ("_id", -1)]
+
+        self.assertEqual(
+            {"job": "job"}, add_keyset_spec({"job": "job"}, sort, []))
+        self.assertEqual(
+            {
+                "$and": [
+                    {"job": "job"},
+                    {
+                        "$or": [
+                            {
+                                "$or": [
+                                    {"created_on": {"$lt": 2}},
+                                    {"created_on": None}
+                                ]
+                            },
+                            {"created_on": 2, "_id": {"$lt": "id"}}
+                        ]
+                    }
+                ]
+            },
+            add_keyset_spec({"job": "job"}, sort, [2, "id"]))
+        self.assertEqual(
+            {"$or": [{"_id": {"$gt": "id"}}]},
+            add_keyset_spec({}, [("_id", 1)], ["id"]))
+        self.assertRaises(ValueError, add_keyset_spec, {}, sort, ["id"])
+        self.assertRaises(
+            ValueError, add_keyset_spec, {}, sort, [None, None])
+
+    def test_add_keyset_spec_null(self):
+        self.assertEqual(
+            {
+                "$or": [
+                    {"created_on": {"$ne": None}},
+                    {"created_on": None, "_id": {"$gt": "id"}}
+                ]
+            },
+            add_keyset_spec(
+                {}, [("created_on", 1), ("_id", 1)], [None, "id"]))
+        self.assertEqual(
+            {"$or": [{"created_on": None, "_id": {"$lt": "id"}}]},
+            add_keyset_spec(
+                {}, [("created_on", -1), ("_id", -1)], [None, "id"]))
+
+    def test_get_after_token_value(self):
+        created_on = datetime.datetime(2019, 3, 1, 10, 0, tzinfo=tz_util.utc)
+        doc = {"_id": "id", "created_on": created_on, "data": {"name": "a"}}
+        sort = [("created_on", -1), ("data.name", -1), ("_id", -1)]
+
+        token = get_after_token(doc, sort)
+        self.assertEqual(
+            [created_on, "a", "id"], get_after_value(lambda key: [token]))
+
+        token = get_after_token(doc, [("job", -1), ("data.name.x", -1)])
+        self.assertEqual([None, None], get_after_value(lambda key: [token]))
+
+    def test_get_after_value_not_valid(self):
+        self.assertIsNone(get_after_value(lambda key: []))
+        self.assertEqual([], get_after_value(lambda key: [""]))
+        self.assertRaises(
+            ValueError, get_after_value, lambda key: ["not-a-token"])
+        self.assertRaises(
+            ValueError, get_after_value, lambda key: ["e30="])
+
+    def test_get_count_value(self):
+        def query_args_func(key):
+            args = {
+                "count": ["true", "false"]
+            }
+            return args.get(key, [])
+
+        self.assertFalse(get_count_value(query_args_func))
+        self.assertTrue(get_count_value(lambda key: []))
+        self.assertTrue(get_count_value(lambda key: ["1"]))
+        self.assertFalse(get_count_value(lambda key: ["0"]))
+        self.assertFalse(get_count_value(lambda key: ["False"]))
+
     def test_get_query_fields_valid_only_field(self):
         def query_args_func(key):
             args = {
@@ -0,0 +1,198 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import fakeredis
+import json
+import logging
+import mock
+import pymongo.errors
+import unittest
+
+import handlers.common.query_shapes as hquery_shapes
+
+COLLSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "SORT",
+            "inputStage": {"stage": "COLLSCAN"},
+        },
+    },
+}
+
+IXSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "FETCH",
+            "inputStage": {"stage": "IXSCAN", "indexName": "job_1"},
+        },
+    },
+}
+
+INDEX_SPECS = {
+    "job": [
+        [("created_on", -1)],
+        [("job", 1)],
+        [("kernel", 1)],
+    ],
+}
+
+
+class TestQueryShapes(unittest.TestCase):
+
+    def setUp(self):
+        super(TestQueryShapes, self).setUp()
+        logging.disable(logging.CRITICAL)
+        self.redisdb = fakeredis.FakeStrictRedis()
+        self.recorder = hquery_shapes.QueryShapeRecorder(
+            self.redisdb, sample_rate=1)
+        self.collection = mock.MagicMock()
+        self.collection.name = "job"
+
+    def tearDown(self):
+        super(TestQueryShapes, self).tearDown()
+        logging.disable(logging.NOTSET)
+        self.redisdb.flushall()
+
+    def test_get_shape(self):
+        shape = hquery_shapes.get_shape(
+            {
+                "job": "mainline",
+                "kernel": {"$in": ["v1", "v2"]},
+                "created_on": {"$gte": 1, "$lt": 2},
+                "$or": [{"status": "PASS"}],
+            },
+            [("created_on", -1)])
+
+        self.assertDictEqual(
+            {
+                "match": [
+                    ["$or", "other"],
+                    ["created_on", "range"],
+                    ["job", "eq"],
+                    ["kernel", "in"],
+                ],
+                "sort": [["created_on", -1]],
+            },
+            json.loads(shape))
+        self.assertEqual(
+            shape,
+            hquery_shapes.get_shape(
+                {
+                    "$or": [],
+                    "created_on": {"$lt": 5},
+                    "kernel": {"$in": []},
+                    "job": "next",
+                },
+                [("created_on", -1)]))
+
+    def test_record(self):
+        self.collection.database.command.return_value = COLLSCAN_PLAN
+        self.recorder.record(
+            self.collection, {"kernel": "v1"}, [("created_on", 1)])
+        self.recorder.record(
+            self.collection, {"kernel": "v2"}, [("created_on", 1)])
+
+        self.collection.database.command.assert_called_with(
+            "explain", mock.ANY, verbosity="queryPlanner")
+        shapes = hquery_shapes.get_shapes(self.redisdb, "job")
+        self.assertEqual(1, len(shapes))
+        self.assertEqual(2, shapes[0]["queries"])
+        self.assertEqual(2, shapes[0]["sampled"])
+        self.assertEqual(2, shapes[0]["collscan"])
+        self.assertEqual(2, shapes[0]["in_memory_sort"])
+
+    def test_record_not_sampled(self):
+        self.recorder.sample_rate = 0
+        self.recorder.record(self.collection, {"job": "mainline"})
+
+        self.assertFalse(self.collection.database.command.called)
+        shapes = hquery_shapes.get_shapes(self.redisdb, "job")
+        self.assertEqual(1, shapes[0]["queries"])
+        self.assertEqual(0, shapes[0]["sampled"])
+
+    def test_record_explain_error(self):
+        self.collection.database.command.side_effect = \
+            pymongo.errors.OperationFailure("explain")
+        self.recorder.record(self.collection, {"job": "mainline"})
+
+        self.assertListEqual(
+            [], hquery_shapes.get_shapes(self.redisdb, "job"))
+
+    def test_suggest_index(self):
+        shape = {
+            "match": [
+                ["created_on", "range"],
+                ["job", "eq"],
+                ["kernel", "in"],
+                ["status", "eq"],
+            ],
+            "sort": [["created_on", -1], ["job", 1]],
+        }
+
+        self.assertListEqual(
+            [
+                ("job", 1),
+                ("status", 1),
+                ("created_on", -1),
+                ("kernel", 1),
+            ],
+            hquery_shapes.suggest_index(shape))
+
+    def test_get_report(self):
+        self.collection.database.command.return_value = IXSCAN_PLAN
+        self.recorder.record(self.collection, {"job": "mainline"})
+        self.recorder.record(
+            self.collection, {"job": "mainline"}, [("created_on", -1)])
+
+        self.collection.database.command.return_value = COLLSCAN_PLAN
+        self.recorder.record(
+            self.collection, {"kernel": "v1"}, [("created_on", 1)])
+        self.recorder.record(self.collection, {"status": "PASS"})
+
+        report = hquery_shapes.get_report(self.redisdb, INDEX_SPECS)
+
+        self.assertListEqual(["job"], report.keys())
+        self.assertEqual(4, len(report["job"]["shapes"]))
+        self.assertListEqual(
+            [
+                [("kernel", 1), ("created_on", 1)],
+                [("status", 1)],
+            ],
+            sorted(report["job"]["missing"]))
+        self.assertListEqual(
+            [[("created_on", -1)], [("kernel", 1)]],
+            report["job"]["unused"])
+
+    def test_get_report_required_indexes(self):
+        self.collection.database.command.return_value = COLLSCAN_PLAN
+        for name in ["bisect", "errors_summary", "counter"]:
+            self.collection.name = name
+            self.recorder.record(self.collection, {"status": "PASS"})
+
+        report = hquery_shapes.get_report(self.redisdb)
+
+        # TTL index.
+        self.assertListEqual(
+            [[("name", -1)]], report["bisect"]["unused"])
+        # Unique index used by the upserts, and counters rebuild index.
+        self.assertListEqual([], report["errors_summary"]["unused"])
+        self.assertListEqual([], report["counter"]["unused"])
+
+    def test_reset(self):
+        self.recorder.record(self.collection, {"job": "mainline"})
+        self.recorder.reset("job")
+
+        self.assertDictEqual({}, hquery_shapes.get_report(self.redisdb))
@@ -0,0 +1,132 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import fakeredis
+import logging
+import mock
+import threading
+import time
+import tornado.testing
+
+import handlers.common.results as hresults
+import handlers.response as hresponse
+
+
+def _get_key(task_id):
+    return "celery-task-meta-" + task_id
+
+
+def _task_result(task_id):
+    result = mock.MagicMock(spec=["id", "get"])
+    result.id = task_id
+    return result
+
+
+class TestResultWaiter(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestResultWaiter, self).setUp()
+        logging.disable(logging.CRITICAL)
+        self.redisdb = fakeredis.FakeStrictRedis()
+        self.waiter = hresults.ResultWaiter(
+            self.redisdb, _get_key, max_in_flight=2)
+
+    def tearDown(self):
+        super(TestResultWaiter, self).tearDown()
+        logging.disable(logging.NOTSET)
+        self.waiter.close()
+        self.redisdb.flushall()
+
+    def _store_later(self, task_id, delay=0.2):
+        """Store a task result like the Celery Redis backend does."""
+        def store():
+            time.sleep(delay)
+            self.redisdb.set(_get_key(task_id), "{}")
+            self.redisdb.publish(_get_key(task_id), "{}")
+
+        thread = threading.Thread(target=store)
+        thread.daemon = True
+        thread.start()
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_wait_stored(self):
+        self.redisdb.set(_get_key("a"), "{}")
+
+        ready = yield self.waiter.wait(_task_result("a"), timeout=5)
+        self.assertTrue(ready)
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_wait_published(self):
+        self._store_later("b")
+
+        ready = yield self.waiter.wait(_task_result("b"), timeout=5)
+        self.assertTrue(ready)
+        self.assertDictEqual({}, self.waiter._waiting)
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_wait_group(self):
+        group = mock.MagicMock()
+        group.results = [_task_result("c"), _task_result("d")]
+        self.redisdb.set(_get_key("c"), "{}")
+        self._store_later("d")
+
+        ready = yield self.waiter.wait(group, timeout=5)
+        self.assertTrue(ready)
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_wait_timeout(self):
+        ready = yield self.waiter.wait(_task_result("e"), timeout=0.2)
+        self.assertFalse(ready)
+        self.assertDictEqual({}, self.waiter._waiting)
+
+    def test_acquire_release(self):
+        self.assertTrue(self.waiter.acquire())
+        self.assertTrue(self.waiter.acquire())
+        self.assertFalse(self.waiter.acquire())
+
+        self.waiter.release()
+        self.assertEqual(1, self.waiter.in_flight)
+        self.assertTrue(self.waiter.acquire())
+
+
+class TestTaskResponse(tornado.testing.AsyncTestCase):
+
+    def test_get_value(self):
+        result = _task_result("a")
+        result.get.return_value = (200, [])
+        self.assertEqual((200, []), hresults.get_value(result))
+
+        group = mock.MagicMock()
+        group.join_native.return_value = [1, 2]
+        self.assertEqual([1, 2], hresults.get_value(group))
+
+    def test_get_task_response(self):
+        def callback(value):
+            response = hresponse.HandlerResponse(201)
+            response.result = value
+            return response
+
+        result = _task_result("a")
+        result.get.return_value = {"foo": "bar"}
+
+        response = hresults.get_task_response(result, callback)
+        self.assertEqual(201, response.status_code)
+        self.assertListEqual([{"foo": "bar"}], response.result)
+
+        response = hresults.get_task_response(result, callback, wait=False)
+        self.assertIs(result, response.task)
+        self.assertIs(callback, response.task_callback)
+        self.assertIsNone(response.result)
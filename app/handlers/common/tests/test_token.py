@@ -317,3 +317,104 @@ class TestCommonToken(unittest.TestCase):
 
         self.assertFalse(handlers.common.token.validate_token(
             token, "GET", None, validate_func)[0])
+
+    def test_token_cache_get_put(self):
+        cache = handlers.common.token.TokenCache(max_size=2, ttl=60)
+
+        self.assertIsNone(cache.get("foo"))
+        cache.put("foo", self.token)
+
+        self.assertIs(cache.get("foo"), self.token)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_token_cache_lru_eviction(self):
+        cache = handlers.common.token.TokenCache(max_size=2, ttl=60)
+
+        cache.put("foo", mtoken.Token())
+        cache.put("bar", mtoken.Token())
+        # Use "foo" so that "bar" becomes the least recently used.
+        cache.get("foo")
+        cache.put("baz", mtoken.Token())
+
+        self.assertEqual(2, len(cache))
+        self.assertIsNotNone(cache.get("foo"))
+        self.assertIsNone(cache.get("bar"))
+        self.assertIsNotNone(cache.get("baz"))
+
+    @mock.patch("time.time")
+    def test_token_cache_ttl(self, mock_time):
+        cache = handlers.common.token.TokenCache(ttl=10)
+
+        mock_time.return_value = 100
+        cache.put("foo", self.token)
+        mock_time.return_value = 105
+        self.assertIs(cache.get("foo"), self.token)
+        mock_time.return_value = 111
+        self.assertIsNone(cache.get("foo"))
+        self.assertEqual(0, len(cache))
+
+    def test_token_cache_invalidate(self):
+        redis_conn = mock.Mock()
+        cache = handlers.common.token.TokenCache(redis_conn=redis_conn)
+
+        cache.put("foo", self.token)
+        cache.put("bar", mtoken.Token())
+        cache.invalidate("foo")
+
+        self.assertIsNone(cache.get("foo"))
+        self.assertIsNotNone(cache.get("bar"))
+        redis_conn.publish.assert_called_once_with(
+            handlers.common.token.TOKEN_CACHE_CHANNEL, "foo")
+
+        cache.invalidate()
+        self.assertEqual(0, len(cache))
+        redis_conn.publish.assert_called_with(
+            handlers.common.token.TOKEN_CACHE_CHANNEL,
+            handlers.common.token.TOKEN_CACHE_FLUSH)
+
+    def test_token_cache_handle_message(self):
+        redis_conn = mock.Mock()
+        cache = handlers.common.token.TokenCache(redis_conn=redis_conn)
+
+        cache.put("foo", self.token)
+        cache.put("bar", mtoken.Token())
+        cache._handle_message({"data": "foo"})
+
+        self.assertIsNone(cache.get("foo"))
+        self.assertIsNotNone(cache.get("bar"))
+        self.assertFalse(redis_conn.publish.called)
+
+        cache._handle_message(
+            {"data": handlers.common.token.TOKEN_CACHE_FLUSH})
+        self.assertEqual(0, len(cache))
+
+    @mock.patch("handlers.common.token.find_token")
+    def test_token_validation_with_cache(self, mock_find_token):
+        cache = handlers.common.token.TokenCache()
+        mock_find_token.return_value = {
+            "_id": "id", "email": "foo@example.net", "token": "foo"}
+        validate_func = mock.Mock()
+        validate_func.return_value = True
+
+        valid, token = handlers.common.token.token_validation(
+            "GET", "foo", None, validate_func, None, cache=cache)
+        self.assertTrue(valid)
+        self.assertIs(cache.get("foo"), token)
+
+        valid, cached = handlers.common.token.token_validation(
+            "GET", "foo", None, validate_func, None, cache=cache)
+        self.assertTrue(valid)
+        self.assertIs(token, cached)
+        mock_find_token.assert_called_once_with(None, {"token": "foo"})
+
+    @mock.patch("handlers.common.token.find_token")
+    def test_token_validation_with_cache_not_found(self, mock_find_token):
+        cache = handlers.common.token.TokenCache()
+        mock_find_token.return_value = None
+
+        valid, token = handlers.common.token.token_validation(
+            "GET", "foo", None, mock.Mock(), None, cache=cache)
+        self.assertFalse(valid)
+        self.assertIsNone(token)
+        self.assertEqual(0, len(cache))
@@ -17,13 +17,124 @@
 
 """Handler utilities to work with tokens."""
 
+import collections
 import datetime
+import threading
+import time
 
 import models
 import models.token as mtoken
 import utils
 import utils.db
 
+# Redis channel used to broadcast token invalidations to all the processes.
+TOKEN_CACHE_CHANNEL = "kernelci-token-cache"
+# Message sent on the channel to clear all the cached tokens.
+TOKEN_CACHE_FLUSH = "*"
+
+
+class TokenCache(object):
+    """Bounded in-memory LRU cache of `Token` objects.
+
+    Tokens are keyed by the token string and expire after `ttl` seconds.
+    The cache is shared by all the handler threads of a process; when a
+    Redis connection is provided, invalidations are also published on the
+    `TOKEN_CACHE_CHANNEL` channel so that the other processes can drop their
+    copy.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, redis_conn=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis_conn
+        self._pubsub_thread = None
+        self._tokens = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def get(self, key):
+        """Get a cached token.
+
+        :param key: The token string.
+        :type key: str
+        :return The cached `Token` object or None.
+        """
+        with self._lock:
+            entry = self._tokens.pop(key, None)
+            if entry is not None:
+                token, expires = entry
+                if expires > time.time():
+                    # Re-insert to mark it as the most recently used.
+                    self._tokens[key] = entry
+                    self.hits += 1
+                    return token
+            self.misses += 1
+        return None
+
+    def put(self, key, token):
+        """Store a token in the cache.
+
+        If the cache is full, the least recently used token is evicted.
+
+        :param key: The token string.
+        :type key: str
+        :param token: The token to store.
+        :type token: `models.token.Token`
+        """
+        with self._lock:
+            self._tokens.pop(key, None)
+            while len(self._tokens) >= self.max_size:
+                self._tokens.popitem(last=False)
+            self._tokens[key] = (token, time.time() + self.ttl)
+
+    def invalidate(self, key=None, publish=True):
+        """Remove a token from the cache.
+
+        :param key: The token string, or None to clear the whole cache.
+        :type key: str
+        :param publish: If the invalidation should be broadcast to the
+        other processes via Redis.
+        :type publish: bool
+        """
+        with self._lock:
+            if key is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop(key, None)
+
+        if publish and self._redis is not None:
+            try:
+                self._redis.publish(
+                    TOKEN_CACHE_CHANNEL, key or TOKEN_CACHE_FLUSH)
+            except Exception, ex:
+                utils.LOG.error("Error publishing token invalidation")
+                utils.LOG.exception(ex)
+
+    def _handle_message(self, message):
+        """Handle an invalidation message received from Redis."""
+        key = message.get("data")
+        if key == TOKEN_CACHE_FLUSH:
+            key = None
+        self.invalidate(key, publish=False)
+
+    def subscribe(self, sleep_time=1.0):
+        """Listen for invalidations published by the other processes.
+
+        The messages are handled in a background daemon thread.
+
+        :param sleep_time: How long to wait for a new message.
+        :type sleep_time: float
+        """
+        if self._redis is not None and self._pubsub_thread is None:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{TOKEN_CACHE_CHANNEL: self._handle_message})
+            self._pubsub_thread = pubsub.run_in_thread(
+                sleep_time=sleep_time, daemon=True)
+
 
 def valid_token_general(token, method):
     """Make sure the token can be used for an HTTP method.
@@ -179,7 +290,8 @@ def is_expired_token(token):
 def validate_token(token_obj, method, remote_ip, validate_func):
     """Make sure the passed token is valid.
 
-    :param token_obj: The JSON object from the db that contains the token.
+    :param token_obj: The JSON object from the db that contains the token,
+        or an already built `Token` object.
     :param method: The HTTP verb this token is being validated for.
     :param remote_ip: The remote IP address sending the token.
     :param validate_func: Function called to validate the token, must accept
@@ -190,7 +302,10 @@ def validate_token(token_obj, method, remote_ip, validate_func):
     token = None
 
     if token_obj:
-        token = mtoken.Token.from_json(token_obj)
+        if isinstance(token_obj, mtoken.Token):
+            token = token_obj
+        else:
+            token = mtoken.Token.from_json(token_obj)
 
         if token:
             if not isinstance(token, mtoken.Token):
@@ -230,7 +345,8 @@ def find_token(database, spec):
 # pylint: disable=unused-argument
 def token_validation(
         method,
-        req_token, remote_ip, validation_func, database, master_key=None):
+        req_token, remote_ip, validation_func, database, master_key=None,
+        cache=None):
     """Perform the real token validation.
 
     :param method: The HTTP verb to validate.
@@ -244,11 +360,25 @@ def token_validation(
     :param database: The database connection.
     :param master_key: The default master key.
     :type master_key: str
+    :param cache: The cache where to look up the token first.
+    :type cache: `TokenCache`
     :return A 2-tuple: True or False; the token object.
     """
     valid_token = False
     token = None
-    token_obj = find_token(database, {models.TOKEN_KEY: req_token})
+    token_obj = None
+
+    if cache is not None:
+        token_obj = cache.get(req_token)
+
+    if token_obj is None:
+        token_obj = find_token(database, {models.TOKEN_KEY: req_token})
+
+        if token_obj and cache is not None:
+            if not isinstance(token_obj, mtoken.Token):
+                token_obj = mtoken.Token.from_json(token_obj)
+            if token_obj:
+                cache.put(req_token, token_obj)
 
     if token_obj:
         valid_token, token = validate_token(
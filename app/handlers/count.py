@@ -23,7 +23,9 @@ import handlers.base as hbase
 import handlers.common.query
 import handlers.response as hresponse
 import models
+import taskqueue.tasks.stats
 import utils
+import utils.counters
 import utils.db
 
 # Internally used only. It is used to retrieve just one field for
@@ -42,26 +44,40 @@ class CountHandler(hbase.BaseHandler):
     def _valid_keys(method):
         return models.COUNT_VALID_KEYS.get(method, None)
 
-    def _get_one(self, collection, **kwargs):
-        response = hresponse.HandlerResponse()
+    @property
+    def counters_ttl(self):
+        """How long the document counters are valid, 0 if not used."""
+        return self.settings.get("counters_ttl", 0)
 
+    def _get_one(self, collection, **kwargs):
         if collection in models.COUNT_COLLECTIONS:
-            response.result = count_one_collection(
-                self.db[collection],
-                collection, self.get_query_arguments, self._valid_keys("GET"))
+            query = dict(
+                (key, sorted(values))
+                for key, values in self.request.arguments.iteritems())
+            response = self._get_cached(
+                collection, query, kwargs.get("token"),
+                self._count_one, collection)
         else:
-            response.status_code = 404
+            response = hresponse.HandlerResponse(404)
             response.reason = "Collection %s not found" % collection
 
         return response
 
+    def _count_one(self, collection):
+        response = hresponse.HandlerResponse()
+        response.result = count_one_collection(
+            self.db[collection],
+            collection,
+            self.get_query_arguments,
+            self._valid_keys("GET"), counters_ttl=self.counters_ttl)
+        return response
+
     def _get(self, **kwargs):
         response = hresponse.HandlerResponse()
         response.result = count_all_collections(
             self.db,
             self.get_query_arguments,
-            self._valid_keys("GET")
-        )
+            self._valid_keys("GET"), counters_ttl=self.counters_ttl)
 
         return response
 
@@ -76,8 +92,60 @@ class CountHandler(hbase.BaseHandler):
         self.write_error(status_code=501)
 
 
+def _schedule_rebuild(collection_name, ttl):
+    """Start the rebuild of the document counters of a collection.
+
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param ttl: How long the counters are valid, in seconds.
+    :type ttl: int
+    """
+    try:
+        taskqueue.tasks.stats.rebuild_counters.apply_async(
+            [collection_name, ttl])
+    except Exception, ex:
+        utils.LOG.error(
+            "Error scheduling the rebuild of the %s counters",
+            collection_name)
+        utils.LOG.exception(ex)
+
+
+def _count_documents(collection, collection_name, spec, counters_ttl):
+    """Count the documents matching a query.
+
+    The pre-aggregated counters are used when enabled and if they can answer
+    the query, otherwise the documents are counted with a query.  Missing or
+    expired counters are rebuilt by a Celery task.
+
+    :param collection: The collection whose elements should be counted.
+    :param collection_name: The name of the collection to count.
+    :type collection_name: str
+    :param spec: The query spec.
+    :type spec: dict
+    :param counters_ttl: How long the counters are valid, 0 to not use them.
+    :type counters_ttl: int
+    :return The number of documents.
+    """
+    number = None
+
+    if counters_ttl:
+        number = utils.counters.get_count(
+            collection.database, collection_name, spec, counters_ttl,
+            schedule_rebuild=_schedule_rebuild)
+
+    if number is None:
+        if spec:
+            _, number = utils.db.find_and_count(
+                collection, 0, 0, spec, COUNT_FIELDS)
+        else:
+            number = utils.db.count(collection)
+
+    return number or 0
+
+
 def count_one_collection(
-        collection, collection_name, query_args_func, valid_keys):
+        collection, collection_name, query_args_func, valid_keys,
+        counters_ttl=0):
     """Count all the available documents in the provide collection.
 
     :param collection: The collection whose elements should be counted.
@@ -89,6 +157,9 @@ def count_one_collection(
     :param valid_keys: A list containing the valid keys that should be
     retrieved.
     :type valid_keys: list
+    :param counters_ttl: How long the document counters are valid, 0 to not
+    use them.
+    :type counters_ttl: int
     :return A list containing a dictionary with the `collection`, `count` and
     optionally the `fields` fields.
     """
@@ -100,24 +171,18 @@ def count_one_collection(
         spec, query_args_func, valid_keys)
     utils.update_id_fields(spec)
 
-    if spec:
-        _, number = utils.db.find_and_count(
-            collection, 0, 0, spec, COUNT_FIELDS)
-        if not number:
-            number = 0
-
-        result.append(dict(collection=collection_name, count=number))
-    else:
-        result.append(
-            dict(
-                collection=collection_name,
-                count=utils.db.count(collection))
-        )
+    result.append(
+        dict(
+            collection=collection_name,
+            count=_count_documents(
+                collection, collection_name, spec, counters_ttl))
+    )
 
     return result
 
 
-def count_all_collections(database, query_args_func, valid_keys):
+def count_all_collections(
+        database, query_args_func, valid_keys, counters_ttl=0):
     """Count all the available documents in the database collections.
 
     :param database: The datase connection to use.
@@ -127,6 +192,9 @@ def count_all_collections(database, query_args_func, valid_keys):
     :param valid_keys: A list containing the valid keys that should be
     retrieved.
     :type valid_keys: list
+    :param counters_ttl: How long the document counters are valid, 0 to not
+    use them.
+    :type counters_ttl: int
     :return A list containing a dictionary with the `collection` and `count`
     fields.
     """
@@ -136,20 +204,13 @@ def count_all_collections(database, query_args_func, valid_keys):
     handlers.common.query.get_and_add_date_range(spec, query_args_func)
     utils.update_id_fields(spec)
 
-    if spec:
-        for collection in models.COUNT_COLLECTIONS:
-            _, number = utils.db.find_and_count(
-                database[collection], 0, 0, spec, COUNT_FIELDS)
-            if not number:
-                number = 0
-            result.append(dict(collection=collection, count=number))
-    else:
-        for collection in models.COUNT_COLLECTIONS:
-            result.append(
-                {
-                    models.COLLECTION_KEY: collection,
-                    models.COUNT_KEY: utils.db.count(database[collection])
-                }
-            )
+    for collection in models.COUNT_COLLECTIONS:
+        result.append(
+            {
+                models.COLLECTION_KEY: collection,
+                models.COUNT_KEY: _count_documents(
+                    database[collection], collection, spec, counters_ttl)
+            }
+        )
 
     return result
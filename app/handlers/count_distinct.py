@@ -147,23 +147,9 @@ def get_distinct_query(field, collection, query_args_func, valid_keys):
     :return The number of results.
     :rtype int
     """
-    fields = None
-    limit = 0
-    skip = 0
-    sort = None
-    spec = {}
+    spec, _, _, _, _, _ = get_all_query_values(query_args_func, valid_keys)
 
-    spec, sort, fields, skip, limit, _ = \
-        get_all_query_values(query_args_func, valid_keys)
-
-    result = collection.find(
-        spec, fields, limit=limit, skip=skip, sort=sort)
-    if result:
-        result = len(result.distinct(field))
-    else:
-        result = 0
-
-    return result
+    return count_distinct(collection, field, spec)
 
 
 def get_distinct_field(field, collection):
@@ -175,7 +161,35 @@ def get_distinct_field(field, collection):
     :return The number of results.
     :rtype int
     """
-    return len(collection.distinct(field))
+    return count_distinct(collection, field)
+
+
+def count_distinct(collection, field, spec=None):
+    """Count the distinct values of a field in the database.
+
+    The values are counted with an aggregation, instead of retrieving all of
+    them just to get the length of the list.  As with `distinct`, documents
+    without the field are not counted.
+
+    :param collection: The database collection.
+    :param field: The field to count the unique values of.
+    :type field: str
+    :param spec: The query spec of the documents to look at.
+    :type spec: dict
+    :return The number of unique values.
+    :rtype int
+    """
+    pipeline = [
+        {"$match": spec or {}},
+        {"$match": {field: {"$exists": True}}},
+        {"$group": {models.ID_KEY: "$" + field}},
+        {"$count": models.COUNT_KEY},
+    ]
+
+    for result in collection.aggregate(pipeline, allowDiskUse=True):
+        return result[models.COUNT_KEY]
+
+    return 0
 
 
 def valid_distinct_keys(resource, method):
@@ -25,6 +25,7 @@ import pymongo
 
 import models
 import utils
+import utils.counters
 
 
 INDEX_SPECS = {
@@ -108,6 +109,13 @@ INDEX_SPECS = {
         ],
     ],
 
+    models.COUNTER_COLLECTION: [
+        [
+            (models.COLLECTION_KEY, pymongo.ASCENDING),
+            (utils.counters.GENERATION, pymongo.ASCENDING),
+        ],
+    ],
+
     models.DAILY_STATS_COLLECTION: [
         [
             (models.CREATED_KEY, pymongo.DESCENDING),
@@ -120,6 +128,15 @@ INDEX_SPECS = {
         ],
     ],
 
+    models.ERRORS_SUMMARY_COLLECTION: [
+        [
+            (models.JOB_KEY, pymongo.ASCENDING),
+            (models.KERNEL_KEY, pymongo.ASCENDING),
+            (models.GIT_BRANCH_KEY, pymongo.ASCENDING),
+            (models.JOB_ID_KEY, pymongo.ASCENDING),
+        ],
+    ],
+
     models.JOB_COLLECTION: [
         [
             (models.CREATED_KEY, pymongo.DESCENDING),
@@ -335,6 +352,43 @@ INDEX_EXPIRATION = {
     (models.REPORT_COLLECTION, 'created_on_1'): 604800,
 }
 
+# Indexes used to avoid duplicate documents created by concurrent upserts.
+INDEX_UNIQUE = [
+    (models.ERRORS_SUMMARY_COLLECTION, 'job_1_kernel_1_git_branch_1_job_id_1'),
+]
+
+# Indexes used by internal code paths rather than by the handler queries:
+# the counters rebuild, the errors summary upserts and the token lookups.
+INDEX_INTERNAL = [
+    (models.COUNTER_COLLECTION, 'collection_1_generation_1'),
+    (models.ERRORS_SUMMARY_COLLECTION, 'job_1_kernel_1_git_branch_1_job_id_1'),
+    (models.TOKEN_COLLECTION, 'token_-1'),
+]
+
+
+def get_index_name(index):
+    """Get the name MongoDB gives to an index.
+
+    :param index: The index keys and directions.
+    :type index: list
+    :return The name as a string.
+    """
+    return '_'.join('_'.join(str(x) for x in spec) for spec in index)
+
+
+def is_required_index(collection, index):
+    """Check if an index is needed whatever the handler queries are.
+
+    :param collection: The name of the collection.
+    :type collection: str
+    :param index: The index keys and directions.
+    :type index: list
+    :return True for the TTL, unique and internally used indexes.
+    """
+    key = (collection, get_index_name(index))
+    return key in INDEX_EXPIRATION or key in INDEX_UNIQUE or \
+        key in INDEX_INTERNAL
+
 
 def ensure_indexes(database):
     """Ensure that mongodb indexes exists, if not create them.
@@ -348,8 +402,10 @@ def ensure_indexes(database):
         db_indexes = db_collection.index_information()
 
         for index in index_specs:
-            name = '_'.join('_'.join(str(x) for x in spec) for spec in index)
+            name = get_index_name(index)
             expire = INDEX_EXPIRATION.get((collection, name))
             if name not in db_indexes:
                 kw = {'expireAfterSeconds': expire} if expire else {}
+                if (collection, name) in INDEX_UNIQUE:
+                    kw['unique'] = True
                 db_collection.create_index(index, **kw)
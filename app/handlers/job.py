@@ -23,6 +23,7 @@ import handlers.base as hbase
 import handlers.response as hresponse
 import models
 import taskqueue.tasks.build as taskb
+import utils.counters
 import utils.db
 
 JOB_NOT_FOUND = "Job '%s-%s (branch %s)' not found"
@@ -80,6 +81,8 @@ class JobHandler(hbase.BaseHandler):
             else:
                 response.reason = \
                     JOB_UPDATED % (job, kernel, git_branch, status)
+                # The previous status is not known, count the jobs again.
+                utils.counters.invalidate(self.db, models.JOB_COLLECTION)
                 # Create the build logs summary file.
                 taskb.create_build_logs_summary.apply_async(
                     [job, kernel, git_branch])
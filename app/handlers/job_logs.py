@@ -25,6 +25,7 @@ import handlers.response as hresponse
 import models
 import models.error_summary as errsummary
 import utils.db
+import utils.logs.summary
 
 
 # pylint: disable=too-many-public-methods
@@ -63,13 +64,14 @@ class JobLogsHandler(hbase.BaseHandler):
             result = utils.db.find_one2(
                 self.collection,
                 {models.JOB_ID_KEY: obj_id},
-                fields=handlers.common.query.get_query_fields(
-                    self.get_query_arguments)
+                fields=utils.logs.summary.get_fields(
+                    handlers.common.query.get_query_fields(
+                        self.get_query_arguments))
             )
 
             if result:
                 # result here is returned as a dictionary from mongodb
-                response.result = result
+                response.result = utils.logs.summary.to_lists(result)
             else:
                 response.status_code = 404
                 response.reason = "Resource '%s' not found" % doc_id
@@ -80,3 +82,13 @@ class JobLogsHandler(hbase.BaseHandler):
             response.reason = "Wrong ID value provided"
 
         return response
+
+    def _get_query_args(self, method="GET"):
+        spec, sort, fields, skip, limit, aggregate = \
+            super(JobLogsHandler, self)._get_query_args(method=method)
+        return (
+            spec, sort, utils.logs.summary.get_fields(fields), skip, limit,
+            aggregate)
+
+    def _get_result_document(self, document):
+        return utils.logs.summary.to_lists(document)
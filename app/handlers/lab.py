@@ -133,6 +133,8 @@ class LabHandler(handlers.base.BaseHandler):
                     token_id = lab_doc.get(models.TOKEN_KEY, None)
                     response = self._delete(
                         {models.ID_KEY: lab_bson_id}, token_id=token_id)
+                    self._invalidate_cache(
+                        response, models.TOKEN_COLLECTION)
 
                     if response.status_code == 500:
                         response.reason = \
@@ -158,11 +160,13 @@ class LabHandler(handlers.base.BaseHandler):
 
         ret_val = utils.db.delete_by_id(self.collection, oid)
         if all([ret_val != 500, token_id]):
-            token_ret_val = utils.db.delete_by_id(
-                self.db[models.TOKEN_COLLECTION],
-                token_id)
+            token_collection = self.db[models.TOKEN_COLLECTION]
+            token_doc = utils.db.find_one2(token_collection, token_id)
+            token_ret_val = utils.db.delete_by_id(token_collection, token_id)
             if token_ret_val == 500:
                 response.errors = "Error deleting/disabling associated token"
+            elif token_doc and self.token_cache is not None:
+                self.token_cache.invalidate(token_doc.get(models.TOKEN_KEY))
 
         response.status_code = ret_val
 
@@ -0,0 +1,46 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Provide the /metrics handler for Prometheus."""
+
+import tornado.gen
+import tornado.web
+
+import utils.db
+import utils.task_metrics
+
+
+# pylint: disable=too-many-public-methods
+class MetricsHandler(tornado.web.RequestHandler):
+    """Handle request to the /metrics URL.
+
+    Export the Celery task metrics and the response cache counters of the
+    web server process in the Prometheus text format.  There is no token:
+    this is served by a separate application listening on the local
+    interface only.
+    """
+
+    @tornado.gen.coroutine
+    def get(self):
+        text = yield utils.db.run_async(
+            utils.task_metrics.get_prometheus_text,
+            self.settings["redis_connection"])
+        response_cache = self.settings.get("response_cache", None)
+        if response_cache is not None:
+            text += response_cache.get_prometheus_text()
+        self.set_header(
+            "Content-Type", utils.task_metrics.PROMETHEUS_CONTENT_TYPE)
+        self.write(text)
@@ -36,6 +36,13 @@ class HandlerResponse(object):
 
     To send this response on the wire, serialize the object by calling
     `to_dict()` or `repr`. They will return a dictionary view of the object.
+
+    If `stream` is set before `result`, a database cursor stored in `result`
+    is not turned into a list: the documents are meant to be serialized one
+    batch at a time while they are sent.
+
+    If `task` is set, the response is a placeholder: the handler waits for
+    the Celery result and sends the response created by `task_callback`.
     """
     def __init__(self, status_code=200):
         """Create a new HandlerResponse.
@@ -49,11 +56,16 @@ class HandlerResponse(object):
         self._count = None
         self._errors = []
         self._headers = None
+        self._keyset_sort = None
         self._limit = None
         self._messages = []
+        self._next_token = None
         self._reason = None
         self._result = None
         self._skip = None
+        self._stream = False
+        self._task = None
+        self._task_callback = None
 
     @property
     def status_code(self):
@@ -154,6 +166,87 @@ class HandlerResponse(object):
         else:
             raise ValueError("Value must be an integer")
 
+    @property
+    def next_token(self):
+        """The token to retrieve the next page of results."""
+        return self._next_token
+
+    @next_token.setter
+    def next_token(self, value):
+        """Set the token to retrieve the next page of results.
+        If set to None, it will not be displayed in the output.
+
+        :param value: The opaque token.
+        :type value: str
+        """
+        if any([value is None, isinstance(value, types.StringTypes)]):
+            self._next_token = value
+        else:
+            raise ValueError("Value must be a string")
+
+    @property
+    def keyset_sort(self):
+        """The keyset sort of a streamed result, or None."""
+        return self._keyset_sort
+
+    @keyset_sort.setter
+    def keyset_sort(self, value):
+        """Set the keyset sort of a streamed result.
+
+        When a streamed keyset page is full, the token to retrieve the next
+        page is created from its last document and sent after the result.
+
+        :param value: The keyset sort data structure.
+        :type value: list
+        """
+        self._keyset_sort = value
+
+    @property
+    def stream(self):
+        """If the result cursor should be streamed."""
+        return all([
+            self._stream, isinstance(self._result, pymongo.cursor.Cursor)])
+
+    @stream.setter
+    def stream(self, value):
+        """Set if the result cursor should be streamed.
+
+        :param value: True or False.
+        :type value: bool
+        """
+        self._stream = bool(value)
+
+    @property
+    def task(self):
+        """The Celery result the response is waiting for, or None."""
+        return self._task
+
+    @task.setter
+    def task(self, value):
+        """Set the Celery result the response is waiting for.
+
+        The handler waits for the result without blocking a thread, and
+        replaces the response with the one returned by `task_callback`.
+
+        :param value: The Celery result.
+        """
+        self._task = value
+
+    @property
+    def task_callback(self):
+        """The function creating the response from the task result value."""
+        return self._task_callback
+
+    @task_callback.setter
+    def task_callback(self, value):
+        """Set the function creating the response from the task result value.
+
+        :param value: The function, taking the value as its only argument and
+        returning a `HandlerResponse` object.
+        :type value: function
+        """
+        self._task_callback = value
+
     @property
     def result(self):
         """The result associated with this response.
@@ -178,7 +271,8 @@ class HandlerResponse(object):
             # The pymongo cursor is an iterable.
             if not isinstance(value, (types.ListType, pymongo.cursor.Cursor)):
                 value = [value]
-            elif isinstance(value, pymongo.cursor.Cursor):
+            elif all([isinstance(value, pymongo.cursor.Cursor),
+                      not self._stream]):
                 value = [r for r in value]
             self._result = value
 
@@ -230,6 +324,9 @@ class HandlerResponse(object):
         if self.skip is not None:
             dict_obj["skip"] = self.skip
 
+        if self.next_token is not None:
+            dict_obj["next"] = self.next_token
+
         if self.result is not None:
             dict_obj["result"] = self.result
 
@@ -20,6 +20,7 @@
 import json
 import mock
 import tornado
+import tornado.concurrent
 
 import urls
 
@@ -113,8 +114,9 @@ class TestBatchHandler(TestHandlerBase):
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
 
-    @mock.patch("taskqueue.tasks.common.run_batch_group")
-    def test_post_correct(self, mocked_run_batch):
+    @mock.patch("handlers.common.results.get_value")
+    @mock.patch("taskqueue.tasks.common.apply_batch_group")
+    def test_post_correct(self, mocked_run_batch, mock_get_value):
         headers = {"Authorization": "foo", "Content-Type": "application/json"}
         batch_dict = {
             "batch": [
@@ -129,7 +131,7 @@ class TestBatchHandler(TestHandlerBase):
         }
         body = json.dumps(batch_dict)
 
-        mocked_run_batch.return_value = {}
+        mock_get_value.return_value = []
 
         response = self.fetch(
             "/batch", method="POST", body=body, headers=headers)
@@ -152,3 +154,132 @@ class TestBatchHandler(TestHandlerBase):
                 "mongodb_password": ""
             }
         )
+        mock_get_value.assert_called_once_with(mocked_run_batch.return_value)
+
+    def _waiter(self, acquire=True, ready=True):
+        waiter = mock.MagicMock()
+        waiter.acquire.return_value = acquire
+        future = tornado.concurrent.Future()
+        future.set_result(ready)
+        waiter.wait.return_value = future
+        self._app.settings["result_waiter"] = waiter
+        return waiter
+
+    @mock.patch("handlers.common.results.get_value")
+    @mock.patch("taskqueue.tasks.common.apply_batch_group")
+    def test_post_result_waiter(self, mock_apply, mock_get_value):
+        headers = {"Authorization": "foo", "Content-Type": "application/json"}
+        body = json.dumps({
+            "batch": [
+                {
+                    "method": "GET",
+                    "resource": "count",
+                    "operation_id": "foo",
+                }
+            ]
+        })
+        waiter = self._waiter()
+        mock_get_value.return_value = [{"operation_id": "foo"}]
+
+        response = self.fetch(
+            "/batch", method="POST", body=body, headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual(
+            [{"operation_id": "foo"}], json.loads(response.body)["result"])
+        waiter.wait.assert_called_once_with(mock_apply.return_value, None)
+        waiter.release.assert_called_once_with()
+
+        waiter = self._waiter(ready=False)
+        response = self.fetch(
+            "/batch", method="POST", body=body, headers=headers)
+        self.assertEqual(response.code, 504)
+        waiter.release.assert_called_once_with()
+
+        waiter = self._waiter(acquire=False)
+        response = self.fetch(
+            "/batch", method="POST", body=body, headers=headers)
+        self.assertEqual(response.code, 503)
+        self.assertFalse(waiter.wait.called)
+        self.assertEqual(2, mock_apply.call_count)
+
+    @mock.patch("utils.batch.common.run_batch_operations")
+    @mock.patch("handlers.common.results.get_value")
+    @mock.patch("taskqueue.tasks.common.apply_batch_group")
+    def test_post_remote_first(self, mock_apply, mock_get_value, mock_run):
+        headers = {"Authorization": "foo", "Content-Type": "application/json"}
+        self._app.settings["batch_in_process_limit"] = 10
+        batch = [
+            {
+                "method": "GET",
+                "resource": "job",
+                "query": "job=foo",
+                "operation_id": "remote"
+            },
+            {
+                "method": "GET",
+                "resource": "job",
+                "query": "job=foo&limit=2",
+                "operation_id": "local"
+            },
+        ]
+        calls = []
+        mock_apply.side_effect = \
+            lambda *args: calls.append("apply") or mock.sentinel.result
+        mock_run.side_effect = \
+            lambda *args, **kwargs: calls.append("run") or [{"id": "local"}]
+        mock_get_value.return_value = [{"id": "remote"}]
+
+        response = self.fetch(
+            "/batch", method="POST", body=json.dumps({"batch": batch}),
+            headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual(["apply", "run"], calls)
+        mock_get_value.assert_called_once_with(mock.sentinel.result)
+        self.assertListEqual(
+            [{"id": "remote"}, {"id": "local"}],
+            json.loads(response.body)["result"])
+
+    @mock.patch("handlers.common.results.get_value")
+    @mock.patch("taskqueue.tasks.common.apply_batch_group")
+    def test_post_in_process(self, mocked_run_batch, mock_get_value):
+        headers = {"Authorization": "foo", "Content-Type": "application/json"}
+        self.database["job"].insert_many(
+            [{"job": "foo", "kernel": str(i)} for i in range(3)])
+        self._app.settings["batch_in_process_limit"] = 10
+        batch = [
+            {
+                "method": "GET",
+                "resource": "job",
+                "query": "job=foo",
+                "operation_id": "all-jobs"
+            },
+            {
+                "method": "GET",
+                "resource": "job",
+                "query": "job=foo&limit=2&field=kernel",
+                "operation_id": "jobs"
+            },
+        ]
+        mock_get_value.return_value = [{"operation_id": "all-jobs"}]
+
+        response = self.fetch(
+            "/batch", method="POST", body=json.dumps({"batch": batch}),
+            headers=headers)
+
+        self.assertEqual(response.code, 200)
+        mocked_run_batch.assert_called_once_with(
+            batch[:1], self.settings["dboptions"])
+        result = json.loads(response.body)["result"]
+        self.assertListEqual(
+            ["all-jobs", "jobs"], [op["operation_id"] for op in result])
+        self.assertEqual(2, len(result[1]["result"][0]["result"]))
+        self.assertIn("execution_time", result[1])
+
+        mocked_run_batch.reset_mock()
+        response = self.fetch(
+            "/batch", method="POST", body=json.dumps({"batch": batch[1:]}),
+            headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertFalse(mocked_run_batch.called)
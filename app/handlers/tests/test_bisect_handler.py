@@ -17,8 +17,11 @@
 
 """Test module for the BisectHandler handler."""
 
+import bson
+import json
 import mock
 import tornado
+import tornado.concurrent
 
 import urls
 
@@ -35,3 +38,48 @@ class TestBisectHandler(TestHandlerBase):
 
         response = self.fetch("/bisect/bisect_id", headers=headers)
         self.assertEqual(response.code, 400)
+
+    def test_bisect_build_saved(self):
+        build_id = bson.objectid.ObjectId()
+        self.database["bisect"].insert_one(
+            {"build_id": build_id, "compare_to": None, "job": "job"})
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/bisect?collection=build&build_id=" + str(build_id),
+            headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual("job", json.loads(response.body)["result"][0]["job"])
+
+    def test_bisect_build_wrong_id(self):
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/bisect?collection=build&build_id=foo", headers=headers)
+        self.assertEqual(response.code, 400)
+
+        response = self.fetch("/bisect?collection=build", headers=headers)
+        self.assertEqual(response.code, 400)
+
+    @mock.patch("handlers.common.results.get_value")
+    @mock.patch("taskqueue.tasks.bisect.defconfig_bisect.apply_async")
+    def test_bisect_build_result_waiter(self, mock_apply, mock_get_value):
+        waiter = mock.MagicMock()
+        waiter.acquire.return_value = True
+        future = tornado.concurrent.Future()
+        future.set_result(True)
+        waiter.wait.return_value = future
+        self._app.settings["result_waiter"] = waiter
+        mock_get_value.return_value = (404, None)
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/bisect?collection=build&build_id=" +
+            str(bson.objectid.ObjectId()),
+            headers=headers)
+
+        self.assertEqual(response.code, 404)
+        self.assertEqual("Defconfig not found", response.reason)
+        waiter.wait.assert_called_once_with(mock_apply.return_value, None)
+        waiter.release.assert_called_once_with()
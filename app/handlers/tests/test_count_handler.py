@@ -18,9 +18,12 @@
 """Test module for the CountHandler handler."""
 
 import json
+import mock
 import tornado
 
+import handlers.common.cache as hcache
 import urls
+import utils.counters
 
 from handlers.tests.test_handler_base import TestHandlerBase
 
@@ -87,3 +90,95 @@ class TestCountHandler(TestHandlerBase):
         self.assertEqual(response.code, 200)
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
+
+    def test_get_count_collection_cached(self):
+        cache = hcache.ResponseCache(self.redisdb)
+        self._app.settings["response_cache"] = cache
+        self.database["build"].insert_one({"arch": "foo"})
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch("/count/build?arch=foo", headers=headers)
+        self.assertEqual(
+            1, json.loads(response.body)["result"][0]["count"])
+
+        self.database["build"].insert_one({"arch": "foo"})
+        response = self.fetch("/count/build?arch=foo", headers=headers)
+        self.assertEqual(
+            1, json.loads(response.body)["result"][0]["count"])
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        cache.invalidate("build")
+        response = self.fetch("/count/build?arch=foo", headers=headers)
+        self.assertEqual(
+            2, json.loads(response.body)["result"][0]["count"])
+        self.assertEqual(2, cache.misses)
+
+    @mock.patch("taskqueue.tasks.stats.rebuild_counters.apply_async")
+    def test_get_count_collection_counters(self, mock_apply):
+        mock_apply.side_effect = lambda args: utils.counters.rebuild(
+            self.database, *args)
+        self._app.settings["counters_ttl"] = 60
+        self.database["build"].insert_one(
+            {"arch": "foo", "job": "mainline", "status": "PASS"})
+        headers = {"Authorization": "foo"}
+
+        # Counted with a query while the counters are rebuilt.
+        response = self.fetch(
+            "/count/build?job=mainline&status=PASS", headers=headers)
+        self.assertEqual(
+            1, json.loads(response.body)["result"][0]["count"])
+        mock_apply.assert_called_once_with(["build", 60])
+
+        # Documents saved without updating the counters are not counted,
+        # unless the query cannot be answered with the counters.
+        self.database["build"].insert_one(
+            {"arch": "foo", "job": "mainline", "status": "PASS"})
+        response = self.fetch(
+            "/count/build?job=mainline&status=PASS", headers=headers)
+        self.assertEqual(
+            1, json.loads(response.body)["result"][0]["count"])
+        response = self.fetch("/count/build?arch=foo", headers=headers)
+        self.assertEqual(
+            2, json.loads(response.body)["result"][0]["count"])
+
+        response = self.fetch("/count?job=mainline", headers=headers)
+        counts = dict(
+            (result["collection"], result["count"])
+            for result in json.loads(response.body)["result"])
+        self.assertEqual(1, counts["build"])
+        self.assertEqual(0, counts["job"])
+
+
+class TestCountDistinctHandler(TestHandlerBase):
+
+    def get_app(self):
+        return tornado.web.Application(
+            [urls._TEST_GROUP_COUNT_DISTINCT_URL], **self.settings)
+
+    def test_get_count_distinct(self):
+        self.database["test_group"].insert_many([
+            {"job": "mainline", "kernel": "v5.4", "arch": "arm"},
+            {"job": "mainline", "kernel": "v5.4", "arch": "arm64"},
+            {"job": "mainline", "kernel": "v5.5", "arch": "arm"},
+            {"job": "next", "kernel": "v5.6"},
+        ])
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/test/group/count/distinct/kernel", headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            3, json.loads(response.body)["result"][0]["count"])
+
+        response = self.fetch(
+            "/test/group/count/distinct/arch?job=mainline&kernel=v5.4",
+            headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            2, json.loads(response.body)["result"][0]["count"])
+
+        response = self.fetch(
+            "/test/group/count/distinct/arch?job=next", headers=headers)
+        self.assertEqual(
+            0, json.loads(response.body)["result"][0]["count"])
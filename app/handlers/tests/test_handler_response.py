@@ -17,6 +17,8 @@
 
 """Test class for HandlerResponse object."""
 
+import mock
+import pymongo.cursor
 import unittest
 
 import handlers.response as hresponse
@@ -117,6 +119,21 @@ class TestHandlerResponse(unittest.TestCase):
         self.assertIsInstance(response.result, list)
         self.assertEqual(response.result, ['foo'])
 
+    def test_response_result_setter_stream(self):
+        cursor = mock.MagicMock(spec=pymongo.cursor.Cursor)
+        cursor.__iter__.return_value = iter([{"_id": 1}])
+
+        response = hresponse.HandlerResponse()
+        self.assertFalse(response.stream)
+        response.stream = True
+        response.result = cursor
+        self.assertIs(cursor, response.result)
+        self.assertIs(cursor, response.to_dict()["result"])
+
+        response = hresponse.HandlerResponse()
+        response.result = cursor
+        self.assertEqual([{"_id": 1}], response.result)
+
     def test_response_headers_setter_not_valid(self):
         response = hresponse.HandlerResponse()
 
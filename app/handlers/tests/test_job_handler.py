@@ -23,10 +23,16 @@ except ImportError:
     import json
 
 import mock
+import pymongo.cursor
+import threading
 import tornado
+import tornado.concurrent
 import unittest
 
+import handlers.common.cache as hcache
+import handlers.common.query
 import urls
+import utils.db
 
 from handlers.tests.test_handler_base import TestHandlerBase
 
@@ -59,6 +65,257 @@ class TestJobHandler(TestHandlerBase):
             response.headers["Content-Type"], self.content_type)
         self.assertDictEqual(json.loads(response.body), expected_body)
 
+    @mock.patch("utils.db.find_and_count")
+    def test_get_cached(self, mock_find):
+        mock_find.return_value = ([{"_id": "foo", "job": "job"}], 1)
+        cache = hcache.ResponseCache(self.redisdb)
+        self._app.settings["response_cache"] = cache
+
+        expected_body = {
+            "count": 1,
+            "code": 200,
+            "limit": 0,
+            "skip": 0,
+            "result": [{"_id": "foo", "job": "job"}]
+        }
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch("/job?job=job&kernel=kernel", headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), expected_body)
+
+        response = self.fetch("/job?kernel=kernel&job=job", headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), expected_body)
+
+        self.assertEqual(1, mock_find.call_count)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_get_query_shape(self):
+        recorded = threading.Event()
+        recorder = mock.MagicMock()
+        recorder.record.side_effect = lambda *args: recorded.set()
+        self._app.settings["query_shapes"] = recorder
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch(
+            "/job?job=job&sort=created_on&sort_order=-1", headers=headers)
+        self.assertEqual(response.code, 200)
+
+        self.assertTrue(recorded.wait(5))
+        collection, spec, sort = recorder.record.call_args[0]
+        self.assertEqual("job", collection.name)
+        self.assertDictEqual({"job": "job"}, spec)
+        self.assertListEqual([("created_on", -1)], sort)
+
+    def test_get_query_shape_keyset(self):
+        recorded = threading.Event()
+        recorder = mock.MagicMock()
+        recorder.record.side_effect = lambda *args: recorded.set()
+        self._app.settings["query_shapes"] = recorder
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch(
+            "/job?job=job&sort=created_on&limit=2&after=", headers=headers)
+        self.assertEqual(response.code, 200)
+
+        self.assertTrue(recorded.wait(5))
+        _, spec, sort = recorder.record.call_args[0]
+        self.assertDictEqual({"job": "job"}, spec)
+        self.assertListEqual([("created_on", -1), ("_id", -1)], sort)
+
+    def test_get_query_shape_aggregate(self):
+        recorder = mock.MagicMock()
+        self._app.settings["query_shapes"] = recorder
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch("/job?aggregate=job", headers=headers)
+        self.assertEqual(response.code, 200)
+        self.assertFalse(recorder.record.called)
+
+    def test_get_async_without_executor(self):
+        self.database["job"].insert_many(
+            [{"job": "job", "kernel": str(i)} for i in xrange(3)])
+        executor = mock.MagicMock()
+        self._app.settings["executor"] = executor
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch("/job?job=job&field=kernel", headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(200, response.code)
+        self.assertEqual(3, body["count"])
+        self.assertEqual(3, len(body["result"]))
+
+        doc_id = self.database["job"].find_one()["_id"]
+        response = self.fetch("/job/" + str(doc_id), headers=headers)
+        self.assertEqual(200, response.code)
+
+        response = self.fetch("/job/" + "x" * 24, headers=headers)
+        self.assertEqual(400, response.code)
+
+        self.assertFalse(executor.submit.called)
+
+    @mock.patch("utils.db.find_and_count")
+    def test_find_and_count_async_prefetch(self, mock_find):
+        cursor = mock.MagicMock(spec=pymongo.cursor.Cursor)
+        cursor.__iter__.return_value = iter([{"job": "job"}])
+        mock_find.return_value = (cursor, 1)
+
+        result, count = utils.db.find_and_count_async(
+            self.database["job"], prefetch=10).result()
+        self.assertEqual([{"job": "job"}], result)
+        self.assertEqual(1, count)
+
+        mock_find.return_value = (cursor, 20)
+        result, count = utils.db.find_and_count_async(
+            self.database["job"], prefetch=10).result()
+        self.assertIs(cursor, result)
+
+        mock_find.return_value = (cursor, None)
+        result, count = utils.db.find_and_count_async(
+            self.database["job"], prefetch=10).result()
+        self.assertIs(cursor, result)
+        self.assertIsNone(count)
+
+    def test_get_count_strategies(self):
+        self.database["job"].insert_many(
+            [{"job": "job", "kernel": str(i)} for i in xrange(5)])
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/job?job=job&limit=2&skip=4&field=kernel", headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(200, response.code)
+        self.assertEqual(1, body["count"])
+        self.assertEqual(1, len(body["result"]))
+
+        response = self.fetch("/job?limit=3&skip=1", headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(3, body["count"])
+        self.assertEqual(3, len(body["result"]))
+
+    def test_get_keyset_pages(self):
+        self.database["job"].insert_many([
+            {"_id": str(i), "job": "job", "created_on": i // 2}
+            for i in xrange(5)])
+        headers = {"Authorization": "foo"}
+        url = "/job?job=job&sort=created_on&limit=2&field=job&after="
+
+        response = self.fetch(url, headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(200, response.code)
+        self.assertEqual(["4", "3"], [doc["_id"] for doc in body["result"]])
+
+        response = self.fetch(url + body["next"], headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(["2", "1"], [doc["_id"] for doc in body["result"]])
+
+        response = self.fetch(url + body["next"], headers=headers)
+        body = json.loads(response.body)
+        self.assertEqual(["0"], [doc["_id"] for doc in body["result"]])
+        self.assertNotIn("next", body)
+
+    def test_get_keyset_pages_null(self):
+        headers = {"Authorization": "foo"}
+
+        # Null values, then missing keys.
+        for null_doc in [{"created_on": None}, {}]:
+            self.database["job"].delete_many({})
+            self.database["job"].insert_many([
+                dict(null_doc, _id="0", job="job"),
+                dict(null_doc, _id="1", job="job"),
+                {"_id": "2", "job": "job", "created_on": 1},
+                dict(null_doc, _id="3", job="job"),
+                {"_id": "4", "job": "job", "created_on": 2},
+            ])
+
+            for sort_order, expected in [
+                    (1, [["0", "1"], ["3", "2"], ["4"]]),
+                    (-1, [["4", "2"], ["3", "1"], ["0"]])]:
+                url = (
+                    "/job?job=job&sort=created_on&sort_order={}&limit=2"
+                    "&field=job&after=".format(sort_order))
+                pages = []
+                token = ""
+                while token is not None:
+                    response = self.fetch(url + token, headers=headers)
+                    self.assertEqual(200, response.code)
+                    body = json.loads(response.body)
+                    pages.append([doc["_id"] for doc in body["result"]])
+                    token = body.get("next")
+                self.assertEqual(expected, pages)
+
+    def test_get_keyset_not_valid(self):
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch("/job?limit=2&after=foo", headers=headers)
+        self.assertEqual(400, response.code)
+
+        response = self.fetch("/job?limit=2&after=WzEsIDJd", headers=headers)
+        self.assertEqual(400, response.code)
+
+    @mock.patch("utils.db.find_and_count")
+    def test_get_count_false(self, mock_find):
+        mock_find.return_value = ([{"_id": "foo"}], None)
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch("/job?job=job&count=false", headers=headers)
+
+        self.assertEqual(200, response.code)
+        self.assertEqual("none", mock_find.call_args[1]["count"])
+        self.assertDictEqual(
+            json.loads(response.body),
+            {"code": 200, "limit": 0, "skip": 0, "result": [{"_id": "foo"}]})
+
+    @mock.patch("utils.db.find_and_count")
+    def test_get_streamed(self, mock_find):
+        docs = [{"_id": str(i), "job": "job"} for i in xrange(1234)]
+        cursor = mock.MagicMock(spec=pymongo.cursor.Cursor)
+        cursor.__iter__.return_value = iter(docs)
+        mock_find.return_value = (cursor, len(docs))
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch("/job?job=job", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            response.headers["Content-Type"], self.content_type)
+        self.assertDictEqual(
+            json.loads(response.body),
+            {
+                "code": 200,
+                "count": 1234,
+                "limit": 0,
+                "skip": 0,
+                "result": docs
+            }
+        )
+        cursor.close.assert_called_once_with()
+
+    @mock.patch("utils.db.find_and_count")
+    def test_get_keyset_streamed(self, mock_find):
+        docs = [
+            {"_id": str(i), "job": "job", "created_on": i}
+            for i in xrange(1500)
+        ]
+        cursor = mock.MagicMock(spec=pymongo.cursor.Cursor)
+        cursor.__iter__.return_value = iter(docs)
+        mock_find.return_value = (cursor, None)
+
+        headers = {"Authorization": "foo"}
+        response = self.fetch(
+            "/job?sort=created_on&limit=1500&count=false&after=",
+            headers=headers)
+
+        self.assertEqual(response.code, 200)
+        body = json.loads(response.body)
+        self.assertEqual(1500, len(body["result"]))
+        self.assertEqual(
+            handlers.common.query.get_after_token(
+                docs[-1], [("created_on", -1), ("_id", -1)]),
+            body["next"])
+
     @mock.patch("utils.db.find")
     @mock.patch("utils.db.count")
     def test_get_with_limit(self, mock_count, mock_find):
@@ -256,9 +513,11 @@ class TestJobHandler(TestHandlerBase):
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
 
-    @mock.patch("handlers.base.BaseHandler._get_one")
+    @mock.patch("handlers.base.BaseHandler._get_one_async")
     def test_get_wrong_handler_response(self, mock_get_one):
-        mock_get_one.return_value = ""
+        future = tornado.concurrent.Future()
+        future.set_result("")
+        mock_get_one.return_value = future
         headers = {"Authorization": "foo"}
 
         response = self.fetch("/job/" + self.doc_id, headers=headers)
@@ -128,7 +128,7 @@ class TestJobLogsHandler(TestHandlerBase):
 
     @mock.patch("utils.db.find_and_count")
     def test_get_valid_no_id(self, mock_find):
-        mock_find.return_value = ({"_id": self.doc_id}, 1)
+        mock_find.return_value = ([{"_id": self.doc_id}], 1)
         headers = {"Authorization": "bar"}
         response = self.fetch(
             self.url + "?job=foo", method="GET", headers=headers)
@@ -136,3 +136,55 @@ class TestJobLogsHandler(TestHandlerBase):
         self.assertEqual(response.code, 200)
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
+
+    def test_get_summary_lists(self):
+        self.database["errors_summary"].insert_one({
+            "job_id": bson.objectid.ObjectId(self.doc_id),
+            "errors": [],
+            "warnings": [],
+            "mismatches": [],
+            "errors_lines": {
+                "a": {"count": 1, "line": "foo"},
+                "b": {"count": 3, "line": "bar"},
+            },
+            "warnings_lines": {
+                "c": {"count": 2, "line": "warn"},
+            },
+        })
+        headers = {"Authorization": "bar"}
+        response = self.fetch(
+            self.url_id + "?field=errors", method="GET", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        result = json.loads(response.body)["result"][0]
+        self.assertListEqual([[3, "bar"], [1, "foo"]], result["errors"])
+        self.assertNotIn("errors_lines", result)
+        self.assertNotIn("warnings", result)
+
+        response = self.fetch(
+            self.url + "?field=warnings", method="GET", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        result = json.loads(response.body)["result"][0]
+        self.assertListEqual([[2, "warn"]], result["warnings"])
+        self.assertNotIn("warnings_lines", result)
+
+    def test_get_summary_lists_aggregate(self):
+        self.database["errors_summary"].insert_one({
+            "job_id": bson.objectid.ObjectId(self.doc_id),
+            "job": "job",
+            "errors": [[2, "foo"]],
+            "errors_lines": {
+                "a": {"count": 1, "line": "foo"},
+                "b": {"count": 3, "line": "bar"},
+            },
+        })
+        headers = {"Authorization": "bar"}
+        response = self.fetch(
+            self.url + "?aggregate=job&field=job&field=errors",
+            method="GET", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        result = json.loads(response.body)["result"][0]
+        self.assertListEqual([[3, "foo"], [3, "bar"]], result["errors"])
+        self.assertNotIn("errors_lines", result)
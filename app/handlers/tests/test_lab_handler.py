@@ -22,7 +22,11 @@ import mock
 import tornado
 
 import urls
+import handlers.common.cache as hcache
+import handlers.common.token
 import handlers.response
+import models
+import models.token as mtoken
 
 from handlers.tests.test_handler_base import TestHandlerBase
 
@@ -233,6 +237,50 @@ class TestLabHandler(TestHandlerBase):
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
 
+    @mock.patch("utils.db.delete")
+    @mock.patch("utils.db.find_one2")
+    def test_delete_invalidates_token_cache(self, mock_find, mock_delete):
+        mock_delete.return_value = 200
+        mock_find.return_value = {
+            "_id": self.doc_id,
+            "token": "token"
+        }
+        token_cache = handlers.common.token.TokenCache()
+        token_cache.put("token", mtoken.Token())
+        self._app.settings["token_cache"] = token_cache
+
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/lab/" + self.doc_id, method="DELETE", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertIsNone(token_cache.get("token"))
+
+    @mock.patch("utils.db.delete")
+    @mock.patch("utils.db.find_one2")
+    def test_delete_invalidates_response_cache(self, mock_find, mock_delete):
+        mock_delete.return_value = 200
+        mock_find.return_value = {
+            "_id": self.doc_id,
+            "token": "token"
+        }
+        cache = hcache.ResponseCache(self.redisdb)
+        self._app.settings["response_cache"] = cache
+        for collection_name in [
+                models.LAB_COLLECTION, models.TOKEN_COLLECTION]:
+            cache.put(
+                collection_name, "key", handlers.response.HandlerResponse())
+
+        headers = {"Authorization": "foo"}
+
+        response = self.fetch(
+            "/lab/" + self.doc_id, method="DELETE", headers=headers)
+
+        self.assertEqual(response.code, 200)
+        self.assertIsNone(cache.get(models.LAB_COLLECTION, "key"))
+        self.assertIsNone(cache.get(models.TOKEN_COLLECTION, "key"))
+
     def test_delete_no_id(self):
         headers = {"Authorization": "foo"}
 
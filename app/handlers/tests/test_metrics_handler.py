@@ -0,0 +1,68 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Test module for the MetricsHandler handler."""
+
+import tornado
+
+import handlers.common.cache as hcache
+import handlers.response as hresponse
+import urls
+import utils.task_metrics
+
+from handlers.tests.test_handler_base import TestHandlerBase
+
+
+class TestMetricsHandler(TestHandlerBase):
+
+    def get_app(self):
+        return tornado.web.Application(urls.METRICS_URLS, **self.settings)
+
+    def test_get(self):
+        utils.task_metrics.TaskMetrics(self.redisdb).record(
+            "lava-test", "lava-test>kcidb-tests", "SUCCESS", 1.5, 3, 0.5, 7)
+
+        response = self.fetch("/metrics", method="GET")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(
+            response.headers["Content-Type"],
+            utils.task_metrics.PROMETHEUS_CONTENT_TYPE)
+        self.assertIn(
+            "kernelci_task_db_calls_total"
+            "{task=\"lava-test\",chain=\"lava-test>kcidb-tests\"} 7",
+            response.body)
+
+    def test_get_empty(self):
+        response = self.fetch("/metrics", method="GET")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual("", response.body)
+
+    def test_get_response_cache(self):
+        cache = hcache.ResponseCache(self.redisdb)
+        self._app.settings["response_cache"] = cache
+        cache.put("job", "key", hresponse.HandlerResponse())
+        cache.get("job", "key")
+        cache.get("job", "other")
+        cache.get("job", "another")
+
+        response = self.fetch("/metrics", method="GET")
+
+        self.assertEqual(response.code, 200)
+        self.assertIn("kernelci_response_cache_hits_total 1\n", response.body)
+        self.assertIn(
+            "kernelci_response_cache_misses_total 2\n", response.body)
@@ -21,6 +21,9 @@ import json
 import mock
 import tornado
 
+import handlers.common.cache as hcache
+import handlers.common.token
+import models.token as mtoken
 import urls
 
 from handlers.tests.test_handler_base import TestHandlerBase
@@ -80,6 +83,21 @@ class TestTokenHandler(TestHandlerBase):
             response.headers["Content-Type"], self.content_type)
         self.assertDictEqual(json.loads(response.body), expected_body)
 
+    @mock.patch("utils.db.find_and_count")
+    def test_get_not_cached(self, mock_find):
+        mock_find.return_value = ([{"token": "secret"}], 1)
+        cache = hcache.ResponseCache(self.redisdb)
+        self._app.settings["response_cache"] = cache
+
+        headers = {"Authorization": "foo"}
+        for _ in xrange(2):
+            response = self.fetch("/token", headers=headers)
+            self.assertEqual(response.code, 200)
+
+        self.assertEqual(2, mock_find.call_count)
+        self.assertEqual(0, cache.misses)
+        self.assertListEqual([], self.redisdb.keys("kernelci-response:*"))
+
     @mock.patch("utils.db.find_one2")
     def test_get_one(self, mock_find):
         mock_find.return_value = {"token": "foo"}
@@ -314,6 +332,25 @@ class TestTokenHandler(TestHandlerBase):
         self.assertEqual(
             response.headers["Content-Type"], self.content_type)
 
+    @mock.patch("bson.objectid.ObjectId")
+    @mock.patch("handlers.token.TokenHandler.collection")
+    def test_put_update_invalidates_cache(self, mock_collection, mock_id):
+        mock_id.return_value = "token"
+        mock_collection.find_one = mock.MagicMock()
+        mock_collection.find_one.return_value = dict(
+            _id="token", token="token")
+        token_cache = handlers.common.token.TokenCache()
+        token_cache.put("token", mtoken.Token())
+        self._app.settings["token_cache"] = token_cache
+        headers = {"Authorization": "foo", "Content-Type": "application/json"}
+        body = json.dumps(dict(admin=1))
+
+        response = self.fetch(
+            "/token/token", method="PUT", headers=headers, body=body)
+
+        self.assertEqual(response.code, 200)
+        self.assertIsNone(token_cache.get("token"))
+
     def test_put_update_wrong_id(self):
         headers = {"Authorization": "foo", "Content-Type": "application/json"}
         body = json.dumps(
@@ -76,7 +76,8 @@ class TokenHandler(hbase.BaseHandler):
                     req_token,
                     remote_ip,
                     self._token_validation_func(),
-                    self.db, master_key=master_key
+                    self.db, master_key=master_key,
+                    cache=self.token_cache
                 )
 
                 if not valid_token:
@@ -88,6 +89,15 @@ class TokenHandler(hbase.BaseHandler):
 
         return valid_token, token
 
+    def _invalidate_cached_token(self, token_doc):
+        """Drop a modified or deleted token from the token cache.
+
+        :param token_doc: The token document as stored in the database.
+        :type token_doc: dict
+        """
+        if self.token_cache is not None:
+            self.token_cache.invalidate(token_doc.get(models.TOKEN_KEY))
+
     def _get_one(self, doc_id, **kwargs):
         # Overridden: with the token we do not search by _id,
         # but by token field.
@@ -222,6 +232,7 @@ class TokenHandler(hbase.BaseHandler):
                 )
                 if response.status_code == 200:
                     response.result = {models.TOKEN_KEY: token.token}
+                    self._invalidate_cached_token(result)
             else:
                 response.status_code = 404
         except bson.errors.InvalidId, ex:
@@ -330,7 +341,8 @@ class TokenHandler(hbase.BaseHandler):
 
         try:
             token_oid = bson.objectid.ObjectId(doc_id)
-            if utils.db.find_one2(self.collection, token_oid):
+            result = utils.db.find_one2(self.collection, token_oid)
+            if result:
                 self.log.info(
                     "Token (%s) deletion from IP '%s'",
                     doc_id, self.request.remote_ip)
@@ -339,6 +351,7 @@ class TokenHandler(hbase.BaseHandler):
 
                 if ret_val == 200:
                     response.reason = "Resource '%s' deleted" % doc_id
+                    self._invalidate_cached_token(result)
                 else:
                     response.reason = "Error deleting resource '%s'" % doc_id
             else:
@@ -37,6 +37,7 @@ I18N_DOMAIN = "kernelci-backend"
 # The default ID key, and other keys, for mongodb documents and queries.
 ACCEPTED_KEYS = "accepted"
 ADDRESS_KEY = "address"
+AFTER_KEY = "after"
 AGGREGATE_KEY = "aggregate"
 ARCHITECTURE_KEY = "arch"
 ATTACHMENTS_KEY = 'attachments'
@@ -100,6 +101,7 @@ EMAIL_TXT_FORMAT_KEY = "txt"
 ENDIANNESS_KEY = "endian"
 ERRORS_COUNT_KEY = "errors_count"
 ERRORS_KEY = "errors"
+ERRORS_LINES_KEY = "errors_lines"
 EXPIRED_KEY = "expired"
 EXPIRES_KEY = "expires_on"
 FASTBOOT_CMD_KEY = "fastboot_cmd"
@@ -134,6 +136,7 @@ KERNEL_VERSION_KEY = "kernel_version"
 LAB_ID_KEY = "lab_id"
 LAB_NAME_KEY = "lab_name"
 LIMIT_KEY = "limit"
+LINE_KEY = "line"
 LOAD_ADDR_KEY = "load_addr"
 LOG_KEY = 'log'
 LOG_LINES_KEY = "log_lines"
@@ -145,10 +148,12 @@ MEASUREMENTS_KEY = "measurements"
 METADATA_KEY = "metadata"
 MISMATCHES_COUNT_KEY = "mismatches_count"
 MISMATCHES_KEY = "mismatches"
+MISMATCHES_LINES_KEY = "mismatches_lines"
 MODULES_DIR_KEY = "modules_dir"
 MODULES_KEY = "modules"
 MODULES_SIZE_KEY = "modules_size"
 NAME_KEY = "name"
+NEXT_KEY = "next"
 NOT_FIELD_KEY = "nfield"
 PARENT_ID_KEY = "parent_id"
 PLAN_KEY = "plan"
@@ -197,6 +202,7 @@ VMLINUX_FILE_SIZE_KEY = "vmlinux_file_size"
 VMLINUX_TEXT_SIZE_KEY = "vmlinux_text_size"
 WARNINGS_COUNT_KEY = "warnings_count"
 WARNINGS_KEY = "warnings"
+WARNINGS_LINES_KEY = "warnings_lines"
 
 # Email reporting control fields.
 SEND_BUILD_REPORT_KEY = "build_report"
@@ -248,12 +254,14 @@ DOCUMENT_ID_KEY = "document_id"
 DOCUMENT_KEY = "document"
 QUERY_KEY = "query"
 OP_ID_KEY = "operation_id"
+EXECUTION_TIME_KEY = "execution_time"
 DISTINCT_KEY = "distinct"
 UNIQUE_KEY = "unique"
 
 # Collection names.
 BUILD_COLLECTION = "build"
 COUNT_COLLECTION = "count"
+COUNTER_COLLECTION = "counter"
 JOB_COLLECTION = "job"
 TOKEN_COLLECTION = "api-token"
 BISECT_COLLECTION = "bisect"
@@ -266,6 +274,7 @@ TEST_REGRESSION_COLLECTION = "test_regression"
 ERROR_LOGS_COLLECTION = "error_logs"
 ERRORS_SUMMARY_COLLECTION = "errors_summary"
 DAILY_STATS_COLLECTION = "daily_stats"
+DAILY_STATS_PARTIAL_COLLECTION = "daily_stats_partial"
 # Delta collections.
 JOB_DELTA_COLLECTION = "job_delta"
 BUILD_DELTA_COLLECTION = "build_delta"
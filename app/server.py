@@ -31,7 +31,12 @@ import tornado.web
 import uuid
 
 import handlers.app as happ
+import handlers.common.cache as hcache
+import handlers.common.query_shapes as hquery_shapes
+import handlers.common.results as hresults
+import handlers.common.token as htoken
 import handlers.dbindexes as hdbindexes
+import taskqueue.celery as taskc
 import urls
 import utils.database.redisdb as redisdb
 import utils.db
@@ -45,6 +50,10 @@ topt.define(
     "max_workers", default=5, type=int,
     help="The number of workers for the thread pool executor"
 )
+topt.define(
+    "db_max_workers", default=50, type=int,
+    help="The number of workers for the database operations thread pool"
+)
 topt.define("gzip", default=True)
 topt.define("debug", default=True)
 topt.define("autoreload", default=True)
@@ -81,6 +90,87 @@ topt.define("redis_db", default=0, type=int, help="The Redis database to use")
 topt.define(
     "redis_password", default="", type=str, help="The Redis database password")
 
+# In-memory token cache parameters.
+topt.define(
+    "token_cache_size",
+    default=1024,
+    type=int, help="The number of tokens to cache in memory, 0 to disable"
+)
+topt.define(
+    "token_cache_ttl",
+    default=300, type=int, help="How long a token is cached, in seconds")
+
+# Redis cache of the GET responses.
+topt.define(
+    "response_cache_ttl",
+    default=30,
+    type=int,
+    help="How long a GET response is cached, in seconds, 0 to disable"
+)
+
+# Pre-aggregated document counters used by /count.
+topt.define(
+    "counters_ttl",
+    default=3600,
+    type=int,
+    help="How long the document counters are valid, in seconds, 0 to disable"
+)
+
+# Query shapes of the GET requests, for the index advisor.
+topt.define(
+    "query_shapes_sample_rate",
+    default=0.01,
+    type=float,
+    help="The fraction of the GET queries to explain, 0 to disable recording"
+)
+
+# Aggregations of the GET requests with the "aggregate" parameter.
+topt.define(
+    "aggregate_allow_disk_use",
+    default=False,
+    type=bool,
+    help="If the aggregations can use temporary files on disk"
+)
+
+# Results of the Celery tasks of the /batch and /bisect requests.
+topt.define(
+    "task_result_timeout",
+    default=120,
+    type=int,
+    help="How long a request waits for a task result, in seconds"
+)
+topt.define(
+    "task_results_max_in_flight",
+    default=50,
+    type=int,
+    help=(
+        "The maximum number of requests waiting for a task result, "
+        "0 to wait in the executor threads"
+    )
+)
+
+# Batch operations run in the web process instead of Celery.
+topt.define(
+    "batch_in_process_limit",
+    default=1000,
+    type=int,
+    help=(
+        "The maximum number of documents of a batch search run in the "
+        "web process, 0 to run all the batch operations with Celery"
+    )
+)
+
+# Prometheus metrics, served on the local interface only.
+topt.define(
+    "metrics_port",
+    default=0,
+    type=int,
+    help=(
+        "The port number where the /metrics endpoint listens on the local "
+        "interface, 0 to disable it"
+    )
+)
+
 # If we want to use UNIX socket for this server.
 topt.define(
     "unixsocket",
@@ -112,6 +202,10 @@ class KernelCiBackend(tornado.web.Application):
     """
     database = None
     redis_con = None
+    token_cache = None
+    response_cache = None
+    query_shapes = None
+    result_waiter = None
 
     def __init__(self):
 
@@ -133,9 +227,45 @@ class KernelCiBackend(tornado.web.Application):
         if not self.redis_con:
             self.redis_con = redisdb.get_db_connection(db_options)
 
+        if not self.token_cache and topt.options.token_cache_size > 0:
+            self.token_cache = htoken.TokenCache(
+                max_size=topt.options.token_cache_size,
+                ttl=topt.options.token_cache_ttl,
+                redis_conn=self.redis_con)
+            self.token_cache.subscribe()
+
+        if not self.response_cache and topt.options.response_cache_ttl > 0:
+            self.response_cache = hcache.ResponseCache(
+                self.redis_con, ttl=topt.options.response_cache_ttl)
+
+        if not self.query_shapes and \
+                topt.options.query_shapes_sample_rate > 0:
+            self.query_shapes = hquery_shapes.QueryShapeRecorder(
+                self.redis_con,
+                sample_rate=topt.options.query_shapes_sample_rate)
+
+        backend_client = getattr(taskc.app.backend, "client", None)
+        if not self.result_waiter and backend_client is not None and \
+                topt.options.task_results_max_in_flight > 0:
+            self.result_waiter = hresults.ResultWaiter(
+                backend_client,
+                taskc.app.backend.get_key_for_task,
+                max_in_flight=topt.options.task_results_max_in_flight)
+
+        utils.db.get_db_executor(topt.options.db_max_workers)
+
         settings = {
             "database": self.database,
             "redis_connection": self.redis_con,
+            "token_cache": self.token_cache,
+            "response_cache": self.response_cache,
+            "query_shapes": self.query_shapes,
+            "result_waiter": self.result_waiter,
+            "task_result_timeout": topt.options.task_result_timeout,
+            "batch_in_process_limit": topt.options.batch_in_process_limit,
+            "counters_ttl": topt.options.counters_ttl,
+            "aggregate_allow_disk_use":
+                topt.options.aggregate_allow_disk_use,
             "dboptions": db_options,
             "default_handler_class": happ.AppHandler,
             "executor": concurrent.futures.ThreadPoolExecutor(
@@ -174,6 +304,15 @@ if __name__ == "__main__":
             "/tmp/kernelci-backend.socket")
         server.add_socket(unix_socket)
     else:
-        KernelCiBackend().listen(topt.options.port, **HTTP_SETTINGS)
+        application = KernelCiBackend()
+        application.listen(topt.options.port, **HTTP_SETTINGS)
+
+    if topt.options.metrics_port:
+        metrics_application = tornado.web.Application(
+            urls.METRICS_URLS,
+            redis_connection=application.redis_con,
+            response_cache=application.response_cache)
+        metrics_application.listen(
+            topt.options.metrics_port, address="127.0.0.1")
 
     tornado.ioloop.IOLoop.instance().start()
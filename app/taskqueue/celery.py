@@ -28,8 +28,14 @@ import celery.signals
 import io
 import kombu.serialization
 import os
+import socket
+
+import handlers.common.cache
 import utils
-from utils.kcidb import KcidbSubmit
+import utils.database.redisdb as redisdb
+import utils.db
+import utils.kcidb
+import utils.task_metrics
 
 import taskqueue.celeryconfig as celeryconfig
 import taskqueue.serializer as serializer
@@ -82,21 +88,55 @@ if os.path.exists(CELERY_CONFIG_FILE):
 app.conf.update(CELERYBEAT_SCHEDULE=CELERYBEAT_SCHEDULE)
 
 app.kcidb_pool = {}
+# The TaskMetrics object of a worker process.
+app.task_metrics = None
+# The KcidbMetricsRecorder object of a worker process.
+app.kcidb_metrics = None
+
+
+def invalidate_response_cache(*collections):
+    """Drop the API responses cached for the modified collections.
+
+    :param collections: The names of the collections.
+    :type collections: str
+    """
+    handlers.common.cache.invalidate(
+        redisdb.get_db_connection(app.conf.db_options), *collections)
 
 
 @celery.signals.worker_process_init.connect
 def worker_init_handler(*args, **kwargs):
+    # The MongoDB clients of the parent process cannot be used after fork().
+    utils.db.reset_db_clients()
+    if app.conf.get("task_metrics", True):
+        app.task_metrics = utils.task_metrics.TaskMetrics(
+            redisdb.get_db_connection(app.conf.db_options),
+            slow_threshold=app.conf.get("slow_task_threshold", 30))
     kcidb_options = app.conf.get("kcidb_options")
     if kcidb_options:
         pid = os.getpid()
         if kcidb_options.get("debug"):
-            utils.LOG.info("Creating KcidbSubmit object for PID: {}"
+            utils.LOG.info("Creating kcidb submitter for PID: {}"
                            .format(pid))
-        app.kcidb_pool[pid] = KcidbSubmit(kcidb_options)
+        kcidb_submit = utils.kcidb.create_submitter(kcidb_options)
+        app.kcidb_pool[pid] = kcidb_submit
+        if app.task_metrics is not None and \
+                hasattr(kcidb_submit, "get_metrics"):
+            app.kcidb_metrics = utils.task_metrics.KcidbMetricsRecorder(
+                app.task_metrics,
+                "{}:{}".format(socket.gethostname(), pid), kcidb_submit)
+            app.kcidb_metrics.start()
 
 
 @celery.signals.worker_process_shutdown.connect
 def worker_process_init_handler(*args, **kwargs):
+    utils.LOG.info(
+        "MongoDB connection pool metrics: {}".format(
+            utils.db.get_pool_metrics()))
+    utils.db.close_db_clients()
+    if app.kcidb_metrics is not None:
+        app.kcidb_metrics.stop()
+        app.kcidb_metrics = None
     kcidb_options = app.conf.get("kcidb_options")
     if kcidb_options:
         pid = os.getpid()
@@ -106,9 +146,34 @@ def worker_process_init_handler(*args, **kwargs):
                 utils.LOG.info('Terminating kcidb-submit for worker pid: {}'
                                .format(pid))
             kcidb_submit.terminate()
+            if hasattr(kcidb_submit, "get_metrics"):
+                utils.LOG.info(
+                    "kcidb submission metrics: {}".format(
+                        kcidb_submit.get_metrics()))
         elif kcidb_options.get("debug"):
             utils.LOG.info('No kcidb-submit for worker pid: {}'.format(pid))
 
 
+@celery.signals.before_task_publish.connect
+def before_task_publish_handler(body=None, headers=None, **kwargs):
+    # Tasks published by a task, like the next ones of a chain, are part of
+    # its chain.
+    parent = app.current_task
+    utils.task_metrics.set_publish_headers(
+        body, headers, parent.request.headers if parent else None)
+
+
+@celery.signals.task_prerun.connect
+def task_prerun_handler(task_id=None, task=None, **kwargs):
+    if app.task_metrics is not None:
+        app.task_metrics.task_started(task_id, task.request.headers)
+
+
+@celery.signals.task_postrun.connect
+def task_postrun_handler(task_id=None, task=None, state=None, **kwargs):
+    if app.task_metrics is not None:
+        app.task_metrics.task_finished(task_id, task.name, state)
+
+
 if __name__ == "__main__":
     app.start()
@@ -58,6 +58,8 @@ def import_build(json_obj):
     # another function.
     build_id, job_id, errors = utils.build.import_single_build(
         json_obj, taskc.app.conf.db_options)
+    taskc.invalidate_response_cache(
+        models.BUILD_COLLECTION, models.JOB_COLLECTION)
 
     # TODO: handle errors.
     return build_id, job_id, first
@@ -77,7 +79,11 @@ def parse_single_build_log(prev_res):
     :return A 2-tuple: The status code, and the errors data structure.
     """
     status, errors = utils.log_parser.parse_single_build_log(
-        prev_res[0], prev_res[1], taskc.app.conf.db_options)
+        prev_res[0], prev_res[1], taskc.app.conf.db_options,
+        processes=taskc.app.conf.get("log_parser_processes", 0))
+    taskc.invalidate_response_cache(
+        models.BUILD_COLLECTION,
+        models.ERROR_LOGS_COLLECTION, models.ERRORS_SUMMARY_COLLECTION)
     # TODO: handle errors.
     return status
 
@@ -21,6 +21,7 @@
 """All callback related celery tasks."""
 
 import taskqueue.celery as taskc
+import models
 import utils
 import utils.callback
 
@@ -38,5 +39,8 @@ def lava_test(json_obj, job_meta, lab_name):
     :type lab_name: string
     :return ObjectId The test document object id.
     """
-    return utils.callback.lava.add_tests(json_obj, job_meta, lab_name,
-                                         taskc.app.conf.db_options)
+    ret_val = utils.callback.lava.add_tests(json_obj, job_meta, lab_name,
+                                            taskc.app.conf.db_options)
+    taskc.invalidate_response_cache(
+        models.TEST_GROUP_COLLECTION, models.TEST_CASE_COLLECTION)
+    return ret_val
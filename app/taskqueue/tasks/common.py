@@ -38,23 +38,34 @@ def execute_batch(json_obj, db_options):
     return utils.batch.common.execute_batch_operation(json_obj, db_options)
 
 
-def run_batch_group(batch_op_list, db_options):
-    """Execute a list of batch operations.
+def apply_batch_group(batch_op_list, db_options):
+    """Start the execution of a list of batch operations.
 
     :param batch_op_list: List of JSON object used to build the batch
     operation.
     :type batch_op_list: list
     :param db_options: The database connection parameters.
     :type db_options: dict
-    :return A list with all the results.
+    :return The `celery.result.GroupResult` of the operations.
     """
     job = celery.group(
         execute_batch.s(batch_op, db_options)
         for batch_op in batch_op_list
     )
-    result = job.apply_async()
-    while not result.ready():
-        pass
+    return job.apply_async()
+
+
+def run_batch_group(batch_op_list, db_options):
+    """Execute a list of batch operations.
+
+    :param batch_op_list: List of JSON object used to build the batch
+    operation.
+    :type batch_op_list: list
+    :param db_options: The database connection parameters.
+    :type db_options: dict
+    :return A list with all the results.
+    """
+    result = apply_batch_group(batch_op_list, db_options)
     # Use the result backend optimezed function to retrieve the results.
     # We are using redis.
     return result.join_native()
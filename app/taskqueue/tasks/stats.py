@@ -20,6 +20,7 @@
 import taskqueue.celery as taskc
 
 import utils
+import utils.counters
 import utils.db
 import utils.stats.daily
 
@@ -34,3 +35,16 @@ def calculate_daily_statistics():
     ret_val, doc_id = utils.db.save(database, daily_stats)
 
     return ret_val, doc_id
+
+
+@taskc.app.task(name="rebuild-counters")
+def rebuild_counters(collection_name, ttl):
+    """Rebuild the document counters of a collection.
+
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param ttl: How long the counters are valid, in seconds.
+    :type ttl: int
+    """
+    database = utils.db.get_db_connection(taskc.app.conf.db_options)
+    utils.counters.rebuild(database, collection_name, ttl)
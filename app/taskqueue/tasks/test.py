@@ -24,6 +24,7 @@
 
 """All test related celery tasks."""
 
+import models
 import taskqueue.celery as taskc
 import utils
 import utils.kci_test.regressions
@@ -40,4 +41,8 @@ def find_regression(group_id):
     :return tuple 200 if OK, 500 in case of errors; a list with created test
     regression document ids
     """
-    return utils.kci_test.regressions.find(group_id, taskc.app.conf.db_options)
+    ret_val = utils.kci_test.regressions.find(
+        group_id, taskc.app.conf.db_options)
+    taskc.invalidate_response_cache(
+        models.TEST_REGRESSION_COLLECTION, models.TEST_CASE_COLLECTION)
+    return ret_val
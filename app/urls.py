@@ -34,6 +34,7 @@ import handlers.distinct
 import handlers.job
 import handlers.job_logs
 import handlers.lab
+import handlers.metrics
 import handlers.report
 import handlers.send
 import handlers.stats
@@ -164,6 +165,9 @@ _LAVA_CALLBACK_URL = tornado.web.url(
     handlers.callback.LavaCallbackHandler, name="callback-lava"
 )
 
+_METRICS_URL = tornado.web.url(
+    r"/metrics/?$", handlers.metrics.MetricsHandler, name="metrics")
+
 APP_URLS = [
     _BATCH_URL,
     _BISECT_URL,
@@ -195,3 +199,8 @@ APP_URLS = [
     _UPLOAD_URL,
     _VERSION_URL
 ]
+
+# Served on the local interface only.
+METRICS_URLS = [
+    _METRICS_URL
+]
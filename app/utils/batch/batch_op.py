@@ -93,6 +93,14 @@ class BatchOperation(object):
             self._database = utils.db.get_db_connection(self.db_options)
         return self._database
 
+    @database.setter
+    def database(self, value):
+        """Set the database connection to use.
+
+        :param value: The database connection.
+        """
+        self._database = value
+
     def prepare_operation(self):
         """Prepare the operation that needs to be performed.
 
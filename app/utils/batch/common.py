@@ -21,11 +21,14 @@
 
 """Common functions for batch operations."""
 
+import concurrent.futures
+import time
 import types
 import urllib
 
 import models
 import utils.batch.batch_op as batchop
+import utils.db
 
 
 def get_batch_query_args(query):
@@ -66,7 +69,7 @@ def get_batch_query_args(query):
     return {k: list(v) for k, v in args.iteritems()}
 
 
-def create_batch_operation(json_obj, db_options):
+def create_batch_operation(json_obj, db_options, database=None):
     """Create a `BatchOperation` object from a JSON object.
 
     No validity checks are performed on the JSON object, it must be a valid
@@ -76,6 +79,8 @@ def create_batch_operation(json_obj, db_options):
     :type json_obj: dict
     :param db_options: The mongodb configuration parameters.
     :type db_options: dict
+    :param database: The database connection to use, default to a connection
+    created from `db_options`.
     :return A `BatchOperation` object, or None if the `BatchOperation` cannot
     be constructed.
     """
@@ -84,6 +89,8 @@ def create_batch_operation(json_obj, db_options):
 
     def _complete_batch_op():
         batch_op.db_options = db_options
+        if database is not None:
+            batch_op.database = database
         batch_op.query_args = get_batch_query_args(
             get_func(models.QUERY_KEY, None))
 
@@ -123,20 +130,96 @@ def create_batch_operation(json_obj, db_options):
     return batch_op
 
 
-def execute_batch_operation(json_obj, db_options):
+def execute_batch_operation(json_obj, db_options, database=None):
     """Create and execute the batch op as defined in the JSON object.
 
+    The time taken by the operation, in seconds, is added to its result.
+
     :param json_obj: The JSON object that will be used to create the batch
     operation.
     :type json_obj: dict
     :param db_options: The mongodb database connection parameters.
     :type db_options: dict
+    :param database: The database connection to use, default to a connection
+    created from `db_options`.
     :return The result of the operation execution, or None.
     """
-    batch_op = create_batch_operation(json_obj, db_options)
+    batch_op = create_batch_operation(json_obj, db_options, database=database)
 
     result = None
     if batch_op:
+        start = time.time()
         result = batch_op.run()
+        result[models.EXECUTION_TIME_KEY] = time.time() - start
 
     return result
+
+
+def is_in_process_operation(json_obj, max_limit):
+    """Check if a batch operation is quick enough to run in the web process.
+
+    The operations on one document, the counts and the distinct values are
+    run in the web process, as well as the searches returning at most
+    `max_limit` documents.  The aggregations and the unbounded searches are
+    left to Celery.
+
+    :param json_obj: The JSON object of the batch operation.
+    :type json_obj: dict
+    :param max_limit: The maximum number of documents of a search.
+    :type max_limit: int
+    :return True or False.
+    """
+    get_func = json_obj.get
+
+    if any([get_func(models.DISTINCT_KEY, None),
+            get_func(models.DOCUMENT_KEY, None),
+            get_func(models.RESOURCE_KEY, None) == models.COUNT_COLLECTION]):
+        return True
+
+    query_args = get_batch_query_args(get_func(models.QUERY_KEY, None))
+    if models.AGGREGATE_KEY in query_args:
+        return False
+
+    try:
+        limit = int(query_args[models.LIMIT_KEY][0])
+    except (KeyError, ValueError):
+        return False
+
+    return 0 < limit <= max_limit
+
+
+def run_batch_operations(batch_op_list, db_options, database, timeout=None):
+    """Execute batch operations in the database thread pool.
+
+    The operations run concurrently and share the same database connection.
+
+    :param batch_op_list: The JSON objects of the batch operations.
+    :type batch_op_list: list
+    :param db_options: The mongodb database connection parameters.
+    :type db_options: dict
+    :param database: The database connection to use.
+    :param timeout: How long to wait for the results, in seconds.
+    :type timeout: int
+    :return The list of the results, in the order of the operations.
+    :raise concurrent.futures.TimeoutError if the timeout expires.
+    """
+    futures = [
+        utils.db.run_async(
+            execute_batch_operation, batch_op, db_options, database=database)
+        for batch_op in batch_op_list
+    ]
+
+    deadline = time.time() + timeout if timeout else None
+    results = []
+    try:
+        for future in futures:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            results.append(future.result(remaining))
+    except concurrent.futures.TimeoutError:
+        for future in futures:
+            future.cancel()
+        raise
+
+    return results
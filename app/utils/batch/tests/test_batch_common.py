@@ -19,7 +19,7 @@
 # along with this library; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-
+import mongomock
 import unittest
 
 from utils.batch.batch_op import (
@@ -33,7 +33,10 @@ from utils.batch.batch_op import (
 )
 from utils.batch.common import (
     create_batch_operation,
-    get_batch_query_args
+    execute_batch_operation,
+    get_batch_query_args,
+    is_in_process_operation,
+    run_batch_operations
 )
 
 
@@ -170,3 +173,62 @@ class TestBatch(unittest.TestCase):
         op = create_batch_operation(json_obj, {})
         self.assertIsInstance(op, BatchDistinctOperation)
         self.assertEqual("arch", op.distinct)
+
+    def test_is_in_process_operation(self):
+        self.assertTrue(is_in_process_operation(
+            {"resource": "count", "document": "job"}, 100))
+        self.assertTrue(is_in_process_operation(
+            {"resource": "build", "distinct": "arch"}, 100))
+        self.assertTrue(is_in_process_operation(
+            {"resource": "job", "query": "job=foo&limit=100"}, 100))
+        self.assertFalse(is_in_process_operation(
+            {"resource": "job", "query": "job=foo&limit=101"}, 100))
+        self.assertFalse(is_in_process_operation(
+            {"resource": "job", "query": "job=foo"}, 100))
+        self.assertFalse(is_in_process_operation(
+            {"resource": "job", "query": "limit=foo"}, 100))
+        self.assertFalse(is_in_process_operation(
+            {"resource": "job", "query": "aggregate=job&limit=10"}, 100))
+
+    def test_execute_batch_operation_database(self):
+        database = mongomock.MongoClient()["kernel-ci"]
+        database["job"].insert_many(
+            [{"job": "foo", "kernel": str(i)} for i in range(3)])
+        json_obj = {
+            "method": "GET",
+            "resource": "job",
+            "query": "job=foo&limit=2",
+            "operation_id": "jobs"
+        }
+
+        result = execute_batch_operation(json_obj, {}, database=database)
+
+        self.assertEqual("jobs", result["operation_id"])
+        self.assertEqual(2, result["result"][0]["count"])
+        self.assertEqual(2, len(result["result"][0]["result"]))
+        self.assertGreaterEqual(result["execution_time"], 0)
+
+    def test_run_batch_operations(self):
+        database = mongomock.MongoClient()["kernel-ci"]
+        database["job"].insert_one({"job": "foo"})
+        database["build"].insert_one({"job": "foo", "arch": "arm"})
+        operations = [
+            {
+                "method": "GET",
+                "resource": "job",
+                "query": "limit=1",
+                "operation_id": "job"
+            },
+            {
+                "method": "GET",
+                "resource": "build",
+                "distinct": "arch",
+                "operation_id": "arch"
+            },
+        ]
+
+        results = run_batch_operations(operations, {}, database, timeout=10)
+
+        self.assertListEqual(
+            ["job", "arch"], [result["operation_id"] for result in results])
+        self.assertEqual(["arm"], results[1]["result"][0]["result"])
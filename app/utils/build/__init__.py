@@ -45,6 +45,7 @@ import models
 import models.build as mbuild
 import models.job as mjob
 import utils
+import utils.counters
 import utils.database.redisdb as redisdb
 import utils.db
 import utils.errors
@@ -73,10 +74,12 @@ def _search_prev_build_doc(build_doc, database):
 
     :param build_doc: The new defconfig document.
     :param database: The db connection.
-    :return The previous doc ID and its creation date, or None.
+    :return The previous doc ID, its creation date and the previous doc, or
+    None.
     """
     doc_id = None
     c_date = None
+    prev_doc = None
 
     if build_doc and database:
         spec = {
@@ -103,7 +106,7 @@ def _search_prev_build_doc(build_doc, database):
                     "Cannot keep old document ID, don't know which one to "
                     "use!")
 
-    return doc_id, c_date
+    return doc_id, c_date, prev_doc
 
 
 class BuildError(Exception):
@@ -125,6 +128,7 @@ def _update_job_doc(job_doc, job_id, status, build_doc, database):
     """
     to_update = False
     ret_val = 201
+    prev_status = job_doc.status
 
     if (job_id and job_doc.id != job_id):
         job_doc.id = job_id
@@ -173,6 +177,12 @@ def _update_job_doc(job_doc, job_id, status, build_doc, database):
 
     if to_update:
         ret_val, _ = utils.db.save(database, job_doc)
+        if ret_val == 201 and prev_status != job_doc.status:
+            prev_doc = job_doc.to_dict()
+            prev_doc[models.STATUS_KEY] = prev_status
+            utils.counters.update(
+                database, models.JOB_COLLECTION,
+                added=[job_doc.to_dict()], removed=[prev_doc])
     return ret_val
 
 
@@ -219,6 +229,10 @@ def _get_or_create_job(meta, database, db_options):
             job_doc.created_on = datetime.datetime.now(tz=bson.tz_util.utc)
             ret_val, job_id = utils.db.save(database, job_doc)
             job_doc.id = job_id
+            if ret_val == 201:
+                utils.counters.update(
+                    database, models.JOB_COLLECTION,
+                    added=[job_doc.to_dict()])
 
     return ret_val, job_doc, job_id
 
@@ -354,7 +368,7 @@ def import_single_build(meta, db_options, base_path=utils.BASE_PATH):
     build_doc = _get_build(meta, database)
     build_doc.job_id = job_doc.id
 
-    doc_id, c_date = _search_prev_build_doc(build_doc, database)
+    doc_id, c_date, prev_doc = _search_prev_build_doc(build_doc, database)
     build_doc.id = doc_id
     build_doc.created_on = c_date or datetime.datetime.now(tz=bson.tz_util.utc)
 
@@ -367,4 +381,8 @@ def import_single_build(meta, db_options, base_path=utils.BASE_PATH):
     if ret_val != 201:
         return None, None, {500: ["Failed to save build document"]}
 
+    utils.counters.update(
+        database, models.BUILD_COLLECTION,
+        added=[build_doc.to_dict()], removed=[prev_doc] if prev_doc else None)
+
     return build_id, job_id, {}
@@ -26,7 +26,7 @@
 # along with this library; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
-import codecs
+import bisect
 import dateutil.parser as dparser
 import errno
 import models
@@ -69,6 +69,12 @@ TEST_CASE_NAME_EXTRA = {
     "test-install-overlay": ["name"],
 }
 
+# Use the libyaml parser when available, LAVA logs can be very large.
+YAML_LOADER = getattr(yaml, "CLoader", yaml.Loader)
+
+# Renderer of the plain text and HTML test logs, shared by all the callbacks.
+LOG_RENDERER = utils.lava_log_parser.LogRenderer()
+
 BL_META_MAP = {
     "ramdisk_addr": "initrd_addr",
     "kernel_addr": "loadaddr",
@@ -135,7 +141,7 @@ class LavaCallback(object):
         self.results = self._prepare_results(job_data["results"])
         self.meta = self._prepare_meta(job_data, definition_meta, lab_name)
         self.definition = yaml.load(job_data["definition"],
-                                    Loader=yaml.CLoader)
+                                    Loader=YAML_LOADER)
         self.log = self._prepare_log(job_data["log"])
 
     def _get_lava_job_meta(self, boot_meta):
@@ -273,11 +279,11 @@ class LavaCallback(object):
         return meta
 
     def _prepare_results(self, results):
-        return {test_suite: yaml.load(results_yaml, Loader=yaml.CLoader)
+        return {test_suite: yaml.load(results_yaml, Loader=YAML_LOADER)
                 for test_suite, results_yaml in results.items()}
 
     def _prepare_log(self, log):
-        log = yaml.load(log, Loader=yaml.CLoader)
+        log = yaml.load(log, Loader=YAML_LOADER)
         for log_line in log:
             log_line['msg'] = unicode(log_line['msg'])
         return log
@@ -352,7 +358,7 @@ def store_lava_json(metadata, job_data):
         f.write(json.dumps(job_data))
 
 
-def store_test_log(metadata, log):
+def store_test_log(metadata, log, compress=False):
     """Parse and save test logs
 
     Parse the LAVA v2 log in YAML format and save it
@@ -361,6 +367,8 @@ def store_test_log(metadata, log):
     :type metadata: dict
     :param log: LAVA log lines extracted from callback
     :type log: list
+    :param compress: Also save gzip-compressed copies of the logs
+    :type compress: bool
     """
 
     dir_path = metadata[models.DIRECTORY_PATH]
@@ -373,9 +381,7 @@ def store_test_log(metadata, log):
      metadata[models.BOOT_LOG_HTML_KEY]) = files
     txt_path, html_path = (os.path.join(dir_path, f) for f in files)
     utils.make_path(dir_path)
-    with codecs.open(txt_path, "w", "utf-8") as txt:
-        with codecs.open(html_path, "w", "utf-8") as html:
-            utils.lava_log_parser.run(log, metadata, txt, html)
+    LOG_RENDERER.write_files(log, metadata, txt_path, html_path, compress)
 
 
 class LogFragmentsMixin(object):
@@ -389,10 +395,32 @@ class LogFragmentsMixin(object):
     LOGIN_CASE_END_PATTERN = re.compile(r'end:.*login-action.*')
     TEST_CASE_SIGNAL_PATTERN = re.compile(
         r'<LAVA_SIGNAL_TESTCASE TEST_CASE_ID.+>')
+    SIGNAL_SENT_PATTERN = re.compile(
+        r'<LAVA_SIGNAL_TESTCASE TEST_CASE_ID=([^\s>]+)')
     SIGNAL_RECEIVED_PATTERN = re.compile(
-        r'Received signal: <TESTCASE> TEST_CASE_ID=(\w+)')
+        r'Received signal: <TESTCASE> TEST_CASE_ID=([^\s>]+)')
+
+    def _index_log(self):
+        """Index the log lines used to extract the fragments
+
+        Scan the log once to find the line where the login test case ends and
+        the lines where each test case signal is sent, so that the fragments
+        can be extracted without scanning the log again for each test case.
+        """
+        self._login_end_line = None
+        self._signal_lines = {}
+        for line_number, line in enumerate(self.log):
+            msg = unicode(line.get('msg', ''))
+            if self._login_end_line is None and \
+                    self.LOGIN_CASE_END_PATTERN.match(msg):
+                self._login_end_line = line_number
+            signal = self.SIGNAL_SENT_PATTERN.match(msg)
+            if signal:
+                self._signal_lines.setdefault(
+                    signal.group(1), []).append(line_number)
 
     def _add_log_fragments(self):
+        self._index_log()
         lines_map = []
         for path, tc in self._test_case_iter():
             tc = tc
@@ -419,23 +447,14 @@ class LogFragmentsMixin(object):
 
         :return line number (int)
         """
-        line_number = self._get_log_line_number(self.LOGIN_CASE_END_PATTERN)
+        line_number = self._login_end_line
         return 0 if line_number is None else line_number
 
-    def _get_log_line_number(self, pattern):
-        for line_number, line in enumerate(self.log):
-            msg = line.get('msg', '')
-            if pattern.match(unicode(msg)) is not None:
-                return line_number
-
     def _find_new_end_line(self, end_line_number, test_case_id):
-        signal_snd_template = r'<LAVA_SIGNAL_TESTCASE TEST_CASE_ID={}'
-        signal_snd_text = signal_snd_template.format(test_case_id)
-        signal_snd_pattern = re.compile(signal_snd_text)
-        for i, log_line in enumerate(reversed(self.log[:end_line_number]), 1):
-            if signal_snd_pattern.match(unicode(log_line['msg'])):
-                return end_line_number - i
-        return end_line_number
+        """Find the last line sending the test case signal before a line"""
+        signal_lines = self._signal_lines.get(test_case_id, [])
+        index = bisect.bisect_left(signal_lines, end_line_number)
+        return signal_lines[index - 1] if index else end_line_number
 
     def _adjust_log_end_line(self, end_line_number):
         log_end_line = self.log[end_line_number]
@@ -22,7 +22,7 @@ import os
 import unittest
 import yaml
 
-from utils.callback.lava import add_tests
+from utils.callback.lava import LogFragmentsMixin, add_tests
 
 
 class TestLavaCallback(unittest.TestCase):
@@ -95,3 +95,40 @@ class TestLavaCallback(unittest.TestCase):
         log_lines = connection.test_case.find_one(
             {'test_case_path': 'baseline.dmesg.emerg'})['log_lines']
         self.assertGreater(len(log_lines), 0)
+
+    def test_log_fragments_index(self):
+        def _line(msg):
+            return {'dt': '2020-01-01T00:00:00', 'lvl': 'target', 'msg': msg}
+
+        signal = '<LAVA_SIGNAL_TESTCASE TEST_CASE_ID={} RESULT=pass>'
+        received = 'Received signal: <TESTCASE> TEST_CASE_ID={} RESULT=pass'
+        messages = [
+            'boot',
+            'end: 2.4.4 auto-login-action (duration 00:00:10)',
+            'test-a output',
+            signal.format('test-a'),
+            received.format('test-a'),
+            'test-b output',
+            signal.format('test-b'),
+            'test-b more output',
+            signal.format('test-b'),
+            received.format('test-b'),
+        ]
+        fragments = LogFragmentsMixin()
+        fragments.log = [_line(msg) for msg in messages]
+        fragments.groups = [{
+            'name': 'group',
+            'test_cases': [
+                {'name': 'test-a', 'log_end_line': '4'},
+                {'name': 'test-b', 'log_end_line': 9},
+            ],
+        }]
+
+        fragments._add_log_fragments()
+
+        self.assertEqual(1, fragments.start_log_line)
+        test_a, test_b = fragments.groups[0]['test_cases']
+        self.assertEqual(
+            messages[1:3], [line['msg'] for line in test_a['log_lines']])
+        self.assertEqual(
+            messages[4:8], [line['msg'] for line in test_b['log_lines']])
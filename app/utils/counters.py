@@ -0,0 +1,312 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Pre-aggregated document counters.
+
+The number of documents of the counted collections is stored in the counter
+collection, for each combination of the values of `COUNTER_KEYS` found in the
+documents: one counter for the whole collection, one for each job, one for
+each job and kernel, and so on.  The code paths importing documents update
+the counters with `$inc` operations.
+
+The counters of a collection are rebuilt from an aggregation when they are
+read for the first time, after they have been invalidated and when they
+expire.  Expiring the counters corrects the increments that can be lost when
+a rebuild runs concurrently with an import.  The rebuild is claimed by one of
+the readers and runs in the background, the documents are counted with a
+query until it is done.
+"""
+
+import bson
+import itertools
+import json
+import pymongo
+import pymongo.errors
+import time
+import types
+
+import models
+import utils
+
+# The keys of the counted query specs, in alphabetical order.
+COUNTER_KEYS = [
+    models.GIT_BRANCH_KEY,
+    models.JOB_KEY,
+    models.KERNEL_KEY,
+    models.STATUS_KEY,
+]
+
+# Keys of the document that marks the counters of a collection as valid.
+EXPIRES = "expires"
+GENERATION = "generation"
+REBUILDING = "rebuilding"
+
+# How long a claimed rebuild can take before it is claimed again, in seconds.
+REBUILD_TIMEOUT = 600
+
+
+def _counter_id(collection_name, values):
+    """Get the ID of a counter document.
+
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param values: The sorted (key, value) pairs of the counter.
+    :type values: list
+    :return The ID as a string.
+    """
+    return "{:s}:{:s}".format(
+        collection_name, json.dumps(values, separators=(",", ":")))
+
+
+def _get_counter_ids(collection_name, doc):
+    """Get the IDs of all the counters of a document.
+
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param doc: The document, or the group of an aggregation.
+    :type doc: dict
+    :return A generator of counter IDs.
+    """
+    values = [
+        [key, doc[key]] for key in COUNTER_KEYS if doc.get(key) is not None]
+    for length in xrange(len(values) + 1):
+        for combination in itertools.combinations(values, length):
+            yield _counter_id(collection_name, list(combination))
+
+
+def get_spec_values(spec):
+    """Get the counter values of a query spec.
+
+    :param spec: The query spec.
+    :type spec: dict
+    :return The sorted list of [key, value] pairs, or None if the query
+    cannot be answered with a counter.
+    """
+    for key, value in spec.iteritems():
+        if key not in COUNTER_KEYS or \
+                not isinstance(value, types.StringTypes):
+            return None
+    return [[key, spec[key]] for key in sorted(spec)]
+
+
+def update(database, collection_name, added=None, removed=None):
+    """Update the counters after some documents have been saved.
+
+    :param database: The database connection.
+    :param collection_name: The name of the collection of the documents.
+    :type collection_name: str
+    :param added: The documents added to the collection.
+    :type added: list
+    :param removed: The documents removed from the collection, or the
+    previous values of the replaced ones.
+    :type removed: list
+    """
+    if collection_name not in models.COUNT_COLLECTIONS:
+        return
+
+    increments = {}
+    for docs, increment in [(added, 1), (removed, -1)]:
+        for doc in docs or []:
+            for counter_id in _get_counter_ids(collection_name, doc):
+                increments[counter_id] = \
+                    increments.get(counter_id, 0) + increment
+
+    requests = [
+        pymongo.UpdateOne(
+            {models.ID_KEY: counter_id},
+            {
+                "$inc": {models.COUNT_KEY: increment},
+                "$setOnInsert": {models.COLLECTION_KEY: collection_name},
+            },
+            upsert=True)
+        for counter_id, increment in increments.iteritems() if increment
+    ]
+
+    if requests:
+        try:
+            database[models.COUNTER_COLLECTION].bulk_write(
+                requests, ordered=False)
+        except pymongo.errors.PyMongoError, ex:
+            utils.LOG.error("Error updating the %s counters", collection_name)
+            utils.LOG.exception(ex)
+            invalidate(database, collection_name)
+
+
+def invalidate(database, collection_name):
+    """Make the counters of a collection be rebuilt when read next.
+
+    This has to be called when the documents are modified in a way that
+    cannot be tracked with `update`.
+
+    :param database: The database connection.
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    """
+    try:
+        database[models.COUNTER_COLLECTION].delete_one(
+            {models.ID_KEY: collection_name})
+    except pymongo.errors.PyMongoError, ex:
+        utils.LOG.error(
+            "Error invalidating the %s counters", collection_name)
+        utils.LOG.exception(ex)
+
+
+def rebuild(database, collection_name, ttl):
+    """Count the documents of a collection and store all its counters.
+
+    :param database: The database connection.
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param ttl: How long the counters are valid, in seconds.
+    :type ttl: int
+    :return A dictionary with the counter IDs as keys and the counts as
+    values.
+    """
+    pipeline = [{
+        "$group": {
+            models.ID_KEY: {
+                key: {"$ifNull": ["$" + key, None]} for key in COUNTER_KEYS
+            },
+            models.COUNT_KEY: {"$sum": 1},
+        }
+    }]
+
+    counts = {_counter_id(collection_name, []): 0}
+    for group in database[collection_name].aggregate(
+            pipeline, allowDiskUse=True):
+        for counter_id in _get_counter_ids(
+                collection_name, group[models.ID_KEY]):
+            counts[counter_id] = \
+                counts.get(counter_id, 0) + group[models.COUNT_KEY]
+
+    generation = bson.objectid.ObjectId()
+    requests = [
+        pymongo.ReplaceOne(
+            {models.ID_KEY: counter_id},
+            {
+                models.COLLECTION_KEY: collection_name,
+                models.COUNT_KEY: count,
+                GENERATION: generation,
+            },
+            upsert=True)
+        for counter_id, count in counts.iteritems()
+    ]
+    # The counters of the previous generations that have not been replaced
+    # are for values not found anymore.  The ones created by `update` since
+    # the aggregation have no generation and are kept.
+    requests.append(pymongo.DeleteMany({
+        models.COLLECTION_KEY: collection_name,
+        GENERATION: {"$exists": True, "$ne": generation},
+    }))
+    requests.append(pymongo.ReplaceOne(
+        {models.ID_KEY: collection_name},
+        {EXPIRES: time.time() + ttl},
+        upsert=True))
+
+    database[models.COUNTER_COLLECTION].bulk_write(requests)
+
+    return counts
+
+
+def _claim_rebuild(counters, collection_name, marker):
+    """Claim the rebuild of missing or expired counters.
+
+    Only one of the concurrent requests reading the counters gets to
+    rebuild them.  The claim is dropped when the rebuild is done, or after
+    `REBUILD_TIMEOUT` seconds if it failed.
+
+    :param counters: The counter collection.
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param marker: The document marking the counters as valid, or None.
+    :type marker: dict
+    :return True if the counters have to be rebuilt.
+    """
+    rebuilding = time.time() + REBUILD_TIMEOUT
+
+    if marker is None:
+        try:
+            counters.insert_one({
+                models.ID_KEY: collection_name,
+                EXPIRES: 0,
+                REBUILDING: rebuilding,
+            })
+        except pymongo.errors.DuplicateKeyError:
+            return False
+        return True
+
+    return counters.find_one_and_update(
+        {
+            models.ID_KEY: collection_name,
+            EXPIRES: marker[EXPIRES],
+            REBUILDING: marker.get(REBUILDING),
+        },
+        {"$set": {REBUILDING: rebuilding}}) is not None
+
+
+def get_count(database, collection_name, spec, ttl, schedule_rebuild=None):
+    """Get the number of documents matching a query from the counters.
+
+    The counters cannot be used while they are missing or being rebuilt.
+    If they are missing or expired, their rebuild is claimed and scheduled.
+
+    :param database: The database connection.
+    :param collection_name: The name of the counted collection.
+    :type collection_name: str
+    :param spec: The query spec.
+    :type spec: dict
+    :param ttl: How long the counters are valid, in seconds.
+    :type ttl: int
+    :param schedule_rebuild: The function starting the rebuild of the
+    counters in the background, called with the collection name and the ttl.
+    :type schedule_rebuild: function
+    :return The number of documents, or None if the query cannot be
+    answered with the counters.
+    """
+    if collection_name not in models.COUNT_COLLECTIONS:
+        return None
+
+    values = get_spec_values(spec)
+    if values is None:
+        return None
+
+    counter_id = _counter_id(collection_name, values)
+    counters = database[models.COUNTER_COLLECTION]
+    now = time.time()
+
+    try:
+        docs = dict(
+            (doc[models.ID_KEY], doc)
+            for doc in counters.find(
+                {models.ID_KEY: {"$in": [collection_name, counter_id]}}))
+
+        marker = docs.get(collection_name)
+        if marker is not None and marker.get(REBUILDING, 0) >= now:
+            return None
+
+        if marker is None or marker.get(EXPIRES, 0) < now:
+            if schedule_rebuild is not None and \
+                    _claim_rebuild(counters, collection_name, marker):
+                schedule_rebuild(collection_name, ttl)
+            return None
+
+        count = docs.get(counter_id, {}).get(models.COUNT_KEY)
+    except pymongo.errors.PyMongoError, ex:
+        utils.LOG.error("Error reading the %s counters", collection_name)
+        utils.LOG.exception(ex)
+        return None
+
+    return count or 0
@@ -24,40 +24,299 @@
 """Collection of mongodb database operations."""
 
 import bson
+import concurrent.futures
+import os
 import pymongo
 import pymongo.errors
+import pymongo.monitoring
+import threading
 import types
 
 import models
 import models.base as mbase
 import utils
 
-CLIENT = None
+# The MongoDB clients of this process, by connection parameters.
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+# The process that created the clients: a client must not be used in a
+# child process after fork(), a new one has to be created.
+CLIENTS_PID = None
+
+# The thread pool running the database operations of the *_async functions.
+DB_EXECUTOR = None
+DB_EXECUTOR_LOCK = threading.Lock()
+# The default number of threads of the pool: each thread uses at most one
+# connection, this should not be greater than the connections pool size.
+DB_MAX_WORKERS = 50
+
+# How find_and_count() counts the documents.
+# Count with a separate count_documents() query.
+COUNT_EXACT = "exact"
+# Retrieve the page as a list and count its documents: a single query.
+COUNT_PAGE = "page"
+# Use the collection metadata if there is no query, otherwise COUNT_EXACT.
+COUNT_ESTIMATED = "estimated"
+# Do not count the documents.
+COUNT_NONE = "none"
+
+
+class PoolMetrics(pymongo.monitoring.ConnectionPoolListener):
+    """Count the connection pool events of the MongoDB clients.
+
+    The metrics are:
+    - pools: the number of open connection pools, one per server
+    - connections: the number of open connections
+    - in_use: the number of connections checked out of the pools
+    - created: the number of connections created
+    - closed: the number of connections closed
+    - checked_out: the number of times a connection was checked out
+    - check_out_failed: the number of failed connection check outs
+    - pool_cleared: the number of times a pool was cleared
+    """
+
+    def __init__(self):
+        super(PoolMetrics, self).__init__()
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.reset()
+
+    def _add(self, **values):
+        with self._lock:
+            for key, value in values.iteritems():
+                self._metrics[key] += value
+
+    def get(self):
+        """Get the metrics.
+
+        :return A dictionary with the metrics values.
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def reset(self):
+        """Set all the metrics to 0."""
+        with self._lock:
+            self._metrics = dict.fromkeys([
+                "pools",
+                "connections",
+                "in_use",
+                "created",
+                "closed",
+                "checked_out", "check_out_failed", "pool_cleared"], 0)
+
+    def pool_created(self, event):
+        self._add(pools=1)
+
+    def pool_cleared(self, event):
+        self._add(pool_cleared=1)
+
+    def pool_closed(self, event):
+        self._add(pools=-1)
+
+    def connection_created(self, event):
+        self._add(connections=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(connections=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add(check_out_failed=1)
+
+    def connection_checked_out(self, event):
+        self._add(in_use=1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+
+POOL_METRICS = PoolMetrics()
+
+
+class CommandMetrics(pymongo.monitoring.CommandListener):
+    """Count the MongoDB commands run by each thread, and their duration.
+
+    The metrics of a thread are reset with `reset`, at the start of a task
+    for example, and read with `get`.
+    """
+
+    def __init__(self):
+        super(CommandMetrics, self).__init__()
+        self._local = threading.local()
+
+    def _add(self, event):
+        local = self._local
+        local.calls = getattr(local, "calls", 0) + 1
+        local.time = \
+            getattr(local, "time", 0.0) + event.duration_micros / 1000000.0
+
+    def get(self):
+        """Get the metrics of the current thread.
+
+        :return A dictionary with the number of `calls` and their `time` in
+        seconds.
+        """
+        return {
+            "calls": getattr(self._local, "calls", 0),
+            "time": getattr(self._local, "time", 0.0),
+        }
+
+    def reset(self):
+        """Set the metrics of the current thread to 0."""
+        self._local.calls = 0
+        self._local.time = 0.0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._add(event)
+
+    def failed(self, event):
+        self._add(event)
+
+
+COMMAND_METRICS = CommandMetrics()
+
+
+def _get_client_key(db_options):
+    """Get the key of a client in the registry from the connection options.
+
+    :param db_options: The connection parameters.
+    :type db_options: dict
+    :return A tuple.
+    """
+    db_options_get = db_options.get
+    return (
+        db_options_get("mongodb_host", "localhost"),
+        db_options_get("mongodb_port", 27017),
+        db_options_get("mongodb_pool", 100),
+        db_options_get("mongodb_user", ""),
+    )
 
 
 def get_db_client(db_options):
-    """Create a MongoDB connection.
+    """Get the MongoDB client of this process for the connection options.
+
+    The clients are created once per process and connection parameters, and
+    shared by all the callers: each of them has its own connections pool.
 
     :param db_options: The connection parameters.
     :type db_options: dict
     :return A MongoClient instance.
     """
-    global CLIENT
+    global CLIENTS_PID
+
+    if not db_options or not isinstance(db_options, types.DictType):
+        db_options = {}
+
+    db_host, db_port, db_pool, _ = key = _get_client_key(db_options)
+
+    with CLIENTS_LOCK:
+        pid = os.getpid()
+        if CLIENTS_PID != pid:
+            # Forked: the clients of the parent process cannot be used.
+            CLIENTS.clear()
+            CLIENTS_PID = pid
+            POOL_METRICS.reset()
+
+        client = CLIENTS.get(key)
+        if client is None:
+            client = pymongo.MongoClient(
+                host=db_host, maxPoolSize=db_pool, port=db_port,
+                w="majority", tz_aware=True,
+                event_listeners=[POOL_METRICS, COMMAND_METRICS])
+            CLIENTS[key] = client
+
+    return client
+
+
+def reset_db_clients():
+    """Forget the MongoDB clients, new ones will be created when needed.
+
+    This has to be called in a new child process, the clients inherited from
+    the parent process are not closed as their connections are shared with
+    it.
+    """
+    global CLIENTS_PID
+
+    with CLIENTS_LOCK:
+        CLIENTS.clear()
+        CLIENTS_PID = os.getpid()
+    POOL_METRICS.reset()
+
+
+def close_db_clients():
+    """Close all the MongoDB clients of this process."""
+    with CLIENTS_LOCK:
+        for client in CLIENTS.itervalues():
+            client.close()
+        CLIENTS.clear()
+
+
+def get_pool_metrics():
+    """Get the connection pool metrics of this process.
+
+    :return A dictionary with the `PoolMetrics` values, the number of clients
+    and the process ID.
+    """
+    metrics = POOL_METRICS.get()
+    with CLIENTS_LOCK:
+        metrics["clients"] = len(CLIENTS)
+    metrics["pid"] = os.getpid()
+    return metrics
+
+
+def get_command_metrics():
+    """Get the MongoDB command metrics of the current thread.
+
+    :return A dictionary with the number of `calls` and their `time` in
+    seconds since the last `reset_command_metrics`.
+    """
+    return COMMAND_METRICS.get()
+
+
+def reset_command_metrics():
+    """Reset the MongoDB command metrics of the current thread."""
+    COMMAND_METRICS.reset()
+
+
+def get_db_executor(max_workers=DB_MAX_WORKERS):
+    """Get the thread pool that runs the asynchronous database operations.
+
+    The pool is created on the first call, `max_workers` is ignored for the
+    following ones.
+
+    :param max_workers: The number of threads of the pool.
+    :type max_workers: int
+    :return A `concurrent.futures.ThreadPoolExecutor` instance.
+    """
+    global DB_EXECUTOR
+
+    with DB_EXECUTOR_LOCK:
+        if DB_EXECUTOR is None:
+            DB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers)
 
-    if CLIENT is None:
-        if not db_options or not isinstance(db_options, types.DictType):
-            db_options = {}
-        db_options_get = db_options.get
+    return DB_EXECUTOR
 
-        db_host = db_options_get("mongodb_host", "localhost")
-        db_port = db_options_get("mongodb_port", 27017)
-        db_pool = db_options_get("mongodb_pool", 100)
 
-        CLIENT = pymongo.MongoClient(
-            host=db_host, maxPoolSize=db_pool, port=db_port, w="majority",
-            tz_aware=True)
+def run_async(func, *args, **kwargs):
+    """Run a blocking database function in the database thread pool.
 
-    return CLIENT
+    The returned future can be yielded by a `tornado.gen.coroutine`: the
+    IOLoop is not blocked while the function runs.
+
+    :param func: The function to run.
+    :type func: function
+    :return A `concurrent.futures.Future` object with the function result.
+    """
+    return get_db_executor().submit(func, *args, **kwargs)
 
 
 def get_db_connection2(db_options, db_name=models.DB_NAME):
@@ -88,6 +347,9 @@ def get_db_connection2(db_options, db_name=models.DB_NAME):
 def get_db_connection(db_options, db_name=models.DB_NAME):
     """Retrieve a mongodb database connection.
 
+    The connection is made with the shared client of this process, see
+    `get_db_client`.
+
     :params db_options: The mongodb database connection parameters.
     :type db_options: dict
     :param db_name: The name of the database to connect to.
@@ -95,27 +357,7 @@ def get_db_connection(db_options, db_name=models.DB_NAME):
     :type db_name: str
     :return A mongodb database instance.
     """
-    if not db_options or not isinstance(db_options, types.DictType):
-        db_options = {}
-
-    db_options_get = db_options.get
-
-    db_host = db_options_get("mongodb_host", "localhost")
-    db_port = db_options_get("mongodb_port", 27017)
-    db_pool = db_options_get("mongodb_pool", 100)
-
-    db_user = db_options_get("mongodb_user", "")
-    db_pwd = db_options_get("mongodb_password", "")
-
-    connection = pymongo.MongoClient(
-        host=db_host, maxPoolSize=db_pool, port=db_port, w="majority",
-        tz_aware=True
-    )[db_name]
-
-    if all([db_user, db_pwd]):
-        connection.authenticate(db_user, password=db_pwd)
-
-    return connection
+    return get_db_connection2(db_options, db_name=db_name)
 
 
 def find_one(collection, value, field="_id", operator="$in", fields=None):
@@ -219,16 +461,23 @@ def find(collection, limit=0, skip=0, spec=None, fields=None, sort=None):
 
 
 def find_and_count(collection, limit=0, skip=0, spec=None, fields=None,
-                   sort=None):
+                   sort=None, count=COUNT_EXACT):
     """Find all the documents in a collection, and return the total count.
 
-    This will execute two operations: a `find` that will retrieve the documents
-    with the specified `limit` and `skip` values, and then a `count` on the
-    results found.
+    By default this will execute two operations: a `find` that will retrieve
+    the documents with the specified `limit` and `skip` values, and then a
+    `count` on the results found.
 
     If just `limit` and `skip` are passed, the `count` will return the total
     number of documents in the collection.
 
+    The `count` strategy can avoid the second operation:
+    - `COUNT_PAGE`: the documents are returned as a list, and counted.  This
+      should only be used with a `limit` value.
+    - `COUNT_ESTIMATED`: if there is no `spec`, the count is based on the
+      collection metadata instead of a query.  It might be inaccurate.
+    - `COUNT_NONE`: the count is None.
+
     :param collection: The collection where to search.
     :param limit: How many documents to return, or 0 for no limit.
     :type int
@@ -241,12 +490,27 @@ def find_and_count(collection, limit=0, skip=0, spec=None, fields=None,
     :type str, list, dict
     :param sort: Whose fields the result should be sorted on.
     :type list
+    :param count: The strategy used to count the documents.
+    :type str
     :return The search result and the total count.
     """
     db_result = collection.find(
         spec, fields, limit=limit, skip=skip, sort=sort)
-    kw = {'limit': limit} if limit else {}
-    db_results_count = collection.count_documents(spec, skip=skip, **kw)
+
+    if count == COUNT_NONE:
+        db_results_count = None
+    elif count == COUNT_PAGE:
+        db_result = list(db_result)
+        db_results_count = len(db_result)
+    elif count == COUNT_ESTIMATED and not spec:
+        db_results_count = max(
+            0, collection.estimated_document_count() - skip)
+        if limit:
+            db_results_count = min(limit, db_results_count)
+    else:
+        kw = {'limit': limit} if limit else {}
+        db_results_count = collection.count_documents(spec, skip=skip, **kw)
+
     return db_result, db_results_count
 
 
@@ -426,6 +690,35 @@ def update(collection, spec, document, operation="$set"):
     return ret_val
 
 
+def upsert(collection, spec, document):
+    """Update a document with the provided operations, or create it.
+
+    `document` is a full update document, with the operators to apply.  If
+    no document matches `spec`, a new one is created.  If a concurrent
+    upsert created it first, the update is retried once.
+
+    :param collection: The database collection.
+    :param spec: The fields that will be matched in the document to update.
+    :type spec: dict
+    :param document: The update document with the operations to perform.
+    :type document: dict
+    :return 200 if the update has success, 500 in case of an error.
+    """
+    ret_val = 200
+
+    try:
+        try:
+            collection.update_one(spec, document, upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            collection.update_one(spec, document, upsert=True)
+    except pymongo.errors.OperationFailure, ex:
+        utils.LOG.error("Error upserting the document with query: %s", spec)
+        utils.LOG.exception(ex)
+        ret_val = 500
+
+    return ret_val
+
+
 def update2(connection, collection, search, document):
     """Update a document in the database.
 
@@ -540,15 +833,62 @@ def delete(collection, query):
     return ret_val
 
 
-def aggregate(
-        collection, unique, match=None, sort=None, fields=None, limit=None):
-    """Perform an aggregate `group` action on the collection.
+def sort_uses_index(sort, match=None, indexes=None):
+    """Check if the documents matching a query can be sorted with an index.
 
-    If the `sort` parameter is defined, the `sort` action on the aggregate will
-    be performed first.
+    An index can sort the documents if, after the keys matched by equality
+    in the query, its keys start with the sort keys, all in the same or all
+    in the opposite direction.
 
-    If `fields` is not defined, the entire document will be returned. This will
-    return the last document found based on the sort criteria.
+    :param sort: The sort keys and directions.
+    :type sort: list
+    :param match: The query spec.
+    :type match: dict
+    :param indexes: The indexes of the collection, lists of keys and
+    directions.
+    :type indexes: list
+    :return True or False.
+    """
+    equal = set(
+        key for key, value in (match or {}).iteritems()
+        if not isinstance(value, types.DictionaryType))
+    sort = [(key, order) for key, order in sort if key not in equal]
+
+    if not sort:
+        return True
+
+    for index in indexes or []:
+        keys = list(index)
+        while keys and keys[0][0] in equal:
+            keys.pop(0)
+        prefix = keys[:len(sort)]
+        if [key for key, _ in prefix] != [key for key, _ in sort]:
+            continue
+        directions = set(
+            order == index_order
+            for (_, order), (_, index_order) in zip(sort, prefix))
+        if len(directions) == 1:
+            return True
+
+    return False
+
+
+def get_aggregate_pipeline(
+        unique, match=None, sort=None, fields=None, limit=None, indexes=None):
+    """Create the pipeline of an aggregate `group` action.
+
+    The pipeline is made of these stages:
+    - `$match` with the query spec;
+    - `$sort`, only if the documents can be sorted with one of `indexes`:
+    the `$first` values of each group are then taken from the first
+    document in the sort order;
+    - `$project` with only the fields used by the following stages, if the
+    `fields` are defined, so that whole documents are not carried through
+    the `$group` stage;
+    - `$group` on the `unique` fields;
+    - `$sort` and `$limit` on the groups.
+
+    If `fields` is not defined, the entire document will be returned.
 
     :param unique: The document attribute on which the `group` action should
         be performed.
@@ -560,7 +900,10 @@ def aggregate(
     :type fields dict
     :param limit The number of results to return.
     :type limit int, str
-    :return A dictionary with the results.
+    :param indexes: The indexes of the collection, lists of keys and
+    directions.
+    :type indexes: list
+    :return The pipeline as a list.
     """
     def _starts_with_dollar(val):
         """Check if a value starts with the dollar sign.
@@ -572,6 +915,12 @@ def aggregate(
             val = "$" + val
         return val
 
+    def _unique_fields():
+        """Get the names of the unique fields."""
+        if isinstance(unique, types.ListType):
+            return [val.lstrip("$") for val in unique]
+        return [unique.lstrip("$")]
+
     def _create_multi_key():
         """Yield (key,value) tuples from the unique field.
         """
@@ -620,6 +969,9 @@ def aggregate(
             "$match": match
         })
 
+    if sort and sort_uses_index(sort, match, indexes):
+        pipeline.append({"$sort": bson.son.SON(sort)})
+
     group_dict = {
         "$group": {
             "_id": _parse_aggregate()
@@ -639,6 +991,13 @@ def aggregate(
                 group_field for group_field in _parse_dict_fields_for_group()
             ]
 
+        projection = set(_unique_fields())
+        projection.update(key for key, _ in r_fields)
+        projection.update(key for key, _ in sort or [])
+        pipeline.append({
+            "$project": dict((key, True) for key in sorted(projection))
+        })
+
     group_dict["$group"].update(r_fields)
 
     if sort:
@@ -649,9 +1008,7 @@ def aggregate(
     # Sort everything now.
     if sort:
         pipeline.append({
-            "$sort": {
-                k: v for k, v in sort
-            }
+            "$sort": bson.son.SON(sort)
         })
 
     # The limit must be applied at the end or we might not get back the
@@ -659,4 +1016,96 @@ def aggregate(
     if limit is not None and limit > 0:
         pipeline.append({"$limit": limit})
 
-    return list(res for res in collection.aggregate(pipeline))
+    return pipeline
+
+
+def aggregate(
+        collection, unique, match=None, sort=None, fields=None, limit=None,
+        indexes=None, allow_disk_use=False):
+    """Perform an aggregate `group` action on the collection.
+
+    The pipeline is created with `get_aggregate_pipeline`.
+
+    :param unique: The document attribute on which the `group` action should
+        be performed.
+    :param match: Which fields the documents should match.
+    :param match dict
+    :param sort: On which attributes the result should be sorted.
+    :type sort list
+    :param fields: The fields to return.
+    :type fields dict
+    :param limit The number of results to return.
+    :type limit int, str
+    :param indexes: The indexes of the collection, used to sort the
+    documents before grouping them.
+    :type indexes: list
+    :param allow_disk_use: If the aggregation stages can write temporary
+    data on disk, when they need more than 100MB of memory.
+    :type allow_disk_use: bool
+    :return A dictionary with the results.
+    """
+    pipeline = get_aggregate_pipeline(
+        unique, match=match, sort=sort, fields=fields, limit=limit,
+        indexes=indexes)
+
+    return list(
+        res for res in collection.aggregate(
+            pipeline, allowDiskUse=allow_disk_use))
+
+
+def find_one2_async(collection, spec_or_id, fields=None, sort=None):
+    """Asynchronous version of `find_one2`.
+
+    :return A future with None or the search result as a dictionary.
+    """
+    return run_async(find_one2, collection, spec_or_id, fields, sort)
+
+
+def find_and_count_async(collection, limit=0, skip=0, spec=None, fields=None,
+                         sort=None, count=COUNT_EXACT, prefetch=0):
+    """Asynchronous version of `find_and_count`.
+
+    A cursor fetches its documents from the database when it is iterated: if
+    there are no more than `prefetch` documents in the result, they are
+    retrieved by the database thread pool and returned as a list.  Larger
+    results are returned as a cursor, they should be iterated with
+    `run_async`.
+
+    :param prefetch: The maximum number of documents to retrieve as a list.
+    :type prefetch: int
+    :return A future with the search result and the total count.
+    """
+    def _find_and_count():
+        result, result_count = find_and_count(
+            collection,
+            limit,
+            skip, spec=spec, fields=fields, sort=sort, count=count)
+
+        size = limit if result_count is None else result_count
+        if not isinstance(result, types.ListType) and 0 < size <= prefetch:
+            result = list(result)
+
+        return result, result_count
+
+    return run_async(_find_and_count)
+
+
+def aggregate_async(
+        collection, unique, match=None, sort=None, fields=None, limit=None,
+        indexes=None, allow_disk_use=False):
+    """Asynchronous version of `aggregate`.
+
+    :return A future with the list of results.
+    """
+    return run_async(
+        aggregate,
+        collection, unique, match=match, sort=sort, fields=fields, limit=limit,
+        indexes=indexes, allow_disk_use=allow_disk_use)
+
+
+def save_async(database, document):
+    """Asynchronous version of `save`.
+
+    :return A future with the operation code and the document ID.
+    """
+    return run_async(save, database, document)
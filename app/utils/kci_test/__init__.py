@@ -35,8 +35,8 @@ import pymongo
 import models
 import models.test_group as mtest_group
 import models.test_case as mtest_case
-import taskqueue.celery as taskc
 import utils
+import utils.counters
 import utils.db
 import utils.errors
 
@@ -118,7 +118,7 @@ def save_or_update(doc, spec_map, collection, database, errors):
     fields = [
         models.CREATED_KEY,
         models.ID_KEY,
-    ]
+    ] + utils.counters.COUNTER_KEYS
 
     prev_doc = utils.db.find_one2(database[collection], spec, fields=fields)
 
@@ -144,6 +144,10 @@ def save_or_update(doc, spec_map, collection, database, errors):
             )
         )
         ERR_ADD(errors, ret_val, err_msg)
+    else:
+        utils.counters.update(
+            database, collection,
+            added=[doc.to_dict()], removed=[prev_doc] if prev_doc else None)
 
     return ret_val, doc_id
 
@@ -465,12 +469,41 @@ def update_test_group_add_test_case_id(
     return ret_val, errors
 
 
+def _get_saved_test_cases(group_doc, database):
+    """Get the test cases already saved for a test group.
+
+    Only the ID and the counted values of the test cases are retrieved.
+
+    :param group_doc: The test_group document object
+    :type group_doc: TestGroupDocument
+    :param database: The database connection.
+    :return A dictionary with the test case names as keys and the documents
+    as values.
+    """
+    spec = {
+        models.KERNEL_KEY: group_doc.kernel,
+        models.TEST_GROUP_ID_KEY: group_doc.id,
+    }
+
+    return {
+        doc[models.NAME_KEY]: doc
+        for doc in utils.db.find(
+            database[models.TEST_CASE_COLLECTION],
+            spec=spec,
+            fields=[models.NAME_KEY] + utils.counters.COUNTER_KEYS)
+    }
+
+
 def import_and_save_test_cases(group_doc, test_cases, database, errors, path):
     """Import the tests cases from a JSON object into a group.
 
     Parse the test_cases JSON data into a list of test cases, add them to the
     database and update the related test group.
 
+    All the test cases are saved with a single bulk operation: the ones
+    already in the database, matched with `SPEC_TEST_CASE`, are replaced.
+    The list of test cases of the group is then set with one update.
+
     This function returns an operation code based on the import result
     of all the test cases.
 
@@ -483,39 +516,69 @@ def import_and_save_test_cases(group_doc, test_cases, database, errors, path):
     :type errors: dict
     :return the operation code (201 if success, 500 in case of an error).
     """
-    ret_code = 500
-
-    for test_case in test_cases:
-        tc_doc = _parse_test_case_from_json(
-            group_doc, test_case, database, errors, path)
-
+    tc_docs = []
     for index, test_case in enumerate(test_cases, 1):
         tc_doc = _parse_test_case_from_json(
             group_doc, test_case, database, errors, path)
-        tc_doc.index = index
         if tc_doc:
-            ret_code, tc_doc_id = save_or_update(
-                tc_doc, SPEC_TEST_CASE, models.TEST_CASE_COLLECTION,
-                database, errors)
-
-        if ret_code == 500:
-            err_msg = (
-                "Error saving test case report in the database "
-                "for '%s (%s, %s)'" %
-                (
-                    tc_doc.name,
-                    tc_doc.status,
-                    tc_doc.test_group_id,
-                )
-            )
-            ERR_ADD(errors, ret_code, err_msg)
-            return ret_code
+            tc_doc.index = index
+            tc_docs.append(tc_doc)
+
+    if not tc_docs:
+        return 201
+
+    saved_cases = _get_saved_test_cases(group_doc, database)
+    group_case_ids = []
+    added_ids = set()
+    requests = []
+    added = []
+    removed = []
+
+    for tc_doc in tc_docs:
+        prev_case = saved_cases.get(tc_doc.name)
+        if prev_case:
+            tc_doc.id = prev_case[models.ID_KEY]
+            removed.append(prev_case)
         else:
-            # Test case imported successfully update test group
-            ret_code, errors = update_test_group_add_test_case_id(
-                tc_doc_id, group_doc.id, group_doc.name, database)
+            tc_doc.id = bson.objectid.ObjectId()
+        if tc_doc.id not in added_ids:
+            added_ids.add(tc_doc.id)
+            group_case_ids.append(tc_doc.id)
+        doc_data = tc_doc.to_dict()
+        saved_cases[tc_doc.name] = doc_data
+        added.append(doc_data)
+        spec = {x: getattr(tc_doc, y) for x, y in SPEC_TEST_CASE.iteritems()}
+        requests.append(pymongo.ReplaceOne(spec, doc_data, upsert=True))
+
+    utils.LOG.debug(
+        "Saving %d test cases for test group '%s' (%s)",
+        len(requests), group_doc.name, str(group_doc.id))
+
+    try:
+        database[models.TEST_CASE_COLLECTION].bulk_write(requests)
+    except pymongo.errors.PyMongoError, ex:
+        utils.LOG.exception(ex)
+        ERR_ADD(
+            errors, 500,
+            "Error saving test case reports in the database for test "
+            "group '%s' (%s)" % (group_doc.name, str(group_doc.id)))
+        return 500
+
+    utils.counters.update(
+        database, models.TEST_CASE_COLLECTION, added=added, removed=removed)
+
+    ret_code = utils.db.update(
+        database[models.TEST_GROUP_COLLECTION],
+        {models.ID_KEY: group_doc.id},
+        {models.TEST_CASES_KEY: group_case_ids})
+    if ret_code != 200:
+        ERR_ADD(
+            errors, ret_code,
+            "Error updating test group '%s' with test case references" %
+            (str(group_doc.id)))
+        return 500
 
-    return ret_code
+    return 201
 
 
 def update_test_group_add_sub_group_id(
@@ -18,13 +18,17 @@
 """Logic to find regressions in test group results."""
 
 import bson
+import pymongo
+import pymongo.errors
 import redis
 
 import models
 import models.test_regression
 import utils
+import utils.counters
 import utils.db
 import utils.database.redisdb as redisdb
+import utils.kci_test.tree
 
 REGRESSION_SPEC_KEYS = [
     models.JOB_KEY,
@@ -80,8 +84,38 @@ def _test_case_regression_data(test_case, group):
     return regr_data
 
 
-def _check_and_track(test_case, group, last_case, last_group, db, spec,
-                     hierarchy):
+def _get_last_regressions(db, spec, last_group):
+    """Get the regressions of the previous kernel with a single query.
+
+    :param db: The database connection.
+    :param spec: The spec of the test group.
+    :type spec: dict
+    :param last_group: The previous test group.
+    :type last_group: dict
+    :return A dictionary with the test case paths as keys and the lists of
+    regression documents as values.
+    """
+    if not last_group:
+        return {}
+
+    regr_spec = {k: spec[k] for k in REGRESSION_SPEC_KEYS}
+    regr_spec[models.KERNEL_KEY] = last_group[models.KERNEL_KEY]
+    regressions = {}
+
+    for regr_doc in utils.db.find(
+            db[models.TEST_REGRESSION_COLLECTION], spec=regr_spec):
+        regressions.setdefault(
+            regr_doc[models.TEST_CASE_PATH_KEY], []).append(regr_doc)
+
+    return regressions
+
+
+def _check_and_track(test_case, group, last_case, last_group, spec,
+                     hierarchy, last_regressions):
+    """Check if a failing test case is a new or a tracked regression.
+
+    :return The regression document as a dictionary, or None.
+    """
     hierarchy = hierarchy + [test_case[models.NAME_KEY]]
     regr = {k: spec[k] for k in REGRESSION_SPEC_KEYS}
     regr.update({k: group[k] for k in REGRESSION_EXTRA_KEYS})
@@ -99,48 +133,53 @@ def _check_and_track(test_case, group, last_case, last_group, db, spec,
         regr[models.KERNEL_KEY] = spec[models.KERNEL_KEY]
         regr[models.LAB_NAME_KEY] = test_case[models.LAB_NAME_KEY]
         doc = models.test_regression.TestRegressionDocument.from_json(regr)
-        return utils.db.save(db, doc) if doc else (500, None)
+        return doc.to_dict() if doc else None
 
     regr[models.KERNEL_KEY] = last_group[models.KERNEL_KEY]
-    regr_doc = utils.db.find_one2(db[models.TEST_REGRESSION_COLLECTION], regr)
+    regr_doc = next((
+        doc for doc in last_regressions.get(test_case_path, [])
+        if all(doc.get(k) == v for k, v in regr.iteritems())
+    ), None)
     if not regr_doc:
-        return (200, None)
+        return None
 
     utils.LOG.info("Tracking regression: {}".format(test_case_path))
-    test_case_data = _test_case_regression_data(test_case, group)
-    regr_doc[models.REGRESSIONS_KEY].append(test_case_data)
+    regr_doc = dict(regr_doc)
+    regr_doc[models.REGRESSIONS_KEY] = regr_doc[models.REGRESSIONS_KEY] + [
+        _test_case_regression_data(test_case, group)]
     regr_doc[models.KERNEL_KEY] = spec[models.KERNEL_KEY]
     del regr_doc[models.ID_KEY]  # Save a separate doc for each kernel revision
     del regr_doc[models.CREATED_KEY]
     doc = models.test_regression.TestRegressionDocument.from_json(regr_doc)
-    return utils.db.save(db, doc) if doc else (500, None)
+    return doc.to_dict() if doc else None
+
+
+def _add_test_group_regressions(group, last_group, spec, last_regressions,
+                                hierarchy=None, regressions=None):
+    """Find the regressions in a test group tree.
 
+    Both `group` and `last_group` need to have been loaded with
+    `utils.kci_test.tree.load_trees` first.  Nothing is written to the
+    database.
 
-def _add_test_group_regressions(group, last_group, db, spec, hierarchy=None,
-                                ids=None):
+    :return A list of (test case ID, regression document) tuples.
+    """
     if hierarchy is None:
         hierarchy = [group[models.NAME_KEY]]
     else:
         hierarchy = hierarchy + [group[models.NAME_KEY]]
 
-    if ids is None:
-        ids = []
-
-    case_collection = db[models.TEST_CASE_COLLECTION]
-    group_collection = db[models.TEST_GROUP_COLLECTION]
+    if regressions is None:
+        regressions = []
 
-    def _get_docs_dict(group, collection, field):
-        return {
-            doc[models.NAME_KEY]: doc
-            for doc in (utils.db.find_one2(collection, doc_id)
-                        for doc_id in group[field])
-        }
+    def _get_docs_dict(group, field):
+        return {doc[models.NAME_KEY]: doc for doc in group[field]}
 
     def _get_cases_dict(group):
-        return _get_docs_dict(group, case_collection, models.TEST_CASES_KEY)
+        return _get_docs_dict(group, models.TEST_CASES_KEY)
 
     def _get_sub_groups_dict(group):
-        return _get_docs_dict(group, group_collection, models.SUB_GROUPS_KEY)
+        return _get_docs_dict(group, models.SUB_GROUPS_KEY)
 
     test_cases = _get_cases_dict(group)
     last_test_cases = _get_cases_dict(last_group) if last_group else {}
@@ -148,23 +187,61 @@ def _add_test_group_regressions(group, last_group, db, spec, hierarchy=None,
     for test_case_name, test_case in test_cases.iteritems():
         last_case = last_test_cases.get(test_case_name)
         if last_case and test_case[models.STATUS_KEY] == "FAIL":
-            ret, doc_id = _check_and_track(
-                test_case, group, last_case, last_group, db, spec, hierarchy)
-            if doc_id:
-                ids.append(doc_id)
-                data = dict(test_case)
-                data[models.REGRESSION_ID_KEY] = doc_id
-                test_doc = models.test_case.TestCaseDocument.from_json(data)
-                utils.db.save(db, test_doc)
+            regr_doc = _check_and_track(
+                test_case, group, last_case, last_group, spec, hierarchy,
+                last_regressions)
+            if regr_doc:
+                regressions.append((test_case[models.ID_KEY], regr_doc))
 
     sub_groups = _get_sub_groups_dict(group)
     last_sub_groups = _get_sub_groups_dict(last_group) if last_group else {}
 
     for sub_name, sub in sub_groups.iteritems():
         last_sub = last_sub_groups.get(sub_name)
-        _add_test_group_regressions(sub, last_sub, db, spec, hierarchy, ids)
+        _add_test_group_regressions(
+            sub, last_sub, spec, last_regressions, hierarchy, regressions)
 
-    return ids
+    return regressions
+
+
+def _save_regressions(db, regressions):
+    """Save the regressions and update their test cases in bulk.
+
+    :param db: The database connection.
+    :param regressions: The (test case ID, regression document) tuples.
+    :type regressions: list
+    :return A 2-tuple: 200 or 500; the list of regression document IDs.
+    """
+    if not regressions:
+        return 200, []
+
+    regr_ids = []
+    inserts = []
+    updates = []
+
+    for test_case_id, regr_doc in regressions:
+        regr_id = bson.objectid.ObjectId()
+        regr_doc[models.ID_KEY] = regr_id
+        regr_ids.append(regr_id)
+        inserts.append(pymongo.InsertOne(regr_doc))
+        updates.append(pymongo.UpdateOne(
+            {models.ID_KEY: test_case_id},
+            {"$set": {models.REGRESSION_ID_KEY: regr_id}}))
+
+    try:
+        db[models.TEST_REGRESSION_COLLECTION].bulk_write(
+            inserts, ordered=False)
+        db[models.TEST_CASE_COLLECTION].bulk_write(updates, ordered=False)
+    except pymongo.errors.PyMongoError, ex:
+        utils.LOG.error("Error saving test regressions")
+        utils.LOG.exception(ex)
+        return 500, None
+
+    utils.counters.update(
+        db, models.TEST_REGRESSION_COLLECTION,
+        added=[regr_doc for _, regr_doc in regressions])
+
+    return 200, regr_ids
 
 
 def find(group_id, db_options={}, db=None):
@@ -200,6 +277,9 @@ def find(group_id, db_options={}, db=None):
     redis_conn = redisdb.get_db_connection(db_options)
     lock_key = "-".join(group[k] for k in TEST_GROUP_SPEC_KEYS)
     # Hold a lock as multiple group results may be imported in parallel
+    utils.kci_test.tree.load_trees([group, last], db)
     with redis.lock.Lock(redis_conn, lock_key, timeout=5):
-        regr_ids = _add_test_group_regressions(group, last, db, spec)
-    return (200, regr_ids)
+        last_regressions = _get_last_regressions(db, spec, last)
+        regressions = _add_test_group_regressions(
+            group, last, spec, last_regressions)
+        return _save_regressions(db, regressions)
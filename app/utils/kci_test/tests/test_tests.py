@@ -21,8 +21,11 @@ import tempfile
 import unittest
 
 import models.test_group
+import utils.counters
+import utils.db
 import utils.kci_test
 import utils.kci_test.regressions
+import utils.kci_test.tree
 
 
 class TestTests(unittest.TestCase):
@@ -90,6 +93,56 @@ class TestTests(unittest.TestCase):
         for ref, doc in zip(test_case_list, test_case_docs):
             self.assertDictContainsSubset(ref, doc)
 
+    def test_load_tree(self):
+        git_commit = "abcdef123457"
+        group_data = self._make_test_data(git_commit, [
+            ("foo", "PASS"),
+            ("bar", "FAIL"),
+        ])
+        group_data[models.SUB_GROUPS_KEY] = [
+            {
+                models.NAME_KEY: "sub",
+                models.TEST_CASES_KEY: [
+                    {
+                        models.NAME_KEY: "baz",
+                        models.STATUS_KEY: "SKIP",
+                        models.LAB_NAME_KEY: "unit-test-lab",
+                    },
+                ],
+            },
+        ]
+        group_id = self._save_group_assert(group_data, self._db)
+        group = utils.db.find_one2(
+            self._db[models.TEST_GROUP_COLLECTION], group_id)
+
+        utils.kci_test.tree.load_tree(group, self._db)
+
+        test_cases = group[models.TEST_CASES_KEY]
+        self.assertEqual(
+            ["foo", "bar"], [tc[models.NAME_KEY] for tc in test_cases])
+        self.assertEqual(
+            ["PASS", "FAIL"], [tc[models.STATUS_KEY] for tc in test_cases])
+        sub_groups = group[models.SUB_GROUPS_KEY]
+        self.assertEqual(1, len(sub_groups))
+        self.assertEqual("sub", sub_groups[0][models.NAME_KEY])
+        sub_cases = sub_groups[0][models.TEST_CASES_KEY]
+        self.assertEqual(["baz"], [tc[models.NAME_KEY] for tc in sub_cases])
+        self.assertEqual([], sub_groups[0][models.SUB_GROUPS_KEY])
+
+    def test_load_trees_case_fields(self):
+        group_data = self._make_test_data("abcdef123458", [("foo", "PASS")])
+        group_id = self._save_group_assert(group_data, self._db)
+        group = utils.db.find_one2(
+            self._db[models.TEST_GROUP_COLLECTION], group_id)
+
+        groups = utils.kci_test.tree.load_trees(
+            [group, None], self._db, [models.NAME_KEY])
+
+        self.assertIs(group, groups[0])
+        test_case = group[models.TEST_CASES_KEY][0]
+        self.assertEqual("foo", test_case[models.NAME_KEY])
+        self.assertNotIn(models.STATUS_KEY, test_case)
+
     def test_new_failure(self):
         group_collection = self._db[models.TEST_GROUP_COLLECTION]
         regr_collection = self._db[models.TEST_REGRESSION_COLLECTION]
@@ -231,3 +284,84 @@ class TestTests(unittest.TestCase):
                 self.assertIsNotNone(regr_doc)
                 test_case_path = ".".join(regr_doc[models.HIERARCHY_KEY])
                 self.assertIn(test_case_path, regr_ref)
+
+    def test_regression_id_on_test_cases(self):
+        case_collection = self._db[models.TEST_CASE_COLLECTION]
+        regr_collection = self._db[models.TEST_REGRESSION_COLLECTION]
+        names = ["test-{:03d}".format(n) for n in range(20)]
+
+        for commit, status in [("89abcdef", "PASS"), ("89abcdf0", "FAIL"),
+                               ("89abcdf1", "FAIL")]:
+            group_data = self._make_test_data(
+                commit, [(name, status) for name in names])
+            group_id = self._save_group_assert(group_data, self._db)
+            ret, regr_ids = utils.kci_test.regressions.find(
+                group_id, db=self._db)
+            self.assertEqual(ret, 200)
+
+        self.assertEqual(len(names), len(regr_ids))
+        self.assertEqual(2 * len(names), regr_collection.count_documents({}))
+
+        for regr_id in regr_ids:
+            regr_doc = utils.db.find_one2(regr_collection, regr_id)
+            self.assertEqual(3, len(regr_doc[models.REGRESSIONS_KEY]))
+            case_id = regr_doc[models.REGRESSIONS_KEY][-1][
+                models.TEST_CASE_ID_KEY]
+            case_doc = utils.db.find_one2(case_collection, case_id)
+            self.assertEqual(regr_id, case_doc[models.REGRESSION_ID_KEY])
+
+    def test_import_test_cases_bulk(self):
+        group_collection = self._db[models.TEST_GROUP_COLLECTION]
+        case_collection = self._db[models.TEST_CASE_COLLECTION]
+        group_data = self._make_test_data("abcdef123459", [
+            ("foo", "PASS"),
+            ("bar", "FAIL"),
+            ("baz", "PASS"),
+        ])
+
+        group_id = self._save_group_assert(group_data, self._db)
+        test_cases = utils.db.find_one2(group_collection, group_id)[
+            models.TEST_CASES_KEY]
+        self.assertEqual(3, case_collection.count_documents({}))
+        self.assertEqual(
+            ["foo", "bar", "baz"],
+            [utils.db.find_one2(case_collection, case_id)[models.NAME_KEY]
+             for case_id in test_cases])
+
+        # Importing the same group again replaces the test cases.
+        group_data[models.TEST_CASES_KEY][1][models.STATUS_KEY] = "PASS"
+        self.assertEqual(
+            group_id, self._save_group_assert(group_data, self._db))
+        self.assertEqual(3, case_collection.count_documents({}))
+        self.assertEqual(
+            test_cases,
+            utils.db.find_one2(group_collection, group_id)[
+                models.TEST_CASES_KEY])
+        case_doc = utils.db.find_one2(case_collection, test_cases[1])
+        self.assertEqual("PASS", case_doc[models.STATUS_KEY])
+        self.assertEqual(2, case_doc[models.INDEX_KEY])
+
+    def test_import_test_cases_counters(self):
+        counters = self._db[models.COUNTER_COLLECTION]
+        group_data = self._make_test_data("abcdef123460", [
+            ("foo", "PASS"),
+            ("bar", "FAIL"),
+            ("baz", "PASS"),
+        ])
+
+        def count(**spec):
+            counter_id = utils.counters._counter_id(
+                models.TEST_CASE_COLLECTION,
+                utils.counters.get_spec_values(spec))
+            return utils.db.find_one2(counters, counter_id)[models.COUNT_KEY]
+
+        self._save_group_assert(group_data, self._db)
+        self.assertEqual(3, count())
+        self.assertEqual(2, count(status="PASS"))
+        self.assertEqual(1, count(status="FAIL"))
+
+        group_data[models.TEST_CASES_KEY][1][models.STATUS_KEY] = "PASS"
+        self._save_group_assert(group_data, self._db)
+        self.assertEqual(3, count())
+        self.assertEqual(3, count(status="PASS"))
+        self.assertEqual(0, count(status="FAIL"))
@@ -0,0 +1,110 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Load test group trees with a fixed number of database queries."""
+
+import models
+import utils.db
+
+# Maximum number of IDs passed to a single $in query.
+IN_QUERY_CHUNK = 1000
+
+
+def find_by_ids(collection, doc_ids, fields=None):
+    """Find all the documents matching a list of IDs.
+
+    The IDs are looked up with $in queries, split in chunks of
+    `IN_QUERY_CHUNK` values to keep the query documents small.
+
+    :param collection: The collection where to search.
+    :param doc_ids: The list of document IDs.
+    :type doc_ids: list
+    :param fields: The fields that should be available or excluded from the
+    result.
+    :return A dictionary with the documents keyed by their ID.
+    """
+    docs = {}
+    doc_ids = list(set(doc_ids))
+    for start in range(0, len(doc_ids), IN_QUERY_CHUNK):
+        chunk = doc_ids[start:start + IN_QUERY_CHUNK]
+        for doc in utils.db.find(
+                collection,
+                spec={models.ID_KEY: {"$in": chunk}}, fields=fields):
+            docs[doc[models.ID_KEY]] = doc
+    return docs
+
+
+def load_trees(groups, db, case_fields=None):
+    """Load the test cases and sub-groups of some test groups.
+
+    The trees are walked one level at a time: all the test cases and all the
+    sub-groups of a level are retrieved with a single query each, regardless
+    of the number of groups or test cases.
+
+    The groups are modified in place: their `test_cases` and `sub_groups`
+    lists of IDs are replaced with the corresponding documents, in the same
+    order.  IDs of documents that can't be found are dropped.
+
+    :param groups: The test group documents where to start.
+    :type groups: list
+    :param db: The database connection.
+    :param case_fields: The test case fields to retrieve, or None for all.
+    :return The list of groups.
+    """
+    case_collection = db[models.TEST_CASE_COLLECTION]
+    group_collection = db[models.TEST_GROUP_COLLECTION]
+    level = [group for group in groups if group]
+
+    while level:
+        cases = find_by_ids(
+            case_collection,
+            (case_id
+             for group in level for case_id in group[models.TEST_CASES_KEY]),
+            fields=case_fields)
+        sub_groups = find_by_ids(
+            group_collection,
+            (sub_id
+             for group in level for sub_id in group[models.SUB_GROUPS_KEY]))
+
+        next_level = []
+        for group in level:
+            group[models.TEST_CASES_KEY] = [
+                cases[case_id] for case_id in group[models.TEST_CASES_KEY]
+                if case_id in cases
+            ]
+            group[models.SUB_GROUPS_KEY] = [
+                sub_groups[sub_id] for sub_id in group[models.SUB_GROUPS_KEY]
+                if sub_id in sub_groups
+            ]
+            next_level.extend(group[models.SUB_GROUPS_KEY])
+        level = next_level
+
+    return groups
+
+
+def load_tree(group, db, case_fields=None):
+    """Load the test cases and sub-groups of a single test group.
+
+    See `load_trees`.
+
+    :param group: The test group document where to start.
+    :type group: dict
+    :param db: The database connection.
+    :param case_fields: The test case fields to retrieve, or None for all.
+    :return The test group.
+    """
+    load_trees([group], db, case_fields)
+    return group
@@ -17,19 +17,40 @@
 
 """Push data using kcidb-submit."""
 
+import collections
+import itertools
 import json
 import os
 import subprocess
 import threading
+import time
+import types
 import urlparse
 
 import models
 import utils
 import utils.db
+import utils.kci_test.tree
 from utils.report.common import DEFAULT_STORAGE_URL as STORAGE_URL
 
 
+# The version of the kcidb schema of the submitted data.
+KCIDB_VERSION = "1"
+# The kinds of kcidb objects, in the order they are put in a batch.
+OBJECT_KINDS = ["revisions", "builds", "tests"]
+# Separators of the compact JSON data.
+JSON_SEPARATORS = (",", ":")
+# Number of test cases read and submitted at a time.
+TESTS_CHUNK_SIZE = 1000
+
+
 class KcidbSubmit(object):
+    """Write kcidb data to a `kcidb-submit` process.
+
+    The process is started when data is first written, and restarted if it
+    has exited or if writing to it fails.
+    """
+
     def __init__(self, kcidb_options):
         kcidb_path = kcidb_options.get("kcidb_path", "")
         self.kcidb_submit_cmd = os.path.join(kcidb_path, "kcidb-submit")
@@ -37,41 +58,351 @@ class KcidbSubmit(object):
         self.topic = kcidb_options["topic"]
         self.credentials = kcidb_options["credentials"]
         self.debug = kcidb_options.get("debug")
+        self.restarts = 0
         self._process = None
         self._lock = threading.Lock()
 
     @property
     def process(self):
-        if not self._process:
-            self._process = self._spawn()
-        return self._process
+        with self._lock:
+            if self._process and self._process.poll() is not None:
+                utils.LOG.warn(
+                    "kcidb-submit exited with status {}, restarting".format(
+                        self._process.returncode))
+                self._process = None
+                self.restarts += 1
+            if not self._process:
+                self._process = self._spawn()
+            return self._process
 
     def _spawn(self):
         local_env = dict(os.environ)
         local_env["GOOGLE_APPLICATION_CREDENTIALS"] = self.credentials
-        self._lock.acquire()
-        process = subprocess.Popen([self.kcidb_submit_cmd,
-                                    "-p", self.project,
-                                    "-t", self.topic],
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   env=local_env)
-        self._lock.release()
+        # The output is only read in debug mode, a full pipe would block
+        # kcidb-submit otherwise.
+        with open(os.devnull, "w") as devnull:
+            return subprocess.Popen([self.kcidb_submit_cmd,
+                                     "-p", self.project,
+                                     "-t", self.topic],
+                                    stdin=subprocess.PIPE,
+                                    stdout=None if self.debug else devnull,
+                                    env=local_env)
+
+    def _close(self):
+        """Close the input of the process and wait for it to exit."""
+        with self._lock:
+            process, self._process = self._process, None
+
+        if process:
+            try:
+                process.stdin.close()
+            except IOError:
+                pass
+            process.wait()
         return process
 
     def terminate(self):
-        if self._process:
-            self.process.communicate()
-        elif self.debug:
+        process = self._close()
+        if process and process.returncode:
+            utils.LOG.warn(
+                "kcidb-submit exited with status {}".format(
+                    process.returncode))
+        elif not process and self.debug:
             utils.LOG.info("No kcidb-submit process running")
 
+    def _write(self, json_data):
+        process = self.process
+        process.stdin.write(json_data)
+        process.stdin.flush()
+
     def write(self, json_data):
-        self.process.stdin.write(json_data)
+        """Write JSON data, restarting kcidb-submit once if it fails.
+
+        :param json_data: The JSON data.
+        :type json_data: str
+        """
         if not json_data.endswith('\n'):
-            self.process.stdin.write('\n')
-        self.process.stdin.flush()
-        if self.process.returncode:
-            utils.LOG.warn("Failed to push data to KCIDB")
+            json_data += '\n'
+
+        try:
+            self._write(json_data)
+        except IOError, ex:
+            utils.LOG.warn(
+                "Failed to push data to KCIDB, restarting kcidb-submit: "
+                "{}".format(ex))
+            self._close()
+            self.restarts += 1
+            self._write(json_data)
+
+    def submit(self, data):
+        """Write kcidb data as compact JSON.
+
+        :param data: The kcidb data, the objects of each kind can be any
+        iterable.
+        :type data: dict
+        """
+        self.write(json.dumps(_get_kcidb_lists(data),
+                              separators=JSON_SEPARATORS))
+
+
+def _get_kcidb_lists(data):
+    """Turn the iterables of objects of kcidb data into lists."""
+    return {
+        kind: objects if isinstance(objects, types.StringTypes)
+        else list(objects)
+        for kind, objects in data.iteritems()
+    }
+
+
+def _get_batch_json(items):
+    """Create the JSON data of a batch.
+
+    :param items: The (kind, JSON data) tuples of the batch objects.
+    :type items: list
+    :return The JSON data, with the objects of each kind in a list.
+    """
+    objects = {}
+    for kind, json_data in items:
+        objects.setdefault(kind, []).append(json_data)
+
+    kinds = [kind for kind in OBJECT_KINDS if kind in objects]
+    kinds.extend(sorted(set(objects).difference(OBJECT_KINDS)))
+
+    parts = ['"version":' + json.dumps(KCIDB_VERSION)]
+    parts.extend(
+        '{}:[{}]'.format(json.dumps(kind), ",".join(objects[kind]))
+        for kind in kinds)
+    return "{" + ",".join(parts) + "}"
+
+
+class KcidbBuffer(object):
+    """Coalesce the kcidb data of several tasks into batches.
+
+    The objects are serialized to compact JSON when they are added, and
+    submitted by a thread in batches of at most `max_items` objects or
+    `max_bytes` bytes, or when the oldest object has been waiting for
+    `max_delay` seconds.  Adding objects blocks while `max_queue` objects
+    are waiting, until a batch is submitted.
+
+    The metrics are:
+    - queue_depth: the number of objects waiting
+    - queue_bytes: the size of the objects waiting
+    - queue_latency_max: the longest time an object waited, in seconds
+    - batches: the number of batches submitted
+    - objects: the number of objects submitted
+    - errors: the number of batches that could not be submitted
+    - blocked: the number of times adding an object had to wait
+    - restarts: the number of times kcidb-submit was restarted
+    - submit_latency_last, submit_latency_avg, submit_latency_max: the time
+      taken to write a batch to kcidb-submit, in seconds
+
+    :param kcidb_submit: The object writing the batches.
+    :type kcidb_submit: KcidbSubmit
+    :param max_items: The maximum number of objects of a batch.
+    :type max_items: int
+    :param max_bytes: The maximum size of a batch.
+    :type max_bytes: int
+    :param max_delay: How long an object waits for its batch to be full.
+    :type max_delay: float
+    :param max_queue: The maximum number of objects waiting.
+    :type max_queue: int
+    """
+
+    def __init__(self, kcidb_submit, max_items=1000,
+                 max_bytes=4 * 1024 * 1024, max_delay=10, max_queue=10000):
+        self.kcidb_submit = kcidb_submit
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.max_queue = max(max_queue, max_items)
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._added = 0
+        self._popped = 0
+        self._done = 0
+        self._flush_until = 0
+        self._stop = False
+        self._thread = None
+        self._metrics = dict.fromkeys([
+            "queue_latency_max",
+            "batches", "objects", "errors", "blocked",
+            "submit_latency_last",
+            "submit_latency_total", "submit_latency_max"], 0)
+
+    def submit(self, data):
+        """Add the objects of kcidb data to the buffer.
+
+        :param data: The kcidb data, the objects of each kind can be any
+        iterable.  The version is set by the buffer.
+        :type data: dict
+        """
+        for kind, objects in data.iteritems():
+            if kind == "version":
+                continue
+            for obj in objects:
+                self._add(kind, json.dumps(obj, separators=JSON_SEPARATORS))
+
+    def _add(self, kind, json_data):
+        with self._cond:
+            self._start()
+            if len(self._pending) >= self.max_queue:
+                self._metrics["blocked"] += 1
+                while len(self._pending) >= self.max_queue:
+                    self._cond.wait()
+
+            self._pending.append((kind, json_data, time.time()))
+            self._pending_bytes += len(json_data)
+            self._added += 1
+            if len(self._pending) >= self.max_items or \
+                    self._pending_bytes >= self.max_bytes:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Submit all the objects added, and wait for them to be written."""
+        with self._cond:
+            until = self._added
+            self._flush_until = max(self._flush_until, until)
+            self._start()
+            self._cond.notify_all()
+            while self._done < until:
+                self._cond.wait()
+
+    def terminate(self):
+        """Submit all the objects added, then stop the thread and the
+        kcidb-submit process."""
+        self.flush()
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stop = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        with self._cond:
+            self._stop = False
+        self.kcidb_submit.terminate()
+
+    def get_metrics(self):
+        """Get the metrics of the buffer.
+
+        :return A dictionary with the metrics values.
+        """
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._pending)
+            metrics["queue_bytes"] = self._pending_bytes
+
+        total = metrics.pop("submit_latency_total")
+        metrics["submit_latency_avg"] = \
+            total / metrics["batches"] if metrics["batches"] else 0
+        metrics["restarts"] = getattr(self.kcidb_submit, "restarts", 0)
+        return metrics
+
+    def _start(self):
+        """Start the submitting thread, with the lock held."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="KcidbBuffer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _get_wait_time(self):
+        """Get how long to wait for a batch, with the lock held.
+
+        :return 0 if a batch is ready, None to wait until objects are added.
+        """
+        if not self._pending:
+            return None
+        if self._stop or self._flush_until > self._popped or \
+                len(self._pending) >= self.max_items or \
+                self._pending_bytes >= self.max_bytes:
+            return 0
+        return max(0, self._pending[0][2] + self.max_delay - time.time())
+
+    def _pop_batch(self):
+        """Take the objects of the next batch, with the lock held."""
+        batch = []
+        size = 0
+        while self._pending and len(batch) < self.max_items:
+            kind, json_data, added = self._pending[0]
+            if batch and size + len(json_data) > self.max_bytes:
+                break
+            self._pending.popleft()
+            batch.append((kind, json_data, added))
+            size += len(json_data)
+
+        self._pending_bytes -= size
+        self._popped += len(batch)
+        self._cond.notify_all()
+        return batch
+
+    def _write_batch(self, batch):
+        json_data = _get_batch_json(
+            (kind, json_data) for kind, json_data, _ in batch)
+
+        start = time.time()
+        try:
+            self.kcidb_submit.write(json_data)
+            error = 0
+        except (IOError, OSError), ex:
+            utils.LOG.error(
+                "Failed to submit {} objects to KCIDB".format(len(batch)))
+            utils.LOG.exception(ex)
+            error = 1
+        end = time.time()
+
+        with self._cond:
+            latency = end - start
+            metrics = self._metrics
+            metrics["batches"] += 1
+            metrics["objects"] += len(batch)
+            metrics["errors"] += error
+            metrics["submit_latency_last"] = latency
+            metrics["submit_latency_total"] += latency
+            metrics["submit_latency_max"] = max(
+                metrics["submit_latency_max"], latency)
+            metrics["queue_latency_max"] = max(
+                metrics["queue_latency_max"], start - batch[0][2])
+            self._done += len(batch)
+            self._cond.notify_all()
+
+    def _run(self):
+        """Submit the batches."""
+        while True:
+            with self._cond:
+                wait_time = self._get_wait_time()
+                while wait_time != 0:
+                    if self._stop:
+                        return
+                    self._cond.wait(wait_time)
+                    wait_time = self._get_wait_time()
+                batch = self._pop_batch()
+
+            self._write_batch(batch)
+
+
+def create_submitter(kcidb_options):
+    """Create the object submitting the kcidb data of a worker process.
+
+    The data is coalesced in a `KcidbBuffer` unless the `batch_size` option
+    is 0.
+
+    :param kcidb_options: The kcidb options, with the optional `batch_size`,
+    `batch_bytes`, `batch_delay` and `queue_size` buffer options.
+    :type kcidb_options: dict
+    :return A `KcidbBuffer` or a `KcidbSubmit` object.
+    """
+    kcidb_submit = KcidbSubmit(kcidb_options)
+    batch_size = kcidb_options.get("batch_size", 1000)
+    if not batch_size:
+        return kcidb_submit
+
+    return KcidbBuffer(
+        kcidb_submit,
+        max_items=batch_size,
+        max_bytes=kcidb_options.get("batch_bytes", 4 * 1024 * 1024),
+        max_delay=kcidb_options.get("batch_delay", 10),
+        max_queue=kcidb_options.get("queue_size", 10000))
 
 
 # Mapping between kcidb revision keys and build documents
@@ -101,38 +432,103 @@ def _get_build_doc(group, db):
     return utils.db.find_one2(db[models.BUILD_COLLECTION], spec)
 
 
-def _get_test_cases(group, db, hierarchy, ns):
-    case_collection = db[models.TEST_CASE_COLLECTION]
-    group_collection = db[models.TEST_GROUP_COLLECTION]
+def _get_group_paths(group, db):
+    """Get the paths and the test cases of a test group and its sub-groups.
 
-    hierarchy = hierarchy + [group[models.NAME_KEY]]
-    tests = [
-        {
+    The sub-groups are looked up one level at a time, with only the fields
+    needed to walk the tree.
+
+    :param group: The test group document.
+    :type group: dict
+    :param db: The database connection.
+    :return A 2-tuple: a dictionary with the group IDs as keys, and their
+    paths as lists of names as values; a dictionary with the group IDs as
+    keys, and the sets of their test case IDs as values.
+    """
+    collection = db[models.TEST_GROUP_COLLECTION]
+    fields = [
+        models.ID_KEY,
+        models.NAME_KEY,
+        models.SUB_GROUPS_KEY,
+        models.TEST_CASES_KEY,
+    ]
+    paths = {group[models.ID_KEY]: [group[models.NAME_KEY]]}
+    cases = {group[models.ID_KEY]: set(group.get(models.TEST_CASES_KEY) or [])}
+    level = [group]
+
+    while level:
+        sub_groups = utils.kci_test.tree.find_by_ids(
+            collection,
+            (sub_id
+             for parent in level for sub_id in parent[models.SUB_GROUPS_KEY]),
+            fields=fields)
+
+        next_level = []
+        for parent in level:
+            for sub_id in parent[models.SUB_GROUPS_KEY]:
+                sub_group = sub_groups.get(sub_id)
+                if sub_group and sub_id not in paths:
+                    paths[sub_id] = paths[parent[models.ID_KEY]] + [
+                        sub_group[models.NAME_KEY]]
+                    cases[sub_id] = set(
+                        sub_group.get(models.TEST_CASES_KEY) or [])
+                    next_level.append(sub_group)
+        level = next_level
+
+    return paths, cases
+
+
+def _get_test_cases(group, db, ns, chunk_size=TESTS_CHUNK_SIZE):
+    """Walk the test cases of a test group and of all its sub-groups.
+
+    The test cases are read with a single cursor on the test group ID index,
+    `chunk_size` documents at a time.  The ones that are not listed in the
+    test cases of their group are skipped.
+
+    :param group: The test group document.
+    :type group: dict
+    :param db: The database connection.
+    :param ns: The namespace of the kcidb IDs.
+    :type ns: str
+    :param chunk_size: The number of test cases read at a time.
+    :type chunk_size: int
+    :return A generator of dictionaries with the kcidb ID, path, status and
+    start time of each test case.
+    """
+    paths, cases = _get_group_paths(group, db)
+    case_fields = [
+        models.ID_KEY,
+        models.NAME_KEY,
+        models.STATUS_KEY,
+        models.CREATED_KEY,
+        models.TEST_GROUP_ID_KEY,
+    ]
+    cursor = utils.db.find(
+        db[models.TEST_CASE_COLLECTION],
+        spec={models.TEST_GROUP_ID_KEY: {"$in": list(paths)}},
+        fields=case_fields)
+    cursor.batch_size(chunk_size)
+
+    for test in cursor:
+        if test[models.ID_KEY] not in cases[test[models.TEST_GROUP_ID_KEY]]:
+            continue
+        yield {
             'id': _make_id(test[models.ID_KEY], ns),
-            'path': '.'.join(hierarchy + [test[models.NAME_KEY]]),
+            'path': '.'.join(
+                paths[test[models.TEST_GROUP_ID_KEY]] +
+                [test[models.NAME_KEY]]),
             'status': test[models.STATUS_KEY],
             # ToDo: get start and duration times from LAVA log timestamps
             'start_time': test[models.CREATED_KEY].isoformat(),
         }
-        for test in (
-            utils.db.find_one2(case_collection, test_id)
-            for test_id in group[models.TEST_CASES_KEY]
-        )
-    ]
-
-    for sub_group_id in group[models.SUB_GROUPS_KEY]:
-        sub_group = utils.db.find_one2(group_collection, sub_group_id)
-        tests += _get_test_cases(sub_group, db, hierarchy, ns)
-
-    return tests
 
 
 def _submit(data, kcidb_options, kcidb_submit):
-    json_data = json.dumps(data, indent=2)
     if kcidb_options.get("debug"):
+        data = _get_kcidb_lists(data)
         utils.LOG.info("Submitting with kcidb:")
-        utils.LOG.info(json_data)
-    kcidb_submit.write(json_data)
+        utils.LOG.info(json.dumps(data, indent=2))
+    kcidb_submit.submit(data)
 
 
 def push_build(build_id, first, kcidb_options, kcidb_submit,
@@ -146,7 +542,7 @@ def push_build(build_id, first, kcidb_options, kcidb_submit,
     revision_id = build[models.GIT_COMMIT_KEY]
 
     kcidb_data = {
-        'version': '1',
+        'version': KCIDB_VERSION,
     }
 
     if first:
@@ -234,7 +630,7 @@ def push_tests(group_id, kcidb_options, kcidb_submit,
     group = utils.db.find_one2(collection, group_id)
     origin = kcidb_options.get("origin", "kernelci")
     ns = kcidb_options.get("namespace", "kernelci.org")
-    test_cases = _get_test_cases(group, db, [], ns)
+    chunk_size = kcidb_options.get("tests_chunk_size", TESTS_CHUNK_SIZE)
     build = _get_build_doc(group, db)
     if not build:
         utils.LOG.warn("kcidb: Missing build, unable to push tests.")
@@ -275,27 +671,36 @@ def push_tests(group_id, kcidb_options, kcidb_submit,
         )
         output_files.append({"name": name, "url": url})
 
-    kcidb_data = {
-        'version': '1',
-        "tests": [
-            {
-                'build_origin': origin,
-                'build_origin_id': build_id,
-                'origin': origin,
-                'origin_id': test['id'],
-                'environment': {
-                    'description': env_description,
-                    'misc': env_misc,
-                },
-                'path': test['path'],
-                'description': test_description,
-                'status': status_translate.get(test['status'], test['status']),
-                'waived': False,
-                'start_time': test['start_time'],
-                'output_files': output_files,
-                'misc': _get_test_misc(group, test)
-            }
-            for test in test_cases
-        ],
+    # The environment and output files are the same for all the tests, they
+    # are shared rather than copied for each one.
+    environment = {
+        'description': env_description,
+        'misc': env_misc,
     }
-    _submit(kcidb_data, kcidb_options, kcidb_submit)
+    tests = (
+        {
+            'build_origin': origin,
+            'build_origin_id': build_id,
+            'origin': origin,
+            'origin_id': test['id'],
+            'environment': environment,
+            'path': test['path'],
+            'description': test_description,
+            'status': status_translate.get(test['status'], test['status']),
+            'waived': False,
+            'start_time': test['start_time'],
+            'output_files': output_files,
+            'misc': _get_test_misc(group, test)
+        }
+        for test in _get_test_cases(group, db, ns, chunk_size)
+    )
+
+    while True:
+        chunk = list(itertools.islice(tests, chunk_size))
+        if not chunk:
+            break
+        kcidb_data = {
+            'version': KCIDB_VERSION,
+            'tests': chunk,
+        }
+        _submit(kcidb_data, kcidb_options, kcidb_submit)
@@ -20,7 +20,9 @@
 
 import argparse
 import cgi
+import codecs
 import dateutil.parser
+import gzip
 import json
 import re
 import yaml
@@ -69,115 +71,232 @@ HTML_HEAD = """\
 DT_RE = re.compile(r"([0-9-]+)T([0-9:.]+)")
 
 
-def run(log, meta, txt, html):
-    boot_result = meta.get("boot_result", "Unknown")
-    if boot_result == "PASS":
-        boot_result_html = "<span class=\"pass\">PASS</span>"
-    elif boot_result == "FAIL":
-        boot_result_html = "<span class=\"err\">FAIL</span>"
+# Kernel log level prefix of the target messages: <0> to <7>.
+KERNEL_LEVEL_RE = re.compile(r'^\<([0-7])\>')
+
+LINE_START = \
+    u"<span id=L%(n)d><a class=\"lineno\" href=\"#L%(n)d\">%(n)5d</a> "
+TIMESTAMP = u"<span class=\"timestamp\">%(ts)s  </span>"
+LINE_END = u"</span>\n"
+
+# The HTML class of the messages of each LAVA log level.
+LEVEL_CLASSES = {
+    "emerg": "alert",
+    "alert": "alert",
+    "crit": "alert",
+    "error": "err",
+    "warning": "warn",
+    "notice": "info",
+    "info": "lavainfo",
+    "debug": "lavainfo",
+}
+
+# The HTML class of the messages of each kernel log level.
+KERNEL_LEVEL_CLASSES = {
+    "0": "alert",  # define KERN_EMERG
+    "1": "alert",  # define KERN_ALERT
+    "2": "alert",  # define KERN_CRIT
+    "3": "err",    # define KERN_ERR
+    "4": "warn",   # define KERN_WARNI
+    "5": "info",   # define KERN_NOTIC
+    "6": "info",   # define KERN_INFO
+    "7": "debug",  # define KERN_DEBUG
+}
+
+
+def _line_template(css_class=None):
+    """Create the template of an HTML log line.
+
+    :param css_class: The class of the message, or None.
+    :type css_class: str
+    :return The template string, to be formatted with a dictionary with the
+    line number `n`, the timestamp `ts` and the escaped message `msg`.
+    """
+    if css_class:
+        msg = u"<span class=\"" + css_class + u"\">%(msg)s</span>"
     else:
-        boot_result_html = "<span class=\"warn\">{}</span>".format(boot_result)
-
-    formats = {
-        "emerg": u"<span class=\"alert\">{}</span>",
-        "alert": u"<span class=\"alert\">{}</span>",
-        "crit": u"<span class=\"alert\">{}</span>",
-        "error": u"<span class=\"err\">{}</span>",
-        "warning": u"<span class=\"warn\">{}</span>",
-        "notice": u"<span class=\"info\">{}</span>",
-        "info": u"<span class=\"lavainfo\">{}</span>",
-        "debug": u"<span class=\"lavainfo\">{}</span>"
-    }
-
-    kernel_log_levels = {
-        "0": u"<span class=\"alert\">{}</span>",
-        "1": u"<span class=\"alert\">{}</span>",
-        "2": u"<span class=\"alert\">{}</span>",
-        "3": u"<span class=\"err\">{}</span>",
-        "4": u"<span class=\"warn\">{}</span>",
-        "5": u"<span class=\"info\">{}</span>",
-        "6": u"<span class=\"info\">{}</span>",
-        "7": u"<span class=\"debug\">{}</span>",
-    }
-
-    numbers = {
-        "emerg": 0,
-        "alert": 0,
-        "crit": 0,
-        "error": 0,
-        "warning": 0,
-        "notice": 0,
-        "info": 0,
-        "debug": 0,
-    }
-
-    kernel_numbers = {
-        "0": 0,  # define KERN_EMERG
-        "1": 0,  # define KERN_ALERT
-        "2": 0,  # define KERN_CRIT
-        "3": 0,  # define KERN_ERR
-        "4": 0,  # define KERN_WARNI
-        "5": 0,  # define KERN_NOTIC
-        "6": 0,  # define KERN_INFO
-        "7": 0   # define KERN_DEBUG
-    }
-
-    start_ts = None
-    log_buffer = []
-    lineno = 0
-
-    for line in log:
-        lineno = lineno + 1
-        dt, level, msg = (line.get(k) for k in ["dt", "lvl", "msg"])
-        raw_ts = DT_RE.match(dt).groups()[1]
-        timestamp = "<span class=\"timestamp\">{}  </span>".format(raw_ts)
-        sl = \
-            "<span id=L{lineno}>"\
-            "<a class=\"lineno\" href=\"#L{lineno}\">{lineno:5d}</a> "\
-            .format(lineno=lineno)
-        el = "</span>\n"
-
-        if isinstance(msg, list):
-            msg = ' '.join(msg)
-
-        fmt = formats.get(level)
-        if fmt:
-            log_buffer .append(
-                ''.join([sl, timestamp, fmt.format(cgi.escape(msg)), el]))
-            numbers[level] += 1
-        elif level == "target":
-            kernel_level = re.match(r'^\<([0-7])\>', msg)
-            if kernel_level:
-                fmt = kernel_log_levels[kernel_level.group(1)]
-                log_buffer.append(''.join(
-                        [sl, timestamp, fmt.format(cgi.escape(msg)), el]))
-                kernel_numbers[kernel_level.group(1)] += 1
-            else:
-                log_buffer.append(
-                    ''.join([sl, timestamp, cgi.escape(msg), el]))
-            txt.write(msg)
-            txt.write("\n")
-        elif level == "info" and msg.startswith("Start time: "):
-            start_ts = msg
-
-    html.write(HTML_HEAD.format(device_type=meta["device_type"]))
-    html.write("<ul class=\"results\">")
-    results = {
-        "Boot result": boot_result_html,
-        "Errors": numbers["error"],
-        "Warnings": numbers["warning"],
-        "Kernel Errors": sum(kernel_numbers[level] for level in "0123"),
-        "Kernel Warnings": kernel_numbers["4"]
-    }
-
-    for title, value in results.iteritems():
-        html.write("<li class=\"result\">{}: {}</li>".format(title, value))
-    if start_ts:
-        html.write("<li class=\"result\">{}</li>".format(start_ts))
-    html.write("</ul><pre>\n")
-    for line in log_buffer:
-        html.write(line)
-    html.write("</pre></body></html>\n")
+        msg = u"%(msg)s"
+    return LINE_START + TIMESTAMP + msg + LINE_END
+
+
+class LogRenderer(object):
+    """Render a LAVA log as plain text and HTML.
+
+    The line templates are created once, and can be used to render several
+    logs.  Each log is rendered in a single pass, and the output is written
+    `buffer_lines` lines at a time.
+    """
+
+    def __init__(self, buffer_lines=4096):
+        self.buffer_lines = buffer_lines
+        self._plain = _line_template()
+        self._levels = {
+            level: _line_template(css_class)
+            for level, css_class in LEVEL_CLASSES.iteritems()
+        }
+        self._kernel_levels = {
+            level: _line_template(css_class)
+            for level, css_class in KERNEL_LEVEL_CLASSES.iteritems()
+        }
+
+    def render(self, log):
+        """Render the lines of a log.
+
+        :param log: The log lines, dictionaries with the `dt`, `lvl` and
+        `msg` values.
+        :type log: list
+        :return A tuple with the list of text lines, the list of HTML lines
+        and a dictionary with the number of lines of each LAVA log level and
+        kernel log level, and the start time line.
+        """
+        numbers = dict.fromkeys(self._levels, 0)
+        kernel_numbers = dict.fromkeys(self._kernel_levels, 0)
+        start_ts = None
+        txt_lines = []
+        html_lines = []
+        txt_append = txt_lines.append
+        html_append = html_lines.append
+        levels_get = self._levels.get
+        kernel_level_match = KERNEL_LEVEL_RE.match
+        dt_match = DT_RE.match
+        escape = cgi.escape
+
+        for lineno, line in enumerate(log, 1):
+            dt, level, msg = (line.get(k) for k in ["dt", "lvl", "msg"])
+
+            if isinstance(msg, list):
+                msg = ' '.join(msg)
+
+            subs = {
+                "n": lineno,
+                "ts": dt_match(dt).groups()[1],
+            }
+
+            template = levels_get(level)
+            if template:
+                subs["msg"] = escape(msg)
+                html_append(template % subs)
+                numbers[level] += 1
+            elif level == "target":
+                subs["msg"] = escape(msg)
+                kernel_level = kernel_level_match(msg)
+                if kernel_level:
+                    kernel_level = kernel_level.group(1)
+                    html_append(self._kernel_levels[kernel_level] % subs)
+                    kernel_numbers[kernel_level] += 1
+                else:
+                    html_append(self._plain % subs)
+                txt_append(msg)
+                txt_append("\n")
+            elif level == "info" and msg.startswith("Start time: "):
+                start_ts = msg
+
+        counts = {
+            "numbers": numbers,
+            "kernel_numbers": kernel_numbers,
+            "start_ts": start_ts,
+        }
+
+        return txt_lines, html_lines, counts
+
+    def _write_lines(self, files, lines):
+        """Write lines to some files, `buffer_lines` lines at a time."""
+        for start in xrange(0, len(lines), self.buffer_lines):
+            chunk = u"".join(lines[start:start + self.buffer_lines])
+            for output in files:
+                output.write(chunk)
+
+    def write(self, log, meta, txt_files, html_files):
+        """Render a log and write it as plain text and HTML.
+
+        :param log: The log lines.
+        :type log: list
+        :param meta: The job meta-data, with the `device_type` and
+        `boot_result` values.
+        :type meta: dict
+        :param txt_files: The files where to write the plain text log.
+        :type txt_files: list
+        :param html_files: The files where to write the HTML log.
+        :type html_files: list
+        """
+        txt_lines, html_lines, counts = self.render(log)
+        numbers = counts["numbers"]
+        kernel_numbers = counts["kernel_numbers"]
+        start_ts = counts["start_ts"]
+
+        boot_result = meta.get("boot_result", "Unknown")
+        if boot_result == "PASS":
+            boot_result_html = "<span class=\"pass\">PASS</span>"
+        elif boot_result == "FAIL":
+            boot_result_html = "<span class=\"err\">FAIL</span>"
+        else:
+            boot_result_html = \
+                "<span class=\"warn\">{}</span>".format(boot_result)
+
+        results = {
+            "Boot result": boot_result_html,
+            "Errors": numbers["error"],
+            "Warnings": numbers["warning"],
+            "Kernel Errors": sum(kernel_numbers[level] for level in "0123"),
+            "Kernel Warnings": kernel_numbers["4"]
+        }
+
+        head = [
+            HTML_HEAD.format(device_type=meta["device_type"]),
+            "<ul class=\"results\">",
+        ]
+        for title, value in results.iteritems():
+            head.append(
+                "<li class=\"result\">{}: {}</li>".format(title, value))
+        if start_ts:
+            head.append("<li class=\"result\">{}</li>".format(start_ts))
+        head.append("</ul><pre>\n")
+
+        self._write_lines(txt_files, txt_lines)
+        self._write_lines(html_files, head)
+        self._write_lines(html_files, html_lines)
+        self._write_lines(html_files, ["</pre></body></html>\n"])
+
+    def write_files(self, log, meta, txt_path, html_path, compress=False):
+        """Render a log and write it in plain text and HTML files.
+
+        :param log: The log lines.
+        :type log: list
+        :param meta: The job meta-data.
+        :type meta: dict
+        :param txt_path: The path of the plain text file.
+        :type txt_path: str
+        :param html_path: The path of the HTML file.
+        :type html_path: str
+        :param compress: If gzip-compressed copies of the files should be
+        written too, with the .gz extension.
+        :type compress: bool
+        """
+        paths = [txt_path, html_path]
+        files = [codecs.open(path, "w", "utf-8") for path in paths]
+        if compress:
+            writer = codecs.getwriter("utf-8")
+            files.extend(
+                writer(gzip.open(path + ".gz", "wb")) for path in paths)
+
+        try:
+            self.write(log, meta, files[0::2], files[1::2])
+        finally:
+            for output in files:
+                output.close()
+
+
+def run(log, meta, txt, html):
+    """Render a log as plain text and HTML.
+
+    :param log: The log lines.
+    :type log: list
+    :param meta: The job meta-data.
+    :type meta: dict
+    :param txt: The file where to write the plain text log.
+    :param html: The file where to write the HTML log.
+    """
+    LogRenderer().write(log, meta, [txt], [html])
 
 
 def main(args):
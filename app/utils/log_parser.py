@@ -22,22 +22,21 @@
 
 """Extract and save build log errors."""
 
+import billiard
 import bson
 import datetime
 import io
 import itertools
 import os
 import re
-import redis
 
 import models
 import models.build as mbuild
 import models.error_log as merrl
-import models.error_summary as mesumm
 import utils
 import utils.build
-import utils.database.redisdb as redisdb
 import utils.errors
+import utils.logs.summary
 
 ERROR_PATTERN_1 = re.compile(r"[Ee]rror:")
 ERROR_PATTERN_2 = re.compile(r"^ERROR")
@@ -77,19 +76,169 @@ ERROR_PATTERNS = [
     ERROR_PATTERN_7
 ]
 
+# Lower-case strings that any line matching one of the patterns above must
+# contain: used to quickly skip all the other lines.
+CANDIDATE_STRINGS = (
+    "error",
+    "warning",
+    "section mismatch",
+    "undefined reference",
+    "gcc doesn't support",
+    "command not found",
+    "/bin/",
+)
+
+# Size of the chunks read from the build log files.
+READ_CHUNK_SIZE = 1024 * 1024
+
+ERROR_LINE = "error"
+WARNING_LINE = "warning"
+MISMATCH_LINE = "mismatch"
+
 ERR_ADD = utils.errors.add_error
 
+# Process ID, number of processes and pool used to parse build logs.
+PARSER_POOL = None
+
 
-def _dict_to_list(data):
-    """Transform a dictionary into a list of tuples.
+class BuildLogClassifier(object):
+    """Extract the error, warning and mismatch lines from build logs.
 
-    :param data: The dictionary to transform.
-    :return A list of tuples.
+    The build log data is read in large chunks and searched for the
+    `CANDIDATE_STRINGS`.  Only the lines that contain one of them are decoded
+    and classified with the exact error, warning and mismatch patterns: most
+    of the lines of a build log don't, so they are never handled one by one
+    in Python.
     """
-    tupl = zip(data.values(), data.keys())
-    tupl.sort()
-    tupl.reverse()
-    return tupl
+
+    def __init__(self, chunk_size=READ_CHUNK_SIZE, encoding="utf-8"):
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+
+    @staticmethod
+    def classify(line):
+        """Classify a single build log line.
+
+        :param line: The line to classify.
+        :type line: unicode
+        :return ERROR_LINE, WARNING_LINE, MISMATCH_LINE or None.
+        """
+        if any(pattern.search(line) for pattern in ERROR_PATTERNS):
+            return ERROR_LINE
+
+        if WARNING_PATTERN.search(line) and \
+                not any(pattern.search(line) for pattern in EXCLUDE_PATTERNS):
+            return WARNING_LINE
+
+        if MISMATCH_PATTERN.search(line):
+            return MISMATCH_LINE
+
+        return None
+
+    @staticmethod
+    def _clean_line(line):
+        """Strip the line and the relative path prefix if any."""
+        line = line.strip()
+        if line.startswith("../"):
+            line = line[3:]
+        return line
+
+    @staticmethod
+    def _candidate_lines(data):
+        """Find the lines containing a candidate string.
+
+        The data is lower-cased once and searched for each of the
+        `CANDIDATE_STRINGS`, the matching lines are then returned in their
+        original order.
+
+        :param data: Build log data, made of complete lines.
+        :type data: str
+        :return Yield the candidate lines as raw strings.
+        """
+        if "\r" in data:
+            # Same as the universal newlines mode of text files.
+            data = data.replace("\r\n", "\n").replace("\r", "\n")
+
+        lower = data.lower()
+        find = lower.find
+        rfind = lower.rfind
+        data_len = len(data)
+        lines = set()
+
+        for candidate in CANDIDATE_STRINGS:
+            pos = find(candidate)
+            while pos != -1:
+                end = find("\n", pos)
+                if end == -1:
+                    end = data_len
+                lines.add((rfind("\n", 0, pos) + 1, end))
+                pos = find(candidate, end)
+
+        for start, end in sorted(lines):
+            yield data[start:end]
+
+    def scan(self, data):
+        """Classify the lines of some build log data.
+
+        :param data: Build log data, made of complete lines.
+        :type data: str
+        :return Yield 2-tuples with the line type and the cleaned line.
+        """
+        for raw_line in self._candidate_lines(data):
+            line = raw_line.decode(self.encoding, "replace")
+            line_type = self.classify(line)
+            if line_type:
+                yield line_type, self._clean_line(line)
+
+    def scan_stream(self, stream):
+        """Classify all the lines read from a binary stream.
+
+        :param stream: The file-like object to read from.
+        :return Yield 2-tuples with the line type and the cleaned line.
+        """
+        tail = ""
+        while True:
+            chunk = stream.read(self.chunk_size)
+            if not chunk:
+                break
+            data = tail + chunk
+            cut = max(data.rfind("\n"), data.rfind("\r")) + 1
+            tail = data[cut:]
+            for item in self.scan(data[:cut]):
+                yield item
+
+        if tail:
+            for item in self.scan(tail):
+                yield item
+
+    def parse_stream(self, stream):
+        """Extract the error, warning and mismatch lines from a stream.
+
+        :param stream: The binary file-like object to read from.
+        :return A 3-tuple with the lists of error, warning and mismatch
+        lines.
+        """
+        lines = {
+            ERROR_LINE: [],
+            WARNING_LINE: [],
+            MISMATCH_LINE: [],
+        }
+        for line_type, line in self.scan_stream(stream):
+            lines[line_type].append(line)
+
+        return lines[ERROR_LINE], lines[WARNING_LINE], lines[MISMATCH_LINE]
+
+    def parse_file(self, path):
+        """Extract the error, warning and mismatch lines from a file.
+
+        :param path: The path of the build log file.
+        :type path: str
+        :return A 3-tuple with the lists of error, warning and mismatch
+        lines.
+        :raise IOError if the file cannot be read.
+        """
+        with io.open(path, mode="rb") as read_file:
+            return self.parse_stream(read_file)
 
 
 def count_lines(error_lines, warning_lines, mismatch_lines):
@@ -122,147 +271,42 @@ def count_lines(error_lines, warning_lines, mismatch_lines):
     return errors_all, warnings_all, mismatches_all
 
 
-# pylint: disable=too-many-branches
-def _update_prev_summary(prev_doc, errors, warnings, mismatches, database):
-    """Update a summary document with new log data.
-
-    :param prev_doc: The previous error summary document.
-    :type prev_doc: dict
-    :param errors: The error lines and their count.
-    :type errors: dict
-    :param warnings: The warning lines and their count.
-    :type warnings: dict
-    :param mismatches: The mismatched lines and their count.
-    :type mismatches: dict
-    :param database: The database connection.
-    :return The return value of the update operation.
-    """
-
-    def _update_summary_data(prev_data, new_data):
-        """Create a new summary data structure based on the new and old values.
-
-        :param prev_data: The data found in the document stored in the
-        database.
-        :type prev_data: dict
-        :param new_data: The log data as processed.
-        :type new_data: dict
-        """
-        # First create a new dict based on the old values.
-        # The old value is a list of 2-tuples and we invert the values found in
-        # there: k, v = tuple[1], tuple[0]
-        prev_data_dict = dict((v, k) for k, v in prev_data)
-
-        # Loop through the new data and look for old values to update.
-        # This is done to update the sum of the log lines found.
-        for key, val in new_data.iteritems():
-            if key in prev_data_dict.viewkeys():
-                prev_data_dict[key] += val
-            else:
-                prev_data_dict[key] = val
-
-        return _dict_to_list(prev_data_dict)
-
-    doc_get = prev_doc.get
-    if errors:
-        prev_errors = doc_get(models.ERRORS_KEY, None)
-        if prev_errors:
-            prev_doc[models.ERRORS_KEY] = _update_summary_data(
-                prev_errors, errors)
-        else:
-            prev_doc[models.ERRORS_KEY] = _dict_to_list(errors)
-
-    if mismatches:
-        prev_mismatches = doc_get(models.MISMATCHES_KEY, None)
-        if prev_mismatches:
-            prev_doc[models.MISMATCHES_KEY] = _update_summary_data(
-                prev_mismatches, mismatches)
-        else:
-            prev_doc[models.MISMATCHES_KEY] = _dict_to_list(mismatches)
-
-    if warnings:
-        prev_warnings = doc_get(models.WARNINGS_KEY, None)
-        if prev_warnings:
-            prev_doc[models.WARNINGS_KEY] = _update_summary_data(
-                prev_warnings, warnings)
-        else:
-            prev_doc[models.WARNINGS_KEY] = _dict_to_list(warnings)
-
-    ret_val = utils.db.find_and_update(
-        database[models.ERRORS_SUMMARY_COLLECTION],
-        {models.ID_KEY: prev_doc[models.ID_KEY]},
-        {
-            models.ERRORS_KEY: prev_doc[models.ERRORS_KEY],
-            models.MISMATCHES_KEY: prev_doc[models.MISMATCHES_KEY],
-            models.WARNINGS_KEY: prev_doc[models.WARNINGS_KEY]
-        }
-    )
-    return ret_val
-
-
-# pylint: disable=too-many-arguments
-def _create_new_summary(
-        errors, warnings, mismatches, job_id, build_doc, database):
-    """Save a new error summary in the database.
-
-    :param errors:
-    :type errors: dict
-    :param warnings:
-    :type warnings: dict
-    :param mismatches:
-    :type mismatches:
-    :param job_id:
-    :type job_id: bson.objectid.ObjectId
-    :param build_doc: The BuildDocument.
-    :type build_doc: BuildDocument
-    :param database: The database connection.
-    :return The return value from the save operation.
-    """
-    error_summary = mesumm.ErrorSummaryDocument(job_id, "1.1")
-    error_summary.created_on = datetime.datetime.now(tz=bson.tz_util.utc)
-    error_summary.job = build_doc.job
-    error_summary.kernel = build_doc.kernel
-    error_summary.git_branch = build_doc.git_branch
-
-    # Store the summary as lists of 2-tuple values.
-    error_summary.errors = _dict_to_list(errors)
-    error_summary.mismatches = _dict_to_list(mismatches)
-    error_summary.warnings = _dict_to_list(warnings)
-
-    ret_val, _ = utils.db.save(database, error_summary)
-    return ret_val
-
-
 def _save_summary(
         errors, warnings, mismatches, job_id, build_doc, db_options):
-    """Save the summary for errors/warnings/mismatches found."""
+    """Save the summary for errors/warnings/mismatches found.
+
+    The counts are added to the summary of the job with a single atomic
+    update, creating the summary if it doesn't exist yet: build logs of the
+    same job can be parsed from multiple processes at the same time.
+    """
     ret_val = 200
     if (errors or warnings or mismatches):
-        prev_doc = None
         database = utils.db.get_db_connection(db_options)
-        redis_conn = redisdb.get_db_connection(db_options)
-        prev_spec = {
+        spec = {
             models.JOB_ID_KEY: job_id,
             models.JOB_KEY: build_doc.job,
             models.KERNEL_KEY: build_doc.kernel,
             models.GIT_BRANCH_KEY: build_doc.git_branch
         }
-
-        # We might being importing documents and parsing build logs from
-        # multiple processes.
-        # In order to avoid having wrong data in the database, lock the
-        # process here looking for the previous summary.
-        lock_key = "log-parser-{:s}".format(str(job_id))
-        with redis.lock.Lock(redis_conn, lock_key, timeout=5):
-            prev_doc = utils.db.find_one2(
-                database[models.ERRORS_SUMMARY_COLLECTION], prev_spec)
-
-            if prev_doc:
-                ret_val = _update_prev_summary(
-                    prev_doc, errors, warnings, mismatches, database)
-            else:
-                ret_val = _create_new_summary(
-                    errors,
-                    warnings, mismatches, job_id, build_doc, database)
+        increments, lines = utils.logs.summary.get_increments(
+            errors, warnings, mismatches)
+
+        ret_val = utils.db.upsert(
+            database[models.ERRORS_SUMMARY_COLLECTION],
+            spec,
+            {
+                "$inc": increments,
+                "$set": lines,
+                "$setOnInsert": {
+                    models.CREATED_KEY: datetime.datetime.now(
+                        tz=bson.tz_util.utc),
+                    models.ERRORS_KEY: [],
+                    models.MISMATCHES_KEY: [],
+                    models.VERSION_KEY: "1.2",
+                    models.WARNINGS_KEY: []
+                }
+            }
+        )
 
     return ret_val
 
@@ -472,19 +516,63 @@ def _save(
     return status
 
 
-# pylint: disable=too-many-statements
-# def _parse_log(job, kernel, defconfig, log_file, build_dir, errors):
-def _parse_log(build_doc, log_file, build_dir, errors):
-    """Read the build log and extract the correct strs.
+def _extract_log_lines(log_file):
+    """Extract the error, warning and mismatch lines from a build log.
 
-    Parse the build log extracting the errors/warnings/mismatches strs
-    saving new files for each of the extracted value.
+    This is a module-level function so that it can be run in a process pool.
+
+    :param log_file: The path of the build log file.
+    :type log_file: str
+    :return A 5-tuple: the status code (200 = OK, 500 = error), an error
+    message or None, and the lists of error, warning and mismatch lines.
+    """
+    if not os.path.isfile(log_file):
+        return 500, None, [], [], []
+
+    try:
+        error_lines, warning_lines, mismatch_lines = \
+            BuildLogClassifier().parse_file(log_file)
+    except IOError, ex:
+        utils.LOG.exception(ex)
+        return (
+            500, "Cannot read build log file {}".format(log_file), [], [], [])
+
+    return 200, None, error_lines, warning_lines, mismatch_lines
+
+
+def _get_parser_pool(processes):
+    """Get the pool of processes used to parse build logs.
+
+    The pool is created on first use and then kept for the lifetime of the
+    calling process, as starting and stopping it is more expensive than
+    parsing a typical build log.
+
+    :param processes: The number of processes in the pool.
+    :type processes: int
+    :return A billiard.Pool instance.
+    """
+    global PARSER_POOL
+
+    pid = os.getpid()
+    if PARSER_POOL is None or PARSER_POOL[:2] != (pid, processes):
+        if PARSER_POOL is not None and PARSER_POOL[0] == pid:
+            PARSER_POOL[2].terminate()
+        PARSER_POOL = (pid, processes, billiard.Pool(processes=processes))
+
+    return PARSER_POOL[2]
+
+
+def _save_log_lines(build_doc, build_dir, lines, errors):
+    """Write the extracted error, warning and mismatch lines to files.
 
     :param build_doc: A BuildDocument.
-    :param log_file: The file to parse.
-    :param build_dir: The directory where the file is located.
-    :return A status code (200 = OK, 500 = error) and
-    the lines for errors, warnings and mismatches as lists.
+    :param build_dir: The directory where the files should be written.
+    :type build_dir: str
+    :param lines: The lists of error, warning and mismatch lines.
+    :type lines: tuple
+    :param errors: Where errors should be stored.
+    :type errors: dict
+    :return A status code (200 = OK, 500 = error).
     """
     def _save_lines(lines, filename):
         # TODO: count the lines here.
@@ -495,66 +583,15 @@ def _parse_log(build_doc, log_file, build_dir, errors):
                 w_file.write(line)
                 w_file.write(u"\n")
 
-    def _clean_path(line):
-        """Strip the beginning of the line if it contains a special sequence.
-
-        :param line: The line to clean.
-        :type line: str
-        :return The line without the special sequence.
-        """
-        if line.startswith("../"):
-            line = line[3:]
-        return line
-
-    error_lines = []
-    warning_lines = []
-    mismatch_lines = []
-
-    if not os.path.isfile(log_file):
-        utils.LOG.warn("Build dir '%s' does not have a build log", build_dir)
-        return 500, [], [], []
-
-    errors_file = os.path.join(build_dir, utils.BUILD_ERRORS_FILE)
-    warnings_file = os.path.join(build_dir, utils.BUILD_WARNINGS_FILE)
-    mismatches_file = os.path.join(build_dir, utils.BUILD_MISMATCHES_FILE)
-
-    utils.LOG.info("Parsing build log file '%s'", log_file)
-
-    err_append = error_lines.append
-    warn_append = warning_lines.append
-    mismatch_append = mismatch_lines.append
+    file_names = [
+        utils.BUILD_ERRORS_FILE,
+        utils.BUILD_WARNINGS_FILE,
+        utils.BUILD_MISMATCHES_FILE,
+    ]
 
     try:
-        with io.open(log_file) as read_file:
-            for line in read_file:
-                if any(re.search(err_pattrn, line)
-                       for err_pattrn in ERROR_PATTERNS):
-                    line = line.strip()
-                    err_append(_clean_path(line))
-                    continue
-
-                if re.search(WARNING_PATTERN, line) \
-                        and not any(re.search(warn_pattrn, line)
-                                    for warn_pattrn in EXCLUDE_PATTERNS):
-                    line = line.strip()
-                    warn_append(_clean_path(line))
-                    continue
-
-                if re.search(MISMATCH_PATTERN, line):
-                    line = line.strip()
-                    mismatch_append(_clean_path(line))
-    except IOError, ex:
-        err_msg = "Cannot read build log file {}".format(log_file)
-        utils.LOG.exception(ex)
-        utils.LOG.error(err_msg)
-        status = 500
-        ERR_ADD(errors, status, err_msg)
-        return status, [], [], []
-
-    try:
-        _save_lines(error_lines, errors_file)
-        _save_lines(warning_lines, warnings_file)
-        _save_lines(mismatch_lines, mismatches_file)
+        for file_lines, file_name in zip(lines, file_names):
+            _save_lines(file_lines, os.path.join(build_dir, file_name))
     except IOError, ex:
         err_msg = "Error writing errors/warnings file for {}-{}-{}-{}".format(
             build_doc.job,
@@ -566,17 +603,83 @@ def _parse_log(build_doc, log_file, build_dir, errors):
         ERR_ADD(errors, status, err_msg)
     else:
         status = 200
-    return status, error_lines, warning_lines, mismatch_lines
+    return status
+
+
+def _parse_log(build_doc, log_file, build_dir, errors):
+    """Read the build log and extract the correct strs.
+
+    Parse the build log extracting the errors/warnings/mismatches strs
+    saving new files for each of the extracted value.
+
+    :param build_doc: A BuildDocument.
+    :param log_file: The file to parse.
+    :param build_dir: The directory where the file is located.
+    :return A status code (200 = OK, 500 = error) and
+    the lines for errors, warnings and mismatches as lists.
+    """
+    return _parse_logs(build_doc, [log_file], build_dir, errors)
+
+
+def _parse_logs(build_doc, log_files, build_dir, errors, processes=0):
+    """Read some build logs and extract the correct strs.
+
+    The logs can be parsed concurrently in a pool of `processes` worker
+    processes.  The extracted lines are merged in the order of `log_files`,
+    then saved in new files for each of the extracted value.
+
+    :param build_doc: A BuildDocument.
+    :param log_files: The files to parse.
+    :type log_files: list
+    :param build_dir: The directory where the files are located.
+    :type build_dir: str
+    :param errors: Where errors should be stored.
+    :type errors: dict
+    :param processes: The maximum number of processes to use, 0 or 1 to
+    parse the logs serially.
+    :type processes: int
+    :return A status code (200 = OK, 500 = error) and
+    the lines for errors, warnings and mismatches as lists.
+    """
+    for log_file in log_files:
+        utils.LOG.info("Parsing build log file '%s'", log_file)
+
+    if processes > 1 and len(log_files) > 1:
+        results = _get_parser_pool(processes).map(
+            _extract_log_lines, log_files)
+    else:
+        results = itertools.imap(_extract_log_lines, log_files)
+
+    err, warn, mism = ([], [], [])
+    for log_file, result in itertools.izip(log_files, results):
+        status, err_msg, err_lines, warn_lines, mism_lines = result
+        if status != 200:
+            if err_msg:
+                utils.LOG.error(err_msg)
+                ERR_ADD(errors, status, err_msg)
+            else:
+                utils.LOG.warn(
+                    "Build dir '%s' does not have a build log", build_dir)
+            return status, [], [], []
+        err.extend(err_lines)
+        warn.extend(warn_lines)
+        mism.extend(mism_lines)
+
+    status = _save_log_lines(build_doc, build_dir, (err, warn, mism), errors)
+    return status, err, warn, mism
 
 
 def parse_single_build_log(build_id, job_id, db_options,
-                           base_path=utils.BASE_PATH):
-    """Parse the build log file of a single build instance.
+                           base_path=utils.BASE_PATH, processes=0):
+    """Parse the build log files of a single build instance.
 
     :param build_id: The ID of the saved build.
     :param job_id: The ID of the saved job.
     :param db_options: The database connection options.
     :param base_path: The base path on the file system where data is stored.
+    :param processes: The maximum number of processes used to parse the build
+    logs concurrently, 0 or 1 to parse them serially.
+    :type processes: int
     :return A 2-tuple: the status code, the errors data structure.
     """
     status = 200
@@ -591,16 +694,12 @@ def parse_single_build_log(build_id, job_id, db_options,
         if build_doc:
             file_server_resource = build_doc.file_server_resource
             build_dir = os.path.join(base_path, file_server_resource)
-            err, warn, mism = ([], [], [])
-            for build_log in build_doc.kernel_build_logs:
-                log_file = os.path.join(build_dir, build_log)
-                status, err_lines, warn_lines, mism_lines = _parse_log(
-                    build_doc, log_file, build_dir, errors)
-                if status != 200:
-                    break
-                err.extend(err_lines)
-                warn.extend(warn_lines)
-                mism.extend(mism_lines)
+            log_files = [
+                os.path.join(build_dir, build_log)
+                for build_log in build_doc.kernel_build_logs
+            ]
+            status, err, warn, mism = _parse_logs(
+                build_doc, log_files, build_dir, errors, processes)
             if status == 200:
                 status = _save(
                     build_doc, job_id, err, warn, mism, errors, db_options)
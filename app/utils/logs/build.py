@@ -22,6 +22,7 @@ import os
 import models
 import utils
 import utils.db
+import utils.logs.summary
 
 
 def create_build_logs_summary(job, kernel, git_branch, db_options):
@@ -50,6 +51,7 @@ def create_build_logs_summary(job, kernel, git_branch, db_options):
         })
 
     if result:
+        utils.logs.summary.to_lists(result)
         errors = result.get(models.ERRORS_KEY)
         warnings = result.get(models.WARNINGS_KEY)
         mismatches = result.get(models.MISMATCHES_KEY)
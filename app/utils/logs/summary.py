@@ -0,0 +1,120 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Store and read the errors summary counts.
+
+The count of each log line is stored in a sub-document keyed by the hash of
+the line, so that the counts of a new build can be added with atomic `$inc`
+operations.  Readers get the summary back as lists of (count, line) values,
+sorted in descending order.
+"""
+
+import hashlib
+import types
+
+import models
+
+# The summary keys and the keys of the sub-documents with the counts.
+SUMMARY_KEYS = [
+    (models.ERRORS_KEY, models.ERRORS_LINES_KEY),
+    (models.WARNINGS_KEY, models.WARNINGS_LINES_KEY),
+    (models.MISMATCHES_KEY, models.MISMATCHES_LINES_KEY),
+]
+
+
+def line_hash(line):
+    """Calculate the hash of a log line, used as its key in the summary.
+
+    :param line: The log line.
+    :type line: str or unicode
+    :return The hex digest of the line.
+    """
+    if isinstance(line, types.UnicodeType):
+        line = line.encode("utf-8")
+    return hashlib.sha1(line).hexdigest()
+
+
+def get_increments(errors, warnings, mismatches):
+    """Create the update operations to add some counts to a summary.
+
+    :param errors: The error lines and their count.
+    :type errors: dict
+    :param warnings: The warning lines and their count.
+    :type warnings: dict
+    :param mismatches: The mismatched lines and their count.
+    :type mismatches: dict
+    :return A 2-tuple with the `$inc` and the `$set` documents.
+    """
+    increments = {}
+    lines = {}
+
+    for (_, lines_key), data in zip(
+            SUMMARY_KEYS, [errors, warnings, mismatches]):
+        if not data:
+            continue
+        for line, count in data.iteritems():
+            field = "{:s}.{:s}".format(lines_key, line_hash(line))
+            increments[field + "." + models.COUNT_KEY] = count
+            lines[field + "." + models.LINE_KEY] = line
+
+    return increments, lines
+
+
+def to_lists(summary):
+    """Replace the counts sub-documents of a summary with sorted lists.
+
+    The summary is modified in place: each list is made of [count, line]
+    values sorted in descending order.  Counts stored as lists by older
+    versions of the document are merged with the new ones.
+
+    :param summary: The errors summary document.
+    :type summary: dict
+    :return The summary document.
+    """
+    for key, lines_key in SUMMARY_KEYS:
+        lines = summary.pop(lines_key, None)
+        if lines is None:
+            continue
+
+        counts = dict((line, count) for count, line in summary.get(key) or [])
+        for value in lines.itervalues():
+            line = value[models.LINE_KEY]
+            counts[line] = counts.get(line, 0) + value[models.COUNT_KEY]
+
+        summary[key] = sorted(
+            ([count, line] for line, count in counts.iteritems()),
+            reverse=True)
+
+    return summary
+
+
+def get_fields(fields):
+    """Add the counts sub-documents to the fields of a summary query.
+
+    :param fields: The `fields` data structure of the query.
+    :type fields: list or dict
+    :return The `fields` data structure.
+    """
+    if isinstance(fields, types.ListType):
+        fields = fields + [
+            lines_key for key, lines_key in SUMMARY_KEYS if key in fields]
+    elif isinstance(fields, types.DictionaryType):
+        fields = dict(fields)
+        for key, lines_key in SUMMARY_KEYS:
+            if key in fields:
+                fields[lines_key] = fields[key]
+
+    return fields
@@ -18,12 +18,14 @@
 
 """Create the build email report."""
 
+import bson.son
 import pymongo
 import urllib
 import urlparse
 
 import models
 import utils.db
+import utils.logs.summary
 import utils.report.common as rcommon
 
 # Register normal Unicode gettext.
@@ -537,106 +539,112 @@ def _create_build_email(**kwargs):
     return txt_body, html_body, subject_str
 
 
-def create_build_report(
-        job,
-        branch, kernel, email_format, db_options, mail_options=None):
-    """Create the build report email to be sent.
+def _get_builds_data(database, spec):
+    """Get the build counts and the failed builds with one aggregation.
+
+    The builds are counted by architecture, which also gives the total count
+    and the unique architectures, and the failed builds are retrieved in the
+    same `$facet` stage.
+
+    :param database: The database connection.
+    :param spec: The query to match the builds.
+    :type spec: dict
+    :return A tuple with the total count, the unique data, the number of
+    failed builds and the failed builds.
+    """
+    pipeline = [
+        {"$match": spec},
+        {
+            "$facet": {
+                "arch": [
+                    {
+                        "$group": {
+                            "_id": "$" + models.ARCHITECTURE_KEY,
+                            "count": {"$sum": 1},
+                        }
+                    },
+                ],
+                "failed": [
+                    {"$match": {models.STATUS_KEY: models.FAIL_STATUS}},
+                    {"$sort": bson.son.SON(BUILD_SEARCH_SORT)},
+                    {"$project": {key: 1 for key in BUILD_SEARCH_FIELDS}},
+                ],
+            }
+        },
+    ]
+
+    facets = next(database[models.BUILD_COLLECTION].aggregate(pipeline), {})
+    arch_counts = facets.get("arch", [])
+    fail_results = facets.get("failed", [])
+
+    total_count = sum(arch["count"] for arch in arch_counts)
+    total_unique_data = {
+        models.ARCHITECTURE_KEY: sorted(arch["_id"] for arch in arch_counts),
+    }
 
+    return total_count, total_unique_data, len(fail_results), fail_results
+
+
+def load_build_report_data(database, job, branch, kernel, db_options=None):
+    """Load the data of a build report.
+
+    All the queries are run with the same database connection.
+
+    :param database: The database connection.
     :param job: The name of the job.
     :type job: str
-    :param  kernel: The name of the kernel.
+    :param branch: The name of the branch.
+    :type branch: str
+    :param kernel: The name of the kernel.
     :type kernel: str
-    :param email_format: The email format to send.
-    :type email_format: list
     :param db_options: The mongodb database connection parameters.
     :type db_options: dict
-    :param mail_options: The options necessary to connect to the SMTP server.
-    :type mail_options: dict
-    :return A tuple with the email body and subject as strings or None.
+    :return A dictionary with the data for `_create_build_email`.
     """
-    kwargs = {}
-    txt_body = None
-    html_body = None
-    subject = None
-    # This is used to provide a footer note in the email report.
-    info_email = None
-
-    fail_count = total_count = 0
-    errors_count = warnings_count = 0
-    fail_results = []
-
-    if mail_options:
-        info_email = mail_options.get("info_email", None)
-
     spec = {
         models.JOB_KEY: job,
         models.GIT_BRANCH_KEY: branch,
         models.KERNEL_KEY: kernel
     }
 
-    database = utils.db.get_db_connection(db_options)
-    total_results, total_count = utils.db.find_and_count(
-        database[models.BUILD_COLLECTION],
-        0,
-        0,
-        spec=spec,
-        fields=BUILD_SEARCH_FIELDS
-    )
-
-    total_unique_data = rcommon.get_unique_data(
-        total_results.clone(), unique_keys=[models.ARCHITECTURE_KEY])
-
-    spec[models.STATUS_KEY] = models.FAIL_STATUS
-
-    fail_results, fail_count = utils.db.find_and_count(
-        database[models.BUILD_COLLECTION],
-        0,
-        0,
-        spec=spec,
-        fields=BUILD_SEARCH_FIELDS,
-        sort=BUILD_SEARCH_SORT)
-
-    failed_data = _parse_build_data(fail_results.clone())
+    total_count, total_unique_data, fail_count, fail_results = \
+        _get_builds_data(database, spec)
+    failed_data = _parse_build_data(fail_results)
 
     # Retrieve the parsed errors/warnings/mismatches summary and then
     # the details.
-    errors_spec = {
-        models.JOB_KEY: job,
-        models.GIT_BRANCH_KEY: branch,
-        models.KERNEL_KEY: kernel,
-    }
-
     errors_summary = utils.db.find_one2(
         database[models.ERRORS_SUMMARY_COLLECTION],
-        errors_spec,
-        fields=[
+        spec,
+        fields=utils.logs.summary.get_fields([
             models.ERRORS_KEY, models.WARNINGS_KEY, models.MISMATCHES_KEY
-        ]
+        ])
     )
+    if errors_summary:
+        utils.logs.summary.to_lists(errors_summary)
 
-    error_details = utils.db.find(
+    error_details = list(utils.db.find(
         database[models.ERROR_LOGS_COLLECTION],
         0,
         0,
-        spec=errors_spec,
+        spec=spec,
         sort=[(models.DEFCONFIG_FULL_KEY, 1)]
-    )
-    error_details = list(d for d in error_details)
+    ))
     err_data, errors_count, warnings_count = _get_errors_count(error_details)
 
-    kwargs = {
-        "base_url": rcommon.DEFAULT_BASE_URL,
-        "build_url": rcommon.DEFAULT_BUILD_URL,
-        "email_format": email_format,
+    git_commit, git_url = rcommon.get_git_data(
+        job, branch, kernel, db_options, database=database)
+
+    return {
         "error_data": err_data,
         "error_details": error_details,
         "errors_count": errors_count,
         "errors_summary": errors_summary,
         "fail_count": fail_count,
         "failed_data": failed_data,
-        "info_email": info_email,
+        "git_commit": git_commit,
+        "git_url": git_url,
         "pass_count": total_count - fail_count,
-        "storage_url": rcommon.DEFAULT_STORAGE_URL,
         "total_count": total_count,
         "total_unique_data": total_unique_data,
         "warnings_count": warnings_count,
@@ -645,8 +653,43 @@ def create_build_report(
         models.KERNEL_KEY: kernel,
     }
 
-    kwargs["git_commit"], kwargs["git_url"] = \
-        rcommon.get_git_data(job, branch, kernel, db_options)
+
+def create_build_report(
+        job,
+        branch, kernel, email_format, db_options, mail_options=None):
+    """Create the build report email to be sent.
+
+    :param job: The name of the job.
+    :type job: str
+    :param  kernel: The name of the kernel.
+    :type kernel: str
+    :param email_format: The email format to send.
+    :type email_format: list
+    :param db_options: The mongodb database connection parameters.
+    :type db_options: dict
+    :param mail_options: The options necessary to connect to the SMTP server.
+    :type mail_options: dict
+    :return A tuple with the email body and subject as strings or None.
+    """
+    txt_body = None
+    html_body = None
+    subject = None
+    # This is used to provide a footer note in the email report.
+    info_email = None
+
+    if mail_options:
+        info_email = mail_options.get("info_email", None)
+
+    database = utils.db.get_db_connection(db_options)
+    kwargs = load_build_report_data(
+        database, job, branch, kernel, db_options=db_options)
+    kwargs.update({
+        "base_url": rcommon.DEFAULT_BASE_URL,
+        "build_url": rcommon.DEFAULT_BUILD_URL,
+        "email_format": email_format,
+        "info_email": info_email,
+        "storage_url": rcommon.DEFAULT_STORAGE_URL,
+    })
 
     custom_headers = {
         rcommon.X_REPORT: rcommon.BUILD_REPORT_TYPE,
@@ -655,7 +698,7 @@ def create_build_report(
         rcommon.X_KERNEL: kernel,
     }
 
-    if all([fail_count == 0, total_count == 0]):
+    if all([kwargs["fail_count"] == 0, kwargs["total_count"] == 0]):
         utils.LOG.warn(
             "Nothing found for '%s-%s-%s': no build email report sent",
             job, branch, kernel)
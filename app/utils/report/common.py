@@ -271,7 +271,7 @@ def parse_job_results(results):
     return parsed_data
 
 
-def get_git_data(job, branch, kernel, db_options):
+def get_git_data(job, branch, kernel, db_options, database=None):
     """Retrieve the git data from a job.
 
     :param job: The job name.
@@ -280,6 +280,8 @@ def get_git_data(job, branch, kernel, db_options):
     :type kernel: string
     :param db_options: The mongodb database connection parameters.
     :type db_options: dict
+    :param database: An already open database connection, used instead of
+    `db_options`.
     :return A 2-tuple: (git commit, git url).
     """
     spec = {
@@ -288,7 +290,8 @@ def get_git_data(job, branch, kernel, db_options):
         models.GIT_BRANCH_KEY: branch
     }
 
-    database = utils.db.get_db_connection(db_options)
+    if database is None:
+        database = utils.db.get_db_connection(db_options)
 
     git_results = utils.db.find(
         database[models.JOB_COLLECTION],
@@ -28,6 +28,7 @@ import pymongo
 import urllib
 import utils
 import utils.db
+import utils.kci_test.tree
 import utils.report.common as rcommon
 import yaml
 
@@ -85,10 +86,13 @@ def _regression_message(data):
 
 
 def _add_test_group_data(group, db, spec, hierarchy=[], regressions=None):
+    """Add the test results and regressions data to a test group.
+
+    The group needs to have been loaded with `utils.kci_test.tree.load_trees`
+    first.
+    """
     hierarchy = hierarchy + [group[models.NAME_KEY]]
-    case_collection = db[models.TEST_CASE_COLLECTION]
     regr_collection = db[models.TEST_REGRESSION_COLLECTION]
-    group_collection = db[models.TEST_GROUP_COLLECTION]
     regr_spec = dict(spec)
     regr_count = 0
 
@@ -96,8 +100,7 @@ def _add_test_group_data(group, db, spec, hierarchy=[], regressions=None):
         regressions = group.setdefault("regressions", list())
 
     test_cases = []
-    for test_case_id in group[models.TEST_CASES_KEY]:
-        test_case = utils.db.find_one2(case_collection, test_case_id)
+    for test_case in group[models.TEST_CASES_KEY]:
         measurements = test_case[models.MEASUREMENTS_KEY]
         for measurement in measurements:
             value = measurement['value']
@@ -123,11 +126,9 @@ def _add_test_group_data(group, db, spec, hierarchy=[], regressions=None):
 
     test_cases.sort(key=lambda tc: tc[models.INDEX_KEY])
 
-    sub_groups = []
-    for sub_group_id in group[models.SUB_GROUPS_KEY]:
-        sub_group = utils.db.find_one2(group_collection, sub_group_id)
+    sub_groups = group[models.SUB_GROUPS_KEY]
+    for sub_group in sub_groups:
         _add_test_group_data(sub_group, db, spec, hierarchy, regressions)
-        sub_groups.append(sub_group)
 
     results = {
         st: len(list(t for t in test_cases if t[models.STATUS_KEY] == st))
@@ -240,6 +241,8 @@ def create_test_report(db_options, data, email_format, email_template=None,
         utils.LOG.warning("Failed to find test group documents")
         return None
 
+    utils.kci_test.tree.load_trees(groups, database)
+
     for group in groups:
         group_spec = dict(spec)
         group_spec.update({
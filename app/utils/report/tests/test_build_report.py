@@ -17,8 +17,10 @@
 
 """Test class for the build email report functions."""
 
+import mongomock
 import unittest
 
+import models
 import utils.report.build as breport
 
 EXP_01 = u"a-job/a-branch build: 10 builds: 0 failed, 10 passed (a-kernel)"
@@ -113,3 +115,45 @@ class TestBuildReport(unittest.TestCase):
 
         self.assertIsNotNone(subject)
         self.assertEqual(EXP_07, subject)
+
+    def test_load_build_report_data(self):
+        database = mongomock.MongoClient()["kernel-ci"]
+        spec = {"job": "a-job", "git_branch": "a-branch", "kernel": "a-kernel"}
+        builds = [
+            ("arm", "multi_v7_defconfig", "PASS"),
+            ("arm", "omap2plus_defconfig", "FAIL"),
+            ("arm64", "defconfig", "PASS"),
+            ("x86_64", "x86_64_defconfig", "FAIL"),
+        ]
+        for arch, defconfig, status in builds:
+            build = {
+                models.ARCHITECTURE_KEY: arch,
+                models.DEFCONFIG_KEY: defconfig,
+                models.DEFCONFIG_FULL_KEY: defconfig,
+                models.BUILD_ENVIRONMENT_KEY: "gcc-8",
+                models.FILE_SERVER_RESOURCE_KEY: "path",
+                models.STATUS_KEY: status,
+            }
+            build.update(spec)
+            database[models.BUILD_COLLECTION].insert_one(build)
+        database[models.BUILD_COLLECTION].insert_one(
+            {"job": "a-job", "git_branch": "a-branch", "kernel": "other"})
+        job = {"git_commit": "1234", "git_url": "git://a-url"}
+        job.update(spec)
+        database[models.JOB_COLLECTION].insert_one(job)
+
+        data = breport.load_build_report_data(
+            database, "a-job", "a-branch", "a-kernel")
+
+        self.assertEqual(4, data["total_count"])
+        self.assertEqual(2, data["fail_count"])
+        self.assertEqual(2, data["pass_count"])
+        self.assertEqual(
+            ["arm", "arm64", "x86_64"], data["total_unique_data"]["arch"])
+        self.assertListEqual(["arm", "x86_64"], sorted(data["failed_data"]))
+        self.assertEqual(
+            "omap2plus_defconfig", data["failed_data"]["arm"][0]["defconfig"])
+        self.assertEqual("1234", data["git_commit"])
+        self.assertEqual("git://a-url", data["git_url"])
+        self.assertEqual(0, data["errors_count"])
+        self.assertIsNone(data["errors_summary"])
@@ -0,0 +1,116 @@
+#! /usr/bin/python
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Measure the LAVA log renderer throughput on a recorded LAVA log.
+
+The lines of a LAVA callback log are repeated up to the requested number of
+lines.  Run from the app/ directory:
+
+  PYTHONPATH=. python utils/scripts/bench-lava-log-parser.py --lines 100000
+
+The script exits with a non-zero status if the throughput is below the
+given minimum, in lines per second.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+import utils.lava_log_parser as lava_log_parser
+
+# A recorded LAVA callback, relative to the app/ directory.
+DEFAULT_CALLBACK = os.path.join(
+    "utils", "callback", "tests", "data", "lava-json-meson-gxbb-p200.json")
+
+YAML_LOADER = getattr(yaml, "CLoader", yaml.Loader)
+
+
+def load_log(path, lines):
+    """Load the log of a LAVA callback and repeat it up to some lines.
+
+    :param path: The path of the JSON callback data.
+    :type path: str
+    :param lines: The number of log lines.
+    :type lines: int
+    :return The list of log lines.
+    """
+    with open(path, "rb") as callback_file:
+        callback = json.load(callback_file)
+    log = yaml.load(callback["log"], Loader=YAML_LOADER)
+    return (log * (lines / len(log) + 1))[:lines]
+
+
+def main(args):
+    log = load_log(args.callback, args.lines)
+    meta = {"device_type": "meson-gxbb-p200", "boot_result": "PASS"}
+    renderer = lava_log_parser.LogRenderer(buffer_lines=args.buffer_lines)
+    out_dir = tempfile.mkdtemp()
+    txt_path = os.path.join(out_dir, "log.txt")
+    html_path = os.path.join(out_dir, "log.html")
+
+    try:
+        best = None
+        for _ in range(args.runs):
+            start = time.time()
+            renderer.write_files(
+                log, meta, txt_path, html_path, compress=args.compress)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        size = os.path.getsize(txt_path) + os.path.getsize(html_path)
+    finally:
+        shutil.rmtree(out_dir)
+
+    throughput = len(log) / best
+    print("Rendered {} lines in {:.3f}s: {:.0f} lines/s".format(
+        len(log), best, throughput))
+    print("output: {:.1f} MB".format(float(size) / (1024 * 1024)))
+
+    if args.min_throughput and throughput < args.min_throughput:
+        print("Throughput below the minimum of {} lines/s".format(
+            args.min_throughput))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="LAVA log renderer micro-benchmark")
+    parser.add_argument(
+        "--callback", default=DEFAULT_CALLBACK,
+        help="Path to the JSON data of a LAVA callback")
+    parser.add_argument(
+        "--lines", type=int, default=100000,
+        help="Number of log lines to render")
+    parser.add_argument(
+        "--buffer-lines", type=int, default=4096,
+        help="Number of lines written at a time")
+    parser.add_argument(
+        "--compress", action="store_true",
+        help="Also write gzip-compressed logs")
+    parser.add_argument(
+        "--runs", type=int, default=3,
+        help="Number of runs, the best one is reported")
+    parser.add_argument(
+        "--min-throughput", type=float,
+        help="Minimum throughput in lines/s, fail if lower")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+#! /usr/bin/python
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Measure the build log parser throughput on a synthetic build log.
+
+Run from the app/ directory:
+
+  PYTHONPATH=. python utils/scripts/bench-log-parser.py --min-throughput 20
+
+The script exits with a non-zero status if the throughput is below the
+given minimum, in MB/s.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import utils.log_parser as lparser
+
+MB = 1024 * 1024
+
+# Most of the lines of a build log are like these ones.
+NOISE_LINES = [
+    "  CC      drivers/gpu/drm/drm_file{}.o",
+    "  CC [M]  drivers/net/ethernet/intel/e1000e/netdev{}.o",
+    "  AS      arch/arm64/kernel/entry{}.o",
+    "  LD [M]  fs/btrfs/btrfs{}.ko",
+    "  AR      lib/built-in{}.a",
+    "  DTC     arch/arm64/boot/dts/board{}.dtb",
+]
+
+# Lines that are errors, warnings, mismatches or excluded warnings.
+MATCH_LINES = [
+    "../kernel/time/tick-internal.h:114:5: error: dereferencing pointer {}",
+    "ERROR: \"__udivdi3\" [drivers/foo{}.ko] undefined!",
+    "drivers/bar{}.o: undefined reference to `qcom_smem_get'",
+    "/bin/sh: 1: dtc{}: command not found",
+    "../sound/soc/soc-dapm.c:3940:2: warning: 'w{}' may be used",
+    "arch/arm64/boot/dts/board{}.dtb: Warning (reg_format): bad reg",
+    "WARNING: modpost: Found {} section mismatch(es).",
+    "WARNING: vmlinux.o(.text+0x{}): Section mismatch in reference",
+    "entry-armv.S:363:2: warning: #warning \"NPTL on non MMU needs fixing\"",
+]
+
+
+def create_log(path, size, match_ratio):
+    """Write a synthetic build log file.
+
+    :param path: The path of the file to write.
+    :type path: str
+    :param size: The size of the file, in bytes.
+    :type size: int
+    :param match_ratio: The ratio of lines that are not just noise.
+    :type match_ratio: float
+    """
+    rand = random.Random(0)
+    written = 0
+    with open(path, "wb") as log_file:
+        while written < size:
+            if rand.random() < match_ratio:
+                line = rand.choice(MATCH_LINES)
+            else:
+                line = rand.choice(NOISE_LINES)
+            line = line.format(rand.randint(0, 9999)) + "\n"
+            log_file.write(line)
+            written += len(line)
+
+
+def main(args):
+    log_path = tempfile.mktemp(suffix=".log")
+    try:
+        create_log(log_path, args.size * MB, args.match_ratio)
+        size = os.path.getsize(log_path)
+        classifier = lparser.BuildLogClassifier(
+            chunk_size=args.chunk_size * 1024)
+
+        best = None
+        for _ in range(args.runs):
+            start = time.time()
+            errors, warnings, mismatches = classifier.parse_file(log_path)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if os.path.exists(log_path):
+            os.unlink(log_path)
+
+    size_mb = float(size) / MB
+    throughput = size_mb / best
+    print("Parsed {:.1f} MB in {:.3f}s: {:.1f} MB/s".format(
+        size_mb, best, throughput))
+    print("errors: {}, warnings: {}, mismatches: {}".format(
+        len(errors), len(warnings), len(mismatches)))
+
+    if args.min_throughput and throughput < args.min_throughput:
+        print("Throughput below the minimum of {} MB/s".format(
+            args.min_throughput))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build log parser micro-benchmark")
+    parser.add_argument(
+        "--size", type=int, default=50,
+        help="Size of the synthetic build log, in MB")
+    parser.add_argument(
+        "--match-ratio", type=float, default=0.01,
+        help="Ratio of error, warning and mismatch lines")
+    parser.add_argument(
+        "--chunk-size", type=int, default=lparser.READ_CHUNK_SIZE / 1024,
+        help="Size of the chunks read from the log, in KB")
+    parser.add_argument(
+        "--runs", type=int, default=3,
+        help="Number of runs, the best one is reported")
+    parser.add_argument(
+        "--min-throughput", type=float,
+        help="Minimum throughput in MB/s, fail if lower")
+    sys.exit(main(parser.parse_args()))
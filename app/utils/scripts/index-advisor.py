@@ -0,0 +1,108 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Report the missing and unused indexes from the recorded query shapes.
+
+The query shapes are recorded by the server when the
+`query_shapes_sample_rate` option is not 0.  Run from the app/ directory:
+
+  PYTHONPATH=. python utils/scripts/index-advisor.py --redis-host localhost
+
+The missing indexes are printed as they would be added to
+`handlers.dbindexes.INDEX_SPECS`.
+"""
+
+import argparse
+import json
+import sys
+
+import handlers.common.query_shapes as query_shapes
+import utils.database.redisdb as redisdb
+
+
+def _format_index(index):
+    return "[{}]".format(", ".join(
+        "({}, {})".format(key, order) for key, order in index))
+
+
+def print_report(report, max_shapes):
+    """Print the report in a readable format.
+
+    :param report: The report created by `query_shapes.get_report`.
+    :type report: dict
+    :param max_shapes: The number of most frequent shapes to print.
+    :type max_shapes: int
+    """
+    for collection_name, values in sorted(report.iteritems()):
+        print "{}:".format(collection_name)
+
+        print "  most frequent shapes:"
+        for shape in values["shapes"][:max_shapes]:
+            print "    {:>8} queries, {:>4} explained, {:>4} collscan, " \
+                "{:>4} in-memory sort: match={} sort={}".format(
+                    shape[query_shapes.QUERIES],
+                    shape[query_shapes.SAMPLED],
+                    shape[query_shapes.COLLSCAN],
+                    shape[query_shapes.SORT],
+                    json.dumps(shape["match"]), json.dumps(shape["sort"]))
+
+        print "  missing indexes:"
+        for index in values["missing"]:
+            print "    " + _format_index(index)
+
+        print "  unused indexes:"
+        for index in values["unused"]:
+            print "    " + _format_index(index)
+
+
+def main(args):
+    redis_conn = redisdb.get_db_connection({
+        "redis_host": args.redis_host,
+        "redis_port": args.redis_port,
+        "redis_db": args.redis_db,
+        "redis_password": args.redis_password,
+    })
+    report = query_shapes.get_report(redis_conn)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        print_report(report, args.max_shapes)
+
+    if args.reset:
+        recorder = query_shapes.QueryShapeRecorder(redis_conn)
+        for collection_name in report:
+            recorder.reset(collection_name)
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-db", type=int, default=0)
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument(
+        "--max-shapes", type=int, default=10,
+        help="The number of most frequent shapes to print per collection")
+    parser.add_argument(
+        "--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "--reset", action="store_true",
+        help="Drop the recorded shapes after printing the report")
+    sys.exit(main(parser.parse_args()))
@@ -26,69 +26,256 @@ import models
 import models.stats as mstats
 import utils
 import utils.db
+import utils.stats.hll
 
 
 # These are used to create the document attributes as in the model.
 OLD_PREFIXES = ["daily", "weekly", "biweekly"]
 
+# The fields whose unique values are counted, for each collection.
+UNIQUE_FIELDS = {
+    models.JOB_COLLECTION: [models.JOB_KEY, models.KERNEL_KEY],
+    models.BUILD_COLLECTION: [models.DEFCONFIG_KEY],
+}
 
-def calculate_job_stats(database, date_range):
+# Keys of the per-day partial statistics documents.
+DAY_KEY = "day"
+SKETCHES_KEY = "sketches"
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def _midnight(date):
+    """Get the start of the day of a date."""
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class DayStats(object):
+    """Partial statistics of the documents created in a day.
+
+    They are made of the number of documents and a HyperLogLog sketch of
+    the values of each field in `UNIQUE_FIELDS`, so that the statistics of
+    several days can be merged.
+    """
+
+    def __init__(self, fields, count=0, sketches=None):
+        self.count = count
+        self.sketches = dict(
+            (field, utils.stats.hll.HyperLogLog(
+                registers=(sketches or {}).get(field)))
+            for field in fields)
+
+    def add(self, doc):
+        """Add a document to the statistics."""
+        self.count += 1
+        for field, sketch in self.sketches.iteritems():
+            value = doc.get(field)
+            if value is not None:
+                sketch.add(value)
+
+    def merge(self, other):
+        """Add the statistics of another day."""
+        self.count += other.count
+        for field, sketch in self.sketches.iteritems():
+            sketch.merge(other.sketches[field])
+
+    def unique(self, field):
+        """Estimate the number of unique values of a field."""
+        return self.sketches[field].count()
+
+    def to_dict(self, collection_name, day):
+        """Create the document to store the statistics of a day."""
+        return {
+            models.ID_KEY: "{:s}:{:s}".format(collection_name, day),
+            models.COLLECTION_KEY: collection_name,
+            DAY_KEY: day,
+            models.COUNT_KEY: self.count,
+            SKETCHES_KEY: dict(
+                (field, sketch.to_binary())
+                for field, sketch in self.sketches.iteritems()),
+        }
+
+
+def calculate_days_stats(database, collection_name, start, end):
+    """Calculate the statistics of each day in a date range.
+
+    The documents of the range are read with a single query.
+
+    :param database: The database connection.
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :param start: The start of the range, or None to start with the first
+    document.
+    :type start: datetime
+    :param end: The end of the range, excluded.
+    :type end: datetime
+    :return A dictionary with the days as keys and the `DayStats` objects
+    as values.
+    """
+    fields = UNIQUE_FIELDS[collection_name]
+    created_on = {"$lt": end}
+    if start is not None:
+        created_on["$gte"] = start
+
+    days = {}
+    for doc in database[collection_name].find(
+            {models.CREATED_KEY: created_on},
+            [models.CREATED_KEY] + fields):
+        day = doc[models.CREATED_KEY].strftime(DAY_FORMAT)
+        day_stats = days.get(day)
+        if day_stats is None:
+            day_stats = days[day] = DayStats(fields)
+        day_stats.add(doc)
+
+    return days
+
+
+def update_days_stats(database, collection_name, today):
+    """Get the statistics of each day before today.
+
+    The statistics of the days that have not been stored yet are calculated
+    and stored.  A document created after the statistics of its day have been
+    stored is not counted.
+
+    :param database: The database connection.
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :param today: The start of the current day.
+    :type today: datetime
+    :return A dictionary with the days as keys and the `DayStats` objects
+    as values.
+    """
+    fields = UNIQUE_FIELDS[collection_name]
+    partial_collection = database[models.DAILY_STATS_PARTIAL_COLLECTION]
+
+    days = dict(
+        (doc[DAY_KEY], DayStats(
+            fields, doc[models.COUNT_KEY], doc[SKETCHES_KEY]))
+        for doc in partial_collection.find(
+            {models.COLLECTION_KEY: collection_name}))
+
+    start = None
+    if days:
+        last_day = datetime.datetime.strptime(max(days), DAY_FORMAT)
+        start = last_day.replace(tzinfo=today.tzinfo) + \
+            datetime.timedelta(days=1)
+
+    new_days = calculate_days_stats(database, collection_name, start, today)
+    if new_days:
+        utils.LOG.info(
+            "Storing %s statistics of %d days", collection_name, len(new_days))
+        partial_collection.bulk_write([
+            pymongo.ReplaceOne(
+                {models.ID_KEY: doc[models.ID_KEY]}, doc, upsert=True)
+            for doc in (
+                day_stats.to_dict(collection_name, day)
+                for day, day_stats in new_days.iteritems())
+        ])
+        days.update(new_days)
+
+    return days
+
+
+def calculate_collection_stats(database, collection_name, now, date_range):
+    """Calculate the statistics of a collection from the days statistics.
+
+    :param database: The database connection.
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :param now: The current date.
+    :type now: datetime
+    :param date_range: The list of dates to calculate statistics for.
+    :type date_range: list
+    :return A 2-tuple: the `DayStats` object of all the documents and a
+    list with the `DayStats` objects of the documents created before each
+    date of the range.
+    """
+    fields = UNIQUE_FIELDS[collection_name]
+    today = _midnight(now)
+    days = update_days_stats(database, collection_name, today)
+
+    def until(date):
+        # The days are merged in order: add the part of the day of the date
+        # created before it to the days already merged.
+        day_stats = DayStats(fields)
+        day_stats.merge(merged)
+        for partial in calculate_days_stats(
+                database, collection_name, _midnight(date), date).values():
+            day_stats.merge(partial)
+        return day_stats
+
+    merged = DayStats(fields)
+    cutoffs = sorted(date_range)
+    before = {}
+
+    for day in sorted(days):
+        while cutoffs and day >= cutoffs[0].strftime(DAY_FORMAT):
+            date = cutoffs.pop(0)
+            before[date] = until(date)
+        merged.merge(days[day])
+
+    for date in cutoffs:
+        before[date] = until(date)
+
+    for partial in calculate_days_stats(
+            database, collection_name, today, now).values():
+        merged.merge(partial)
+
+    return merged, [before[date] for date in date_range]
+
+
+def calculate_job_stats(database, date_range, now):
     """Calculate statistics for the job collection.
 
     :param database: The database connection.
     :param date_range: The list of date ranges to calculate statistics for.
     :param date_range: list
+    :param now: The current date.
+    :type now: datetime
     :return A dictionary containing the job statistics.
     """
     utils.LOG.info("Calculating job statistics")
-    job_collection = database[models.JOB_COLLECTION]
+    total, before = calculate_collection_stats(
+        database, models.JOB_COLLECTION, now, date_range)
 
     job_stats = {
-        "total_jobs": job_collection.count(),
-        "total_unique_trees": len(job_collection.distinct(models.JOB_KEY)),
-        "total_unique_kernels": len(job_collection.distinct(models.KERNEL_KEY))
+        "total_jobs": total.count,
+        "total_unique_trees": total.unique(models.JOB_KEY),
+        "total_unique_kernels": total.unique(models.KERNEL_KEY)
     }
 
-    for idx, date in enumerate(date_range):
-        prefix = OLD_PREFIXES[idx]
-
-        job_data = job_collection.find({models.CREATED_KEY: {"$lt": date}})
-
-        job_stats[prefix + "_total_jobs"] = job_data.count()
-        job_stats[prefix + "_unique_trees"] = \
-            len(job_data.distinct(models.JOB_KEY))
+    for prefix, job_data in zip(OLD_PREFIXES, before):
+        job_stats[prefix + "_total_jobs"] = job_data.count
+        job_stats[prefix + "_unique_trees"] = job_data.unique(models.JOB_KEY)
         job_stats[prefix + "_unique_kernels"] = \
-            len(job_data.distinct(models.KERNEL_KEY))
+            job_data.unique(models.KERNEL_KEY)
 
     return job_stats
 
 
-def calculate_build_stats(database, date_range):
+def calculate_build_stats(database, date_range, now):
     """Calculate statistics for the build collection.
 
     :param database: The database connection.
     :param date_range: The list of date ranges to calculate statistics for.
     :param date_range: list
+    :param now: The current date.
+    :type now: datetime
     :return A dictionary containing the build statistics.
     """
     utils.LOG.info("Calculating build statistics")
-    build_collection = database[models.BUILD_COLLECTION]
+    total, before = calculate_collection_stats(
+        database, models.BUILD_COLLECTION, now, date_range)
 
     build_stats = {
-        "total_builds": build_collection.count(),
-        "total_unique_defconfigs": len(
-            build_collection.distinct(models.DEFCONFIG_KEY))
+        "total_builds": total.count,
+        "total_unique_defconfigs": total.unique(models.DEFCONFIG_KEY)
     }
 
-    for idx, date in enumerate(date_range):
-        prefix = OLD_PREFIXES[idx]
-
-        build_data = build_collection.find(
-            {models.CREATED_KEY: {"$lt": date}})
-
-        build_stats[prefix + "_total_builds"] = build_data.count()
+    for prefix, build_data in zip(OLD_PREFIXES, before):
+        build_stats[prefix + "_total_builds"] = build_data.count
         build_stats[prefix + "_unique_defconfigs"] = \
-            len(build_data.distinct(models.DEFCONFIG_KEY))
+            build_data.unique(models.DEFCONFIG_KEY)
 
     return build_stats
 
@@ -151,8 +338,8 @@ def calculate_daily_stats(db_options):
     date_range = [yesterday, one_week, two_weeks]
 
     start_date = get_start_date(database)
-    job_stats = calculate_job_stats(database, date_range)
-    build_stats = calculate_build_stats(database, date_range)
+    job_stats = calculate_job_stats(database, date_range, today)
+    build_stats = calculate_build_stats(database, date_range, today)
 
     daily_stats = mstats.DailyStats()
     daily_stats.start_date = start_date
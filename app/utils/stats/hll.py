@@ -0,0 +1,113 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""HyperLogLog cardinality sketch.
+
+A sketch estimates the number of unique values added to it with a fixed
+amount of memory, 2^precision bytes, and a standard error of about
+1.04 / sqrt(2^precision): 1.6% with the default precision.  Sketches of
+different sets can be merged to estimate the number of unique values of
+their union.  Small cardinalities are counted almost exactly.
+"""
+
+import bson.binary
+import hashlib
+import math
+import types
+
+DEFAULT_PRECISION = 12
+
+# Number of bits of the hash values.
+HASH_BITS = 64
+
+
+class HyperLogLog(object):
+    """A HyperLogLog sketch of a set of values."""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        """Create a sketch.
+
+        :param precision: The number of bits used to select a register.
+        :type precision: int
+        :param registers: The registers of a serialized sketch.
+        :type registers: str
+        """
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.size)
+        else:
+            self.registers = bytearray(registers)
+            if len(self.registers) != self.size:
+                raise ValueError(
+                    "Expected {} registers, got {}".format(
+                        self.size, len(self.registers)))
+
+    def add(self, value):
+        """Add a value to the set.
+
+        :param value: The value, converted to a string.
+        """
+        if isinstance(value, types.UnicodeType):
+            value = value.encode("utf-8")
+        else:
+            value = str(value)
+
+        digest = int(hashlib.sha1(value).hexdigest()[:HASH_BITS / 4], 16)
+        rest_bits = HASH_BITS - self.precision
+        index = digest >> rest_bits
+        rest = digest & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add all the values of another sketch to this one.
+
+        :param other: The sketch to merge, with the same precision.
+        :type other: HyperLogLog
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+
+        self.registers = bytearray(
+            map(max, self.registers, other.registers))
+
+    def count(self):
+        """Estimate the number of unique values.
+
+        :return The estimated cardinality.
+        :rtype int
+        """
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = \
+            alpha * size * size / sum(2.0 ** -reg for reg in self.registers)
+
+        zeros = self.registers.count(b"\x00")
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = size * math.log(float(size) / zeros)
+
+        return int(round(estimate))
+
+    def to_binary(self):
+        """Serialize the sketch to store it in the database.
+
+        :return The registers as a BSON binary value.
+        """
+        return bson.binary.Binary(bytes(self.registers))
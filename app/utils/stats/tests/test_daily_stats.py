@@ -15,12 +15,14 @@
 # along with this library; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import bson
 import datetime
 import logging
 import mock
 import mongomock
 import unittest
 
+import models
 import utils.stats.daily
 
 
@@ -218,3 +220,70 @@ class TestDailyStats(unittest.TestCase):
 
         daily_stats = utils.stats.daily.calculate_daily_stats({})
         self.assertDictEqual(expected, daily_stats.to_dict())
+
+
+class TestIncrementalStats(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.db = mongomock.MongoClient()["kernel-ci"]
+        self.now = datetime.datetime(
+            2015, 8, 10, hour=12, minute=1, tzinfo=bson.tz_util.utc)
+        self.date_range = [
+            self.now - datetime.timedelta(days=days) for days in [1, 7, 14]]
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def _add_jobs(self, hours_ago, job, kernel):
+        self.db[models.JOB_COLLECTION].insert_one({
+            models.CREATED_KEY: self.now - datetime.timedelta(hours=hours_ago),
+            models.JOB_KEY: job,
+            models.KERNEL_KEY: kernel,
+        })
+
+    def test_calculate_job_stats(self):
+        self._add_jobs(1, "mainline", "v4.2-rc6")
+        self._add_jobs(20, "mainline", "v4.2-rc5")
+        self._add_jobs(30, "next", "next-20150808")
+        self._add_jobs(24 * 10, "next", "next-20150731")
+        self._add_jobs(24 * 20, "stable", "v4.1.4")
+
+        expected = {
+            "total_jobs": 5,
+            "total_unique_trees": 3,
+            "total_unique_kernels": 5,
+            "daily_total_jobs": 3,
+            "daily_unique_trees": 2,
+            "daily_unique_kernels": 3,
+            "weekly_total_jobs": 2,
+            "weekly_unique_trees": 2,
+            "weekly_unique_kernels": 2,
+            "biweekly_total_jobs": 1,
+            "biweekly_unique_trees": 1,
+            "biweekly_unique_kernels": 1,
+        }
+
+        job_stats = utils.stats.daily.calculate_job_stats(
+            self.db, self.date_range, self.now)
+        self.assertDictEqual(expected, job_stats)
+        self.assertEqual(
+            3,
+            self.db[models.DAILY_STATS_PARTIAL_COLLECTION].count_documents(
+                {models.COLLECTION_KEY: models.JOB_COLLECTION}))
+
+        # The stored days are not read again.
+        self.db[models.JOB_COLLECTION].delete_many(
+            {models.JOB_KEY: "stable"})
+        self._add_jobs(2, "stable", "v4.1.5")
+        expected["total_jobs"] = 6
+        expected["total_unique_kernels"] = 6
+        job_stats = utils.stats.daily.calculate_job_stats(
+            self.db, self.date_range, self.now)
+        self.assertDictEqual(expected, job_stats)
+
+    def test_calculate_build_stats_empty(self):
+        build_stats = utils.stats.daily.calculate_build_stats(
+            self.db, self.date_range, self.now)
+        self.assertEqual(0, build_stats["total_builds"])
+        self.assertEqual(0, build_stats["biweekly_unique_defconfigs"])
@@ -0,0 +1,59 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+
+import utils.stats.hll as hll
+
+
+class TestHyperLogLog(unittest.TestCase):
+
+    def test_count_small(self):
+        sketch = hll.HyperLogLog()
+        self.assertEqual(0, sketch.count())
+
+        for value in ["mainline", u"next", "mainline", 42, "42"]:
+            sketch.add(value)
+        self.assertEqual(3, sketch.count())
+
+    def test_count_large(self):
+        sketch = hll.HyperLogLog()
+        for value in xrange(100000):
+            sketch.add("kernel-{}".format(value))
+
+        self.assertAlmostEqual(100000, sketch.count(), delta=5000)
+
+    def test_merge(self):
+        sketch0 = hll.HyperLogLog()
+        sketch1 = hll.HyperLogLog()
+        for value in xrange(2000):
+            sketch0.add(value)
+            sketch1.add(value + 1000)
+
+        sketch0.merge(sketch1)
+        self.assertAlmostEqual(3000, sketch0.count(), delta=100)
+
+        self.assertRaises(ValueError, sketch0.merge, hll.HyperLogLog(10))
+
+    def test_to_binary(self):
+        sketch = hll.HyperLogLog()
+        sketch.add("mainline")
+
+        copy = hll.HyperLogLog(registers=sketch.to_binary())
+        self.assertEqual(sketch.registers, copy.registers)
+        self.assertEqual(1, copy.count())
+
+        self.assertRaises(ValueError, hll.HyperLogLog, registers="abc")
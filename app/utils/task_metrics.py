@@ -0,0 +1,462 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Record the latency of the Celery tasks, by task and by chain.
+
+The time a task waited in the queue, the time it ran, and the number and
+duration of its MongoDB commands are added to counters in a Redis hash
+shared by all the worker processes.  The web server exports them in the
+Prometheus text format.
+
+The name of a chain is made of the names of its tasks.  It is passed from
+one task of the chain to the next in the message headers, along with the
+time each task was published.
+
+The metrics of the kcidb buffer of each worker process are stored in
+another Redis hash, and exported with the process as a label.
+"""
+
+import json
+import redis
+import threading
+import time
+
+import utils
+import utils.db
+
+# The Redis hash with the counters.
+TASK_METRICS_KEY = "kernelci-task-metrics"
+# The Redis hash with the kcidb buffer metrics of each worker process.
+KCIDB_METRICS_KEY = "kernelci-kcidb-metrics"
+# How often the kcidb buffer metrics of a process are stored, in seconds.
+KCIDB_METRICS_INTERVAL = 10
+
+# The message headers set when a task is published.
+PUBLISHED_HEADER = "kci_published"
+CHAIN_HEADER = "kci_chain"
+
+CHAIN_SEPARATOR = ">"
+
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+QUEUE_WAIT = "kernelci_task_queue_wait_seconds"
+RUN_TIME = "kernelci_task_run_seconds"
+DB_TIME = "kernelci_task_db_seconds_total"
+DB_CALLS = "kernelci_task_db_calls_total"
+TASKS = "kernelci_tasks_total"
+
+# The exported metrics, as (name, type, help) tuples.
+METRICS = [
+    (
+        TASKS, "counter",
+        "Number of tasks run, by final state"
+    ),
+    (
+        QUEUE_WAIT, "histogram",
+        "Time between the publication of a task and its start"
+    ),
+    (
+        RUN_TIME, "histogram",
+        "Time taken to run a task"
+    ),
+    (
+        DB_TIME, "counter",
+        "Time spent by the tasks in MongoDB commands"
+    ),
+    (
+        DB_CALLS, "counter",
+        "Number of MongoDB commands run by the tasks"
+    ),
+]
+
+# The exported kcidb buffer metrics, as (name, type, help, key) tuples.
+KCIDB_METRICS = [
+    (
+        "kernelci_kcidb_queue_depth", "gauge",
+        "Number of objects waiting in the kcidb buffer", "queue_depth"
+    ),
+    (
+        "kernelci_kcidb_queue_bytes", "gauge",
+        "Size of the objects waiting in the kcidb buffer", "queue_bytes"
+    ),
+    (
+        "kernelci_kcidb_queue_latency_max_seconds", "gauge",
+        "Longest time an object waited in the kcidb buffer",
+        "queue_latency_max"
+    ),
+    (
+        "kernelci_kcidb_batches_total", "counter",
+        "Number of batches submitted to kcidb", "batches"
+    ),
+    (
+        "kernelci_kcidb_objects_total", "counter",
+        "Number of objects submitted to kcidb", "objects"
+    ),
+    (
+        "kernelci_kcidb_errors_total", "counter",
+        "Number of batches that could not be submitted to kcidb", "errors"
+    ),
+    (
+        "kernelci_kcidb_blocked_total", "counter",
+        "Number of times adding an object to the kcidb buffer had to wait",
+        "blocked"
+    ),
+    (
+        "kernelci_kcidb_restarts_total", "counter",
+        "Number of times kcidb-submit was restarted", "restarts"
+    ),
+    (
+        "kernelci_kcidb_submit_latency_avg_seconds", "gauge",
+        "Average time taken to write a batch to kcidb-submit",
+        "submit_latency_avg"
+    ),
+    (
+        "kernelci_kcidb_submit_latency_max_seconds", "gauge",
+        "Longest time taken to write a batch to kcidb-submit",
+        "submit_latency_max"
+    ),
+]
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def get_chain_name(body):
+    """Get the name of the chain starting with a task.
+
+    :param body: The body of the task message.
+    :type body: dict
+    :return The names of the task and of its callbacks, first callback only.
+    """
+    names = [body["task"]]
+    callbacks = body.get("callbacks")
+    while callbacks:
+        callback = callbacks[0]
+        names.append(callback["task"])
+        callbacks = (callback.get("options") or {}).get("link")
+    return CHAIN_SEPARATOR.join(names)
+
+
+def set_publish_headers(body, headers, parent_headers=None):
+    """Set the metrics headers of a task message being published.
+
+    :param body: The body of the task message.
+    :type body: dict
+    :param headers: The headers of the task message, updated in place.
+    :type headers: dict
+    :param parent_headers: The headers of the task publishing this one, if
+    any.  Its chain is inherited.
+    :type parent_headers: dict
+    """
+    headers[PUBLISHED_HEADER] = time.time()
+    chain = (parent_headers or {}).get(CHAIN_HEADER)
+    headers[CHAIN_HEADER] = chain or get_chain_name(body)
+
+
+def _get_field(metric, task_name, chain, extra=""):
+    return json.dumps([metric, task_name, chain, extra], separators=(",", ":"))
+
+
+def _get_bucket(value):
+    """Get the index of the histogram bucket of a value."""
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return index
+    return len(BUCKETS)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace(
+        "\n", "\\n")
+
+
+def _format_labels(*labels):
+    return ",".join(
+        "{}=\"{}\"".format(name, _escape_label(value))
+        for name, value in labels)
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def get_prometheus_text(redis_conn):
+    """Export the recorded metrics.
+
+    :param redis_conn: The Redis connection.
+    :return The metrics in the Prometheus text format.
+    """
+    values = {}
+    for field, value in redis_conn.hgetall(TASK_METRICS_KEY).iteritems():
+        metric, task_name, chain, extra = json.loads(field)
+        values.setdefault(metric, {}).setdefault(
+            (task_name, chain), {})[extra] = float(value)
+
+    lines = []
+    for metric, metric_type, metric_help in METRICS:
+        series = values.get(metric)
+        if not series:
+            continue
+
+        lines.append("# HELP {} {}".format(metric, metric_help))
+        lines.append("# TYPE {} {}".format(metric, metric_type))
+        for (task_name, chain), extras in sorted(series.iteritems()):
+            if metric_type == "histogram":
+                count = 0
+                for index, bound in enumerate(BUCKETS + ("+Inf",)):
+                    count += extras.get(str(index), 0)
+                    lines.append("{}_bucket{{{}}} {}".format(
+                        metric,
+                        _format_labels(
+                            ("task", task_name), ("chain", chain),
+                            ("le", str(bound))),
+                        _format_value(count)))
+                labels = _format_labels(
+                    ("task", task_name), ("chain", chain))
+                lines.append("{}_sum{{{}}} {}".format(
+                    metric, labels, _format_value(extras.get("sum", 0))))
+                lines.append("{}_count{{{}}} {}".format(
+                    metric, labels, _format_value(extras.get("count", 0))))
+            elif metric == TASKS:
+                for state, value in sorted(extras.iteritems()):
+                    lines.append("{}{{{}}} {}".format(
+                        metric,
+                        _format_labels(
+                            ("task", task_name), ("chain", chain),
+                            ("state", state)),
+                        _format_value(value)))
+            else:
+                lines.append("{}{{{}}} {}".format(
+                    metric,
+                    _format_labels(("task", task_name), ("chain", chain)),
+                    _format_value(extras.get("", 0))))
+
+    lines.extend(_get_kcidb_lines(redis_conn))
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _get_kcidb_lines(redis_conn):
+    """Export the kcidb buffer metrics of the worker processes.
+
+    :param redis_conn: The Redis connection.
+    :return A list with the lines of the metrics.
+    """
+    workers = sorted(
+        (worker, json.loads(value))
+        for worker, value in redis_conn.hgetall(KCIDB_METRICS_KEY).iteritems())
+
+    lines = []
+    for metric, metric_type, metric_help, key in KCIDB_METRICS:
+        series = [
+            (worker, values[key]) for worker, values in workers
+            if key in values]
+        if not series:
+            continue
+
+        lines.append("# HELP {} {}".format(metric, metric_help))
+        lines.append("# TYPE {} {}".format(metric, metric_type))
+        for worker, value in series:
+            lines.append("{}{{{}}} {}".format(
+                metric, _format_labels(("worker", worker)),
+                _format_value(value)))
+
+    return lines
+
+
+class TaskMetrics(object):
+    """Measure the tasks run by a worker process.
+
+    `task_started` and `task_finished` are called from the thread running
+    the task, before and after it runs.
+
+    :param redis_conn: The Redis connection.
+    :param slow_threshold: The run time above which a task is logged as
+    slow, in seconds, or 0 not to log them.
+    :type slow_threshold: float
+    """
+
+    def __init__(self, redis_conn, slow_threshold=0):
+        self.slow_threshold = slow_threshold
+        self._redis = redis_conn
+        self._running = {}
+
+    def task_started(self, task_id, headers):
+        """Start measuring a task.
+
+        :param task_id: The ID of the task.
+        :type task_id: str
+        :param headers: The headers of the task message.
+        :type headers: dict
+        """
+        now = time.time()
+        headers = headers or {}
+        published = headers.get(PUBLISHED_HEADER)
+        queue_wait = max(0, now - published) if published else None
+        self._running[task_id] = (now, queue_wait, headers.get(CHAIN_HEADER))
+        utils.db.reset_command_metrics()
+
+    def task_finished(self, task_id, task_name, state):
+        """Record the metrics of a task.
+
+        :param task_id: The ID of the task.
+        :type task_id: str
+        :param task_name: The name of the task.
+        :type task_name: str
+        :param state: The final state of the task.
+        :type state: str
+        """
+        started = self._running.pop(task_id, None)
+        if started is None:
+            return
+
+        start, queue_wait, chain = started
+        run_time = time.time() - start
+        chain = chain or task_name
+        db_metrics = utils.db.get_command_metrics()
+
+        if self.slow_threshold and run_time >= self.slow_threshold:
+            utils.LOG.warn(
+                "Slow task %s (%s) in chain %s: %.3fs in the queue, "
+                "%.3fs running, %.3fs in %d database calls",
+                task_name, task_id, chain,
+                queue_wait or 0, run_time,
+                db_metrics["time"], db_metrics["calls"])
+
+        self.record(
+            task_name, chain, state or "UNKNOWN", queue_wait, run_time,
+            db_metrics["time"], db_metrics["calls"])
+
+    def record(self, task_name, chain, state, queue_wait, run_time,
+               db_time, db_calls):
+        """Add the metrics of a task to the counters.
+
+        :param task_name: The name of the task.
+        :type task_name: str
+        :param chain: The name of the chain of the task.
+        :type chain: str
+        :param state: The final state of the task.
+        :type state: str
+        :param queue_wait: The time the task waited in the queue, or None if
+        unknown.
+        :type queue_wait: float
+        :param run_time: The time taken to run the task.
+        :type run_time: float
+        :param db_time: The time spent in MongoDB commands.
+        :type db_time: float
+        :param db_calls: The number of MongoDB commands.
+        :type db_calls: int
+        """
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hincrby(
+                TASK_METRICS_KEY,
+                _get_field(TASKS, task_name, chain, state), 1)
+
+            for metric, value in [(QUEUE_WAIT, queue_wait),
+                                  (RUN_TIME, run_time)]:
+                if value is None:
+                    continue
+                bucket = str(_get_bucket(value))
+                pipe.hincrby(
+                    TASK_METRICS_KEY,
+                    _get_field(metric, task_name, chain, bucket), 1)
+                pipe.hincrbyfloat(
+                    TASK_METRICS_KEY,
+                    _get_field(metric, task_name, chain, "sum"), value)
+                pipe.hincrby(
+                    TASK_METRICS_KEY,
+                    _get_field(metric, task_name, chain, "count"), 1)
+
+            pipe.hincrbyfloat(
+                TASK_METRICS_KEY,
+                _get_field(DB_TIME, task_name, chain), db_time)
+            pipe.hincrby(
+                TASK_METRICS_KEY,
+                _get_field(DB_CALLS, task_name, chain), db_calls)
+            pipe.execute()
+        except redis.exceptions.RedisError, ex:
+            utils.LOG.error("Error recording the metrics of %s", task_name)
+            utils.LOG.exception(ex)
+
+    def record_kcidb(self, worker, metrics):
+        """Store the kcidb buffer metrics of a worker process.
+
+        :param worker: The name of the worker process.
+        :type worker: str
+        :param metrics: The metrics of the buffer, or None to remove them
+        when the process stops.
+        :type metrics: dict
+        """
+        try:
+            if metrics is None:
+                self._redis.hdel(KCIDB_METRICS_KEY, worker)
+            else:
+                self._redis.hset(
+                    KCIDB_METRICS_KEY, worker,
+                    json.dumps(metrics, separators=(",", ":")))
+        except redis.exceptions.RedisError, ex:
+            utils.LOG.error("Error recording the kcidb metrics of %s", worker)
+            utils.LOG.exception(ex)
+
+
+class KcidbMetricsRecorder(object):
+    """Store the metrics of the kcidb buffer of a worker process.
+
+    A thread stores them every `interval` seconds, so that they are up to
+    date even when no task is running.
+
+    :param task_metrics: The object storing the metrics.
+    :type task_metrics: TaskMetrics
+    :param worker: The name of the worker process.
+    :type worker: str
+    :param kcidb_buffer: The kcidb buffer.
+    :type kcidb_buffer: utils.kcidb.KcidbBuffer
+    :param interval: How often the metrics are stored, in seconds.
+    :type interval: float
+    """
+
+    def __init__(self, task_metrics, worker, kcidb_buffer,
+                 interval=KCIDB_METRICS_INTERVAL):
+        self.task_metrics = task_metrics
+        self.worker = worker
+        self.kcidb_buffer = kcidb_buffer
+        self.interval = interval
+        self._event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the thread storing the metrics."""
+        self._event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="KcidbMetricsRecorder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and remove the metrics of the process."""
+        self._event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.task_metrics.record_kcidb(self.worker, None)
+
+    def _run(self):
+        while not self._event.wait(self.interval):
+            self.task_metrics.record_kcidb(
+                self.worker, self.kcidb_buffer.get_metrics())
@@ -0,0 +1,153 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import logging
+import mock
+import mongomock
+import unittest
+
+import models
+import utils.counters
+
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.database = mongomock.MongoClient()["kernel-ci"]
+        self.builds = [
+            {"job": "mainline", "git_branch": "master", "kernel": "v5.4",
+             "status": "PASS", "arch": "arm"},
+            {"job": "mainline", "git_branch": "master", "kernel": "v5.4",
+             "status": "FAIL", "arch": "arm64"},
+            {"job": "next", "git_branch": "master", "kernel": "v5.5",
+             "status": "PASS"},
+        ]
+        self.database[models.BUILD_COLLECTION].insert_many(
+            [dict(build) for build in self.builds])
+        # Rebuild the counters right away, as the Celery task would.
+        self.schedule_rebuild = mock.Mock(
+            side_effect=lambda collection_name, ttl: utils.counters.rebuild(
+                self.database, collection_name, ttl))
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def _count(self, spec):
+        return utils.counters.get_count(
+            self.database, models.BUILD_COLLECTION, spec, 60,
+            schedule_rebuild=self.schedule_rebuild)
+
+    def test_get_spec_values(self):
+        self.assertEqual(
+            [["job", "mainline"], ["kernel", "v5.4"]],
+            utils.counters.get_spec_values(
+                {"kernel": "v5.4", "job": "mainline"}))
+        self.assertEqual([], utils.counters.get_spec_values({}))
+        self.assertIsNone(utils.counters.get_spec_values({"arch": "arm"}))
+        self.assertIsNone(
+            utils.counters.get_spec_values({"job": {"$in": ["a", "b"]}}))
+
+    def test_get_count(self):
+        # Not built yet.
+        self.assertIsNone(self._count({}))
+        self.assertEqual(1, self.schedule_rebuild.call_count)
+
+        self.assertEqual(3, self._count({}))
+        self.assertEqual(2, self._count({"job": "mainline"}))
+        self.assertEqual(
+            1, self._count({"job": "mainline", "status": "FAIL"}))
+        self.assertEqual(2, self._count({"git_branch": "master",
+                                         "status": "PASS"}))
+        self.assertEqual(0, self._count({"job": "stable"}))
+        self.assertIsNone(self._count({"arch": "arm"}))
+        self.assertIsNone(
+            utils.counters.get_count(
+                self.database, models.LAB_COLLECTION, {}, 60))
+
+    def test_update(self):
+        self.assertIsNone(self._count({"job": "mainline"}))
+        self.assertEqual(2, self._count({"job": "mainline"}))
+
+        new_build = dict(self.builds[0], status="FAIL")
+        self.database[models.BUILD_COLLECTION].insert_one(dict(new_build))
+        utils.counters.update(
+            self.database, models.BUILD_COLLECTION, added=[new_build])
+
+        self.assertEqual(3, self._count({"job": "mainline"}))
+        self.assertEqual(
+            2, self._count({"job": "mainline", "status": "FAIL"}))
+
+        utils.counters.update(
+            self.database, models.BUILD_COLLECTION,
+            added=[dict(new_build, status="PASS")], removed=[new_build])
+
+        self.assertEqual(3, self._count({"job": "mainline"}))
+        self.assertEqual(
+            1, self._count({"job": "mainline", "status": "FAIL"}))
+        self.assertEqual(4, self._count({}))
+
+    def test_invalidate(self):
+        self.assertIsNone(self._count({}))
+        self.assertEqual(3, self._count({}))
+
+        self.database[models.BUILD_COLLECTION].delete_many({"job": "next"})
+        self.assertEqual(3, self._count({}))
+
+        utils.counters.invalidate(self.database, models.BUILD_COLLECTION)
+        self.assertIsNone(self._count({}))
+        self.assertEqual(2, self._count({}))
+        self.assertEqual(0, self._count({"job": "next"}))
+
+    def test_expired(self):
+        with mock.patch("time.time") as mock_time:
+            mock_time.return_value = 1000
+            self.assertIsNone(self._count({}))
+            self.assertEqual(3, self._count({}))
+
+            self.database[models.BUILD_COLLECTION].insert_one(
+                dict(self.builds[2]))
+            mock_time.return_value = 1059
+            self.assertEqual(3, self._count({}))
+            mock_time.return_value = 1061
+            self.assertIsNone(self._count({}))
+            self.assertEqual(4, self._count({}))
+            self.assertEqual(2, self._count({"job": "next"}))
+
+    def test_rebuild_claimed(self):
+        self.schedule_rebuild.side_effect = None
+
+        with mock.patch("time.time") as mock_time:
+            mock_time.return_value = 1000
+            self.assertIsNone(self._count({}))
+            # Being rebuilt: not claimed again.
+            self.assertIsNone(self._count({"job": "mainline"}))
+            self.assertEqual(1, self.schedule_rebuild.call_count)
+            self.schedule_rebuild.assert_called_with(
+                models.BUILD_COLLECTION, 60)
+
+            # The rebuild failed.
+            mock_time.return_value = 1000 + utils.counters.REBUILD_TIMEOUT + 1
+            self.assertIsNone(self._count({}))
+            self.assertEqual(2, self.schedule_rebuild.call_count)
+
+    def test_claim_missing_marker(self):
+        counters = self.database[models.COUNTER_COLLECTION]
+
+        self.assertTrue(utils.counters._claim_rebuild(
+            counters, models.BUILD_COLLECTION, None))
+        self.assertFalse(utils.counters._claim_rebuild(
+            counters, models.BUILD_COLLECTION, None))
@@ -0,0 +1,283 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import logging
+import mock
+import mongomock
+import os
+import pymongo
+import threading
+import unittest
+
+import handlers.dbindexes
+import utils.db
+
+# Aggregations done by the frontend, as (collection, unique, match, sort,
+# fields).  They must not scan whole collections.
+AGGREGATE_QUERIES = [
+    (
+        "build", "kernel",
+        {"job": "mainline"},
+        [("created_on", pymongo.DESCENDING)],
+        ["job", "kernel", "git_branch", "git_commit", "created_on"],
+    ),
+    (
+        "build", ["job", "git_branch"],
+        None,
+        [("created_on", pymongo.DESCENDING)],
+        ["job", "git_branch", "kernel", "created_on"],
+    ),
+    (
+        "job", "job",
+        None,
+        [("created_on", pymongo.DESCENDING)],
+        ["job", "status", "created_on"],
+    ),
+    (
+        "test_group", "kernel",
+        {"job": "mainline", "git_branch": "master"},
+        [("created_on", pymongo.DESCENDING)],
+        ["job", "git_branch", "kernel", "created_on"],
+    ),
+]
+
+
+class TestDbClients(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        utils.db.reset_db_clients()
+        self.db_options = {"mongodb_host": "localhost", "mongodb_port": 27017}
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        utils.db.close_db_clients()
+
+    def test_get_db_client_shared(self):
+        client = utils.db.get_db_client(self.db_options)
+
+        self.assertIs(client, utils.db.get_db_client(dict(self.db_options)))
+        self.assertIs(
+            client, utils.db.get_db_connection(self.db_options).client)
+        self.assertIs(
+            client, utils.db.get_db_connection2(self.db_options).client)
+        self.assertEqual(1, utils.db.get_pool_metrics()["clients"])
+
+        other_options = dict(self.db_options, mongodb_port=27018)
+        self.assertIsNot(client, utils.db.get_db_client(other_options))
+        self.assertEqual(2, utils.db.get_pool_metrics()["clients"])
+
+    @mock.patch("os.getpid")
+    def test_get_db_client_forked(self, mock_getpid):
+        mock_getpid.return_value = 1
+        client = utils.db.get_db_client(self.db_options)
+        self.assertIs(client, utils.db.get_db_client(self.db_options))
+
+        mock_getpid.return_value = 2
+        child_client = utils.db.get_db_client(self.db_options)
+        self.assertIsNot(client, child_client)
+        self.assertEqual(1, utils.db.get_pool_metrics()["clients"])
+        client.close()
+
+    def test_pool_metrics(self):
+        metrics = utils.db.PoolMetrics()
+        metrics.pool_created(None)
+        for _ in range(3):
+            metrics.connection_created(None)
+            metrics.connection_checked_out(None)
+        metrics.connection_checked_in(None)
+        metrics.connection_closed(None)
+        metrics.connection_check_out_failed(None)
+
+        values = metrics.get()
+        self.assertEqual(1, values["pools"])
+        self.assertEqual(2, values["connections"])
+        self.assertEqual(2, values["in_use"])
+        self.assertEqual(3, values["created"])
+        self.assertEqual(1, values["closed"])
+        self.assertEqual(3, values["checked_out"])
+        self.assertEqual(1, values["check_out_failed"])
+
+        metrics.reset()
+        self.assertEqual(0, metrics.get()["connections"])
+
+    def test_command_metrics(self):
+        metrics = utils.db.CommandMetrics()
+        self.assertEqual({"calls": 0, "time": 0.0}, metrics.get())
+
+        metrics.succeeded(mock.Mock(duration_micros=1500000))
+        metrics.failed(mock.Mock(duration_micros=500000))
+        self.assertEqual({"calls": 2, "time": 2.0}, metrics.get())
+
+        other = {}
+        thread = threading.Thread(
+            target=lambda: other.update(metrics.get()))
+        thread.start()
+        thread.join()
+        self.assertEqual(0, other["calls"])
+
+        metrics.reset()
+        self.assertEqual({"calls": 0, "time": 0.0}, metrics.get())
+
+
+class TestAggregatePipeline(unittest.TestCase):
+
+    def test_sort_uses_index(self):
+        indexes = handlers.dbindexes.INDEX_SPECS["build"]
+
+        self.assertTrue(utils.db.sort_uses_index(
+            [("created_on", -1)], None, indexes))
+        self.assertTrue(utils.db.sort_uses_index(
+            [("created_on", 1)], {"job": "mainline"}, indexes))
+        self.assertTrue(utils.db.sort_uses_index(
+            [("job", 1), ("kernel", 1)], {"git_branch": "master"}, indexes))
+        self.assertTrue(utils.db.sort_uses_index(
+            [("job", 1)], {"job": "mainline"}, None))
+        self.assertFalse(utils.db.sort_uses_index(
+            [("created_on", -1), ("kernel", -1)], None, indexes))
+        self.assertFalse(utils.db.sort_uses_index(
+            [("job", 1), ("kernel", 1)],
+            {"git_branch": {"$in": ["master"]}}, indexes))
+        self.assertFalse(utils.db.sort_uses_index(
+            [("created_on", -1)], None, None))
+
+    def test_pipeline_no_fields(self):
+        pipeline = utils.db.get_aggregate_pipeline(
+            "kernel", match={"job": "mainline"}, limit=5)
+
+        self.assertListEqual(
+            [
+                {"$match": {"job": "mainline"}},
+                {
+                    "$group": {
+                        "_id": "$kernel",
+                        "result": {"$first": "$$CURRENT"},
+                    }
+                },
+                {"$limit": 5},
+            ],
+            pipeline)
+
+    def test_pipeline_project_fields(self):
+        pipeline = utils.db.get_aggregate_pipeline(
+            ["$job", "git_branch"],
+            sort=[("created_on", -1)], fields={"kernel": True, "arch": False})
+
+        self.assertListEqual(["$project", "$group", "$sort"], [
+            stage.keys()[0] for stage in pipeline])
+        self.assertDictEqual(
+            {
+                "created_on": True,
+                "git_branch": True,
+                "job": True,
+                "kernel": True,
+            },
+            pipeline[0]["$project"])
+
+    def test_pipeline_sort_before_group(self):
+        sort = [("created_on", -1)]
+        indexes = handlers.dbindexes.INDEX_SPECS["build"]
+
+        pipeline = utils.db.get_aggregate_pipeline(
+            "kernel", match={"job": "mainline"}, sort=sort, indexes=indexes)
+        self.assertListEqual(
+            ["$match", "$sort", "$group", "$sort"],
+            [stage.keys()[0] for stage in pipeline])
+
+        pipeline = utils.db.get_aggregate_pipeline(
+            "kernel", match={"job": "mainline"}, sort=[("defconfig", 1)],
+            indexes=indexes)
+        self.assertListEqual(
+            ["$match", "$group", "$sort"],
+            [stage.keys()[0] for stage in pipeline])
+
+    def test_aggregate(self):
+        collection = mongomock.MongoClient()["kci"]["job"]
+        collection.insert_many([
+            {"job": "a", "kernel": "v1", "created_on": 1, "status": "PASS"},
+            {"job": "a", "kernel": "v2", "created_on": 2, "status": "FAIL"},
+            {"job": "b", "kernel": "v3", "created_on": 3, "status": "PASS"},
+        ])
+
+        result = utils.db.aggregate(
+            collection, "job", sort=[("created_on", -1)],
+            fields=["kernel"],
+            indexes=handlers.dbindexes.INDEX_SPECS["job"])
+
+        self.assertListEqual(
+            [
+                {"_id": "b", "kernel": "v3", "created_on": 3},
+                {"_id": "a", "kernel": "v2", "created_on": 2},
+            ],
+            result)
+
+    def test_aggregate_queries_use_indexes(self):
+        for name, unique, match, sort, fields in AGGREGATE_QUERIES:
+            indexes = handlers.dbindexes.INDEX_SPECS[name]
+            pipeline = utils.db.get_aggregate_pipeline(
+                unique, match=match, sort=sort, fields=fields,
+                indexes=indexes)
+            stages = [stage.keys()[0] for stage in pipeline]
+
+            self.assertEqual(
+                "$sort", stages[1 if match else 0], (name, unique))
+            self.assertIn("$project", stages, (name, unique))
+            if match:
+                self.assertTrue(
+                    any(index[0][0] in match for index in indexes),
+                    (name, unique))
+
+
+def _get_plan_stages(explain):
+    """Get the stages of all the query plans of an explain output."""
+    if isinstance(explain, dict):
+        if "stage" in explain:
+            yield explain["stage"]
+        for value in explain.itervalues():
+            for stage in _get_plan_stages(value):
+                yield stage
+    elif isinstance(explain, list):
+        for value in explain:
+            for stage in _get_plan_stages(value):
+                yield stage
+
+
+@unittest.skipUnless(
+    os.environ.get("KCI_TEST_MONGODB"),
+    "KCI_TEST_MONGODB is not set to the URI of a test MongoDB server")
+class TestAggregateExplain(unittest.TestCase):
+    """Explain the frontend aggregations with a real MongoDB server."""
+
+    def setUp(self):
+        self.client = pymongo.MongoClient(os.environ["KCI_TEST_MONGODB"])
+        self.database = self.client["kernel-ci-test-explain"]
+        handlers.dbindexes.ensure_indexes(self.database)
+
+    def tearDown(self):
+        self.client.drop_database(self.database)
+        self.client.close()
+
+    def test_aggregate_queries_explain(self):
+        for name, unique, match, sort, fields in AGGREGATE_QUERIES:
+            pipeline = utils.db.get_aggregate_pipeline(
+                unique, match=match, sort=sort, fields=fields,
+                indexes=handlers.dbindexes.INDEX_SPECS[name])
+            explain = self.database.command(
+                "aggregate", name, pipeline=pipeline, explain=True)
+            stages = list(_get_plan_stages(explain))
+
+            self.assertIn("IXSCAN", stages, (name, unique))
+            self.assertNotIn("COLLSCAN", stages, (name, unique))
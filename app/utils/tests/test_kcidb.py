@@ -0,0 +1,331 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import datetime
+import json
+import logging
+import mock
+import mongomock
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+import models
+import utils.kcidb
+
+# Stub kcidb-submit scripts: one appending its input to a file, and one
+# exiting after the first line.
+STUB_SUBMIT = "#!/bin/sh\ncat >> \"$KCIDB_STUB_OUTPUT\"\n"
+STUB_SUBMIT_ONCE = "#!/bin/sh\nhead -n 1 >> \"$KCIDB_STUB_OUTPUT\"\n"
+
+
+class TestKcidbSubmit(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, "output")
+        self.options = {
+            "kcidb_path": self.tmp_dir,
+            "project": "project",
+            "topic": "topic",
+            "credentials": "credentials.json",
+        }
+        patcher = mock.patch.dict(
+            os.environ, {"KCIDB_STUB_OUTPUT": self.output})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _write_stub(self, script):
+        path = os.path.join(self.tmp_dir, "kcidb-submit")
+        with open(path, "w") as stub:
+            stub.write(script)
+        os.chmod(path, stat.S_IRWXU)
+
+    def _read_output(self):
+        with open(self.output) as output:
+            return [json.loads(line) for line in output]
+
+    def _wait_metric(self, buf, name, value):
+        for _ in range(200):
+            if buf.get_metrics()[name] >= value:
+                return
+            time.sleep(0.01)
+        self.fail("Metric {} did not reach {}".format(name, value))
+
+    def test_submit_compact(self):
+        self._write_stub(STUB_SUBMIT)
+        kcidb_submit = utils.kcidb.KcidbSubmit(self.options)
+
+        kcidb_submit.submit({
+            "version": "1",
+            "tests": ({"origin_id": str(i)} for i in range(2)),
+        })
+        kcidb_submit.terminate()
+
+        with open(self.output) as output:
+            lines = output.readlines()
+        self.assertEqual(1, len(lines))
+        self.assertNotIn(" ", lines[0])
+        self.assertEqual(
+            {
+                "version": "1",
+                "tests": [{"origin_id": "0"}, {"origin_id": "1"}],
+            },
+            json.loads(lines[0]))
+
+    def test_submit_restart(self):
+        self._write_stub(STUB_SUBMIT_ONCE)
+        kcidb_submit = utils.kcidb.KcidbSubmit(self.options)
+
+        kcidb_submit.submit({"version": "1", "builds": [{"origin_id": "a"}]})
+        kcidb_submit.process.wait()
+        kcidb_submit.submit({"version": "1", "builds": [{"origin_id": "b"}]})
+        kcidb_submit.terminate()
+
+        self.assertEqual(1, kcidb_submit.restarts)
+        self.assertEqual(
+            ["a", "b"],
+            [data["builds"][0]["origin_id"] for data in self._read_output()])
+
+    def test_buffer_coalesce(self):
+        self._write_stub(STUB_SUBMIT)
+        buf = utils.kcidb.KcidbBuffer(
+            utils.kcidb.KcidbSubmit(self.options), max_delay=60)
+
+        buf.submit({
+            "version": "1",
+            "revisions": [{"origin_id": "rev"}],
+            "builds": [{"origin_id": "build"}],
+        })
+        buf.submit({
+            "version": "1",
+            "tests": ({"origin_id": str(i)} for i in range(3)),
+        })
+        self.assertEqual(5, buf.get_metrics()["queue_depth"])
+        buf.terminate()
+
+        data = self._read_output()
+        self.assertEqual(1, len(data))
+        self.assertEqual("1", data[0]["version"])
+        self.assertEqual([{"origin_id": "rev"}], data[0]["revisions"])
+        self.assertEqual([{"origin_id": "build"}], data[0]["builds"])
+        self.assertEqual(3, len(data[0]["tests"]))
+
+        metrics = buf.get_metrics()
+        self.assertEqual(0, metrics["queue_depth"])
+        self.assertEqual(0, metrics["queue_bytes"])
+        self.assertEqual(1, metrics["batches"])
+        self.assertEqual(5, metrics["objects"])
+        self.assertEqual(0, metrics["errors"])
+        self.assertTrue(metrics["submit_latency_avg"] > 0)
+
+    def test_buffer_size_bounded(self):
+        self._write_stub(STUB_SUBMIT)
+        buf = utils.kcidb.KcidbBuffer(
+            utils.kcidb.KcidbSubmit(self.options), max_items=2, max_delay=60)
+
+        buf.submit({
+            "version": "1",
+            "tests": ({"origin_id": str(i)} for i in range(5)),
+        })
+        self._wait_metric(buf, "batches", 2)
+        self.assertEqual(1, buf.get_metrics()["queue_depth"])
+        buf.terminate()
+
+        self.assertEqual(
+            [2, 2, 1], [len(data["tests"]) for data in self._read_output()])
+
+    def test_buffer_bytes_bounded(self):
+        kcidb_submit = mock.Mock()
+        buf = utils.kcidb.KcidbBuffer(kcidb_submit, max_bytes=30)
+
+        buf.submit({
+            "tests": ({"origin_id": str(i)} for i in range(4)),
+        })
+        buf.flush()
+
+        # Each object is 16 bytes of JSON: one fits in a batch.
+        self.assertEqual(4, kcidb_submit.write.call_count)
+
+    def test_buffer_time_bounded(self):
+        kcidb_submit = mock.Mock()
+        buf = utils.kcidb.KcidbBuffer(kcidb_submit, max_delay=0.05)
+
+        buf.submit({"builds": [{"origin_id": "build"}]})
+        self._wait_metric(buf, "batches", 1)
+
+        kcidb_submit.write.assert_called_once_with(
+            '{"version":"1","builds":[{"origin_id":"build"}]}')
+        self.assertTrue(buf.get_metrics()["queue_latency_max"] >= 0.05)
+
+    def test_buffer_backpressure(self):
+        written = threading.Event()
+        blocked = threading.Event()
+        kcidb_submit = mock.Mock()
+        kcidb_submit.write.side_effect = lambda data: blocked.wait(5)
+        buf = utils.kcidb.KcidbBuffer(
+            kcidb_submit, max_items=1, max_delay=0, max_queue=2)
+
+        def submit():
+            buf.submit({
+                "tests": ({"origin_id": str(i)} for i in range(4)),
+            })
+            written.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # One test is being written, two are waiting and the last one is
+        # blocked until there is room.
+        self._wait_metric(buf, "blocked", 1)
+        self._wait_metric(buf, "queue_depth", 2)
+        self.assertFalse(written.is_set())
+
+        blocked.set()
+        thread.join(5)
+        self.assertTrue(written.is_set())
+        buf.flush()
+        self.assertEqual(4, buf.get_metrics()["objects"])
+
+    def test_buffer_error(self):
+        kcidb_submit = mock.Mock()
+        kcidb_submit.write.side_effect = IOError("Broken pipe")
+        buf = utils.kcidb.KcidbBuffer(kcidb_submit)
+
+        buf.submit({"builds": [{"origin_id": "build"}]})
+        buf.flush()
+
+        metrics = buf.get_metrics()
+        self.assertEqual(1, metrics["errors"])
+        self.assertEqual(0, metrics["queue_depth"])
+
+    def test_create_submitter(self):
+        self.assertIsInstance(
+            utils.kcidb.create_submitter(self.options),
+            utils.kcidb.KcidbBuffer)
+
+        self.options["batch_size"] = 0
+        self.assertIsInstance(
+            utils.kcidb.create_submitter(self.options),
+            utils.kcidb.KcidbSubmit)
+
+
+class TestPushTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.db = mongomock.MongoClient()["kernel-ci"]
+        self.kcidb_submit = mock.Mock()
+        self.build_id = self.db[models.BUILD_COLLECTION].insert_one({
+            models.JOB_KEY: "job",
+            models.KERNEL_KEY: "kernel",
+            models.GIT_BRANCH_KEY: "branch",
+            models.ARCHITECTURE_KEY: "arm",
+            models.DEFCONFIG_KEY: "defconfig",
+            models.BUILD_ENVIRONMENT_KEY: "gcc-8",
+            models.FILE_SERVER_RESOURCE_KEY: "job/branch/kernel",
+        }).inserted_id
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def _add_group(self, name, sub_groups=None):
+        group = {
+            models.NAME_KEY: name,
+            models.SUB_GROUPS_KEY: sub_groups or [],
+            models.JOB_KEY: "job",
+            models.KERNEL_KEY: "kernel",
+            models.GIT_BRANCH_KEY: "branch",
+            models.ARCHITECTURE_KEY: "arm",
+            models.DEFCONFIG_KEY: "defconfig",
+            models.BUILD_ENVIRONMENT_KEY: "gcc-8",
+            models.DEVICE_TYPE_KEY: "board",
+            models.LAB_NAME_KEY: "lab",
+            models.MACH_KEY: "mach",
+            models.INITRD_KEY: None,
+            models.BOARD_INSTANCE_KEY: "board-1",
+            models.BOOT_LOG_KEY: "log.txt",
+            models.BOOT_LOG_HTML_KEY: "log.html",
+            models.PLAN_VARIANT_KEY: "variant",
+        }
+        return self.db[models.TEST_GROUP_COLLECTION].insert_one(
+            group).inserted_id
+
+    def _add_cases(self, group_id, count, orphans=False):
+        case_ids = self.db[models.TEST_CASE_COLLECTION].insert_many([
+            {
+                models.NAME_KEY: "case-{}".format(i),
+                models.STATUS_KEY: "PASS" if i % 2 else "UNKNOWN",
+                models.CREATED_KEY: datetime.datetime(2019, 1, 1),
+                models.TEST_GROUP_ID_KEY: group_id,
+            }
+            for i in range(count)
+        ]).inserted_ids
+        if not orphans:
+            self.db[models.TEST_GROUP_COLLECTION].update_one(
+                {models.ID_KEY: group_id},
+                {"$push": {models.TEST_CASES_KEY: {"$each": case_ids}}})
+
+    def test_push_tests_chunks(self):
+        sub_id = self._add_group("sub")
+        group_id = self._add_group("plan", [sub_id])
+        self._add_cases(group_id, 2)
+        self._add_cases(sub_id, 3)
+        # Not listed in the test cases of their group.
+        self._add_cases(sub_id, 2, orphans=True)
+        # Not part of the group tree.
+        self._add_cases(self._add_group("other"), 4)
+
+        utils.kcidb.push_tests(
+            group_id, {"tests_chunk_size": 2}, self.kcidb_submit,
+            db=self.db)
+
+        chunks = [
+            call[0][0]["tests"]
+            for call in self.kcidb_submit.submit.call_args_list
+        ]
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+
+        tests = [test for chunk in chunks for test in chunk]
+        self.assertEqual(
+            sorted(
+                ["plan.case-0", "plan.case-1"] +
+                ["plan.sub.case-{}".format(i) for i in range(3)]),
+            sorted(test["path"] for test in tests))
+        self.assertEqual(
+            set(["PASS", "SKIP"]), set(test["status"] for test in tests))
+        self.assertEqual(
+            "kernelci.org:{}".format(self.build_id),
+            tests[0]["build_origin_id"])
+        self.assertIs(tests[0]["environment"], tests[-1]["environment"])
+        self.assertIs(tests[0]["output_files"], tests[-1]["output_files"])
+
+    def test_push_tests_no_build(self):
+        self.db[models.BUILD_COLLECTION].delete_many({})
+        group_id = self._add_group("plan")
+        self._add_cases(group_id, 2)
+
+        utils.kcidb.push_tests(group_id, {}, self.kcidb_submit, db=self.db)
+
+        self.assertFalse(self.kcidb_submit.submit.called)
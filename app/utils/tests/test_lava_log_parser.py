@@ -0,0 +1,117 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import codecs
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import utils.lava_log_parser as lava_log_parser
+
+LOG = [
+    {"dt": "2019-01-25T13:10:00.123456", "lvl": "info",
+     "msg": "Start time: 2019-01-25 13:10:00"},
+    {"dt": "2019-01-25T13:10:01.000000", "lvl": "target",
+     "msg": "<3>[    1.000] error <irq>"},
+    {"dt": "2019-01-25T13:10:02.000000", "lvl": "target",
+     "msg": "<4>[    2.000] warning"},
+    {"dt": "2019-01-25T13:10:03.000000", "lvl": "target",
+     "msg": [u"Booting", u"Linux \u00e9"]},
+    {"dt": "2019-01-25T13:10:04.000000", "lvl": "error",
+     "msg": "Kernel panic"},
+    {"dt": "2019-01-25T13:10:05.000000", "lvl": "results",
+     "msg": {"case": "login", "result": "pass"}},
+]
+
+META = {"device_type": "qemu", "boot_result": "FAIL"}
+
+
+class TestLogRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def test_render(self):
+        renderer = lava_log_parser.LogRenderer()
+        txt_lines, html_lines, counts = renderer.render(LOG)
+
+        self.assertEqual(
+            u"<3>[    1.000] error <irq>\n<4>[    2.000] warning\n"
+            u"Booting Linux \u00e9\n",
+            u"".join(txt_lines))
+        self.assertEqual(5, len(html_lines))
+        self.assertEqual(
+            u"<span id=L2><a class=\"lineno\" href=\"#L2\">    2</a> "
+            u"<span class=\"timestamp\">13:10:01.000000  </span>"
+            u"<span class=\"err\">&lt;3&gt;[    1.000] error &lt;irq&gt;"
+            u"</span></span>\n",
+            html_lines[1])
+        self.assertEqual(
+            u"<span id=L4><a class=\"lineno\" href=\"#L4\">    4</a> "
+            u"<span class=\"timestamp\">13:10:03.000000  </span>"
+            u"Booting Linux \u00e9</span>\n",
+            html_lines[3])
+        self.assertEqual(1, counts["numbers"]["error"])
+        self.assertEqual(1, counts["numbers"]["info"])
+        self.assertEqual(1, counts["kernel_numbers"]["3"])
+        self.assertEqual(1, counts["kernel_numbers"]["4"])
+
+    def test_write_buffered(self):
+        txt, html = io.StringIO(), io.StringIO()
+        lava_log_parser.run(LOG, META, txt, html)
+
+        buffered_txt, buffered_html = io.StringIO(), io.StringIO()
+        renderer = lava_log_parser.LogRenderer(buffer_lines=2)
+        renderer.write(LOG, META, [buffered_txt], [buffered_html])
+
+        self.assertEqual(txt.getvalue(), buffered_txt.getvalue())
+        self.assertEqual(html.getvalue(), buffered_html.getvalue())
+        self.assertIn(
+            u"<li class=\"result\">Kernel Errors: 1</li>", html.getvalue())
+        self.assertIn(
+            u"<span class=\"err\">FAIL</span>", html.getvalue())
+        self.assertTrue(html.getvalue().endswith(u"</pre></body></html>\n"))
+
+    def test_write_files_compress(self):
+        txt_path = os.path.join(self.out_dir, "log.txt")
+        html_path = os.path.join(self.out_dir, "log.html")
+        renderer = lava_log_parser.LogRenderer()
+        renderer.write_files(LOG, META, txt_path, html_path, compress=True)
+
+        for path in [txt_path, html_path]:
+            with codecs.open(path, "r", "utf-8") as plain:
+                content = plain.read()
+            with gzip.open(path + ".gz", "rb") as compressed:
+                self.assertEqual(
+                    content, compressed.read().decode("utf-8"))
+            self.assertIn(u"Booting Linux \u00e9", content)
+
+    def test_write_files_no_compress(self):
+        txt_path = os.path.join(self.out_dir, "log.txt")
+        html_path = os.path.join(self.out_dir, "log.html")
+        renderer = lava_log_parser.LogRenderer()
+        renderer.write_files(LOG, META, txt_path, html_path)
+
+        self.assertTrue(os.path.isfile(txt_path))
+        self.assertTrue(os.path.isfile(html_path))
+        self.assertFalse(os.path.exists(txt_path + ".gz"))
+        self.assertFalse(os.path.exists(html_path + ".gz"))
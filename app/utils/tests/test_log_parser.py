@@ -16,6 +16,7 @@
 # along with this library; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import io
 import logging
 import mock
 import mongomock
@@ -28,6 +29,7 @@ import unittest
 import models.build as mbuild
 import utils
 import utils.log_parser as lparser
+import utils.logs.summary
 
 
 class TestBuildLogParser(unittest.TestCase):
@@ -95,176 +97,189 @@ class TestBuildLogParser(unittest.TestCase):
         finally:
             shutil.rmtree(build_dir, ignore_errors=True)
 
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_one_error(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "errors": [
-                (1, "foo")
-            ],
-            "warnings": [],
-            "mismatches": []
-        }
-        errors = {
-            "foo": 3
-        }
-        expected_list = [
-            (4, "foo")
-        ]
-        lparser._update_prev_summary(prev_doc, errors, None, None, self.db)
-        self.assertListEqual(expected_list, prev_doc["errors"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_more_errors(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "errors": [
-                (1, "foo"), (2, "bar")
-            ],
-            "warnings": [],
-            "mismatches": []
-        }
-        errors = {
-            "foo": 3,
-            "baz": 1
-        }
-        expected_list = [
-            (4, "foo"), (2, "bar"), (1, "baz")
-        ]
-        lparser._update_prev_summary(prev_doc, errors, None, None, self.db)
-        self.assertListEqual(expected_list, prev_doc["errors"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_one_warning(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "warnings": [
-                (1, "foo")
-            ],
-            "errors": [],
-            "mismatches": []
-        }
-        warnings = {
-            "foo": 3
-        }
-        expected_list = [
-            (4, "foo")
-        ]
-        lparser._update_prev_summary(prev_doc, None, warnings, None, self.db)
-        self.assertListEqual(expected_list, prev_doc["warnings"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_more_warning(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "warnings": [
-                (1, "foo"), (2, "bar")
-            ],
-            "errors": [],
-            "mismatches": []
-        }
-        warnings = {
-            "foo": 3,
-            "baz": 1
-        }
-        expected_list = [
-            (4, "foo"), (2, "bar"), (1, "baz")
-        ]
-        lparser._update_prev_summary(prev_doc, None, warnings, None, self.db)
-        self.assertListEqual(expected_list, prev_doc["warnings"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_one_mismatch(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "mismatches": [
-                (1, "foo")
-            ],
-            "errors": [],
-            "warnings": []
-        }
-        mismatches = {
-            "foo": 3
-        }
-        expected_list = [
-            (4, "foo")
-        ]
-        lparser._update_prev_summary(prev_doc, None, None, mismatches, self.db)
-        self.assertListEqual(expected_list, prev_doc["mismatches"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_simple_with_more_mismatches(
-            self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "mismatches": [
-                (1, "foo"), (2, "bar")
-            ],
-            "errors": [],
-            "warnings": []
-        }
-        mismatches = {
-            "foo": 3,
-            "baz": 1
-        }
-        expected_list = [
-            (4, "foo"), (2, "bar"), (1, "baz")
-        ]
-        lparser._update_prev_summary(prev_doc, None, None, mismatches, self.db)
-        self.assertListEqual(expected_list, prev_doc["mismatches"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_complex(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
-            "errors": [
-                (1, "foo"), (2, "baz"), (3, "foobar")
-            ],
-            "mismatches": [
-                (1, "foo"), (2, "bar")
+    def test_parse_build_logs_parallel(self):
+        build_dir = None
+        try:
+            build_doc = mbuild.BuildDocument(
+                "job", "kernel", "defconfig", "branch", "build_environment")
+            build_dir = tempfile.mkdtemp()
+            os.mkdir(os.path.join(build_dir, "logs"))
+            log_files = []
+            logs = [
+                ("kernel.log", "foo.c:1: error: foo\nbar.c: warning: b\n"),
+                ("modules.log", "baz.c:2: error: baz\n"),
+                ("dtbs.log", "  DTC     foo.dtb\n"),
+            ]
+            for name, data in logs:
+                log_file = os.path.join(build_dir, name)
+                with open(log_file, "w") as w_file:
+                    w_file.write(data)
+                log_files.append(log_file)
+
+            results = [
+                lparser._parse_logs(
+                    build_doc, log_files, build_dir, {}, processes)
+                for processes in [0, 3]
+            ]
+            self.assertEqual(results[0], results[1])
+
+            status, e_l, w_l, m_l = results[1]
+            self.assertEqual(200, status)
+            self.assertListEqual(
+                ["foo.c:1: error: foo", "baz.c:2: error: baz"], e_l)
+            self.assertListEqual(["bar.c: warning: b"], w_l)
+            self.assertListEqual([], m_l)
+
+            errors_file = os.path.join(build_dir, utils.BUILD_ERRORS_FILE)
+            with open(errors_file) as r_file:
+                self.assertEqual(
+                    "foo.c:1: error: foo\nbaz.c:2: error: baz\n",
+                    r_file.read())
+            self.assertFalse(os.path.exists(
+                os.path.join(build_dir, utils.BUILD_MISMATCHES_FILE)))
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def test_parse_build_logs_parallel_missing_file(self):
+        build_dir = None
+        try:
+            build_doc = mbuild.BuildDocument(
+                "job", "kernel", "defconfig", "branch", "build_environment")
+            build_dir = tempfile.mkdtemp()
+            log_file = os.path.join(build_dir, "kernel.log")
+            with open(log_file, "w") as w_file:
+                w_file.write("foo.c:1: error: foo\n")
+
+            status, e_l, w_l, m_l = lparser._parse_logs(
+                build_doc, [log_file, "nope.log"], build_dir, {}, 2)
+
+            self.assertEqual(500, status)
+            self.assertEqual(([], [], []), (e_l, w_l, m_l))
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def test_classify_lines(self):
+        classify = lparser.BuildLogClassifier.classify
+
+        self.assertEqual(lparser.ERROR_LINE, classify(u"foo.c:1: error: x"))
+        self.assertEqual(lparser.ERROR_LINE, classify(u"ERROR: foo"))
+        self.assertEqual(lparser.ERROR_LINE, classify(u"/bin/sh: 1: foo"))
+        self.assertEqual(
+            lparser.ERROR_LINE, classify(u"foo: warning: undefined reference"))
+        self.assertEqual(lparser.WARNING_LINE, classify(u"foo.c:1: warning x"))
+        self.assertEqual(
+            lparser.MISMATCH_LINE,
+            classify(u"WARNING: modpost: Found 2 section mismatch(es)."))
+        self.assertIsNone(
+            classify(u"warning: \"NPTL on non MMU needs fixing\""))
+        self.assertIsNone(classify(u"  CC      kernel/error.o"))
+        self.assertIsNone(classify(u"  LD      vmlinux"))
+
+    def test_classifier_parse_stream(self):
+        data = (
+            "  CC      init/main.o\r\n"
+            "../init/main.c:10:1: error: foo\r\n"
+            "  CC      kernel/fork.o\r"
+            "../kernel/fork.c:20:2: warning: bar\n"
+            "Section mismatch in reference from baz\n"
+            "../mm/slab.c:30:3: Error: \xc3\xa9t\xc3\xa9"
+        )
+        expected = (
+            [
+                u"init/main.c:10:1: error: foo",
+                u"mm/slab.c:30:3: Error: \xe9t\xe9",
             ],
-            "warnings": []
-        }
-        errors = {
-            "bazfoo": 1
-        }
-        mismatches = {
-            "foo": 3,
-            "baz": 1
-        }
-        expected_err_list = [
-            (3, "foobar"), (2, "baz"), (1, "foo"), (1, "bazfoo")
-        ]
-        expected_mism_list = [
-            (4, "foo"), (2, "bar"), (1, "baz")
-        ]
-        lparser._update_prev_summary(
-            prev_doc, errors, None, mismatches, self.db)
-        self.assertListEqual(expected_err_list, prev_doc["errors"])
-        self.assertListEqual(expected_mism_list, prev_doc["mismatches"])
-
-    @mock.patch("utils.db.find_and_update")
-    def test_update_prev_summary_complex_all(self, mock_update):
-        mock_update.return_value = 200
-        prev_doc = {
-            "_id": "doc-id",
+            [u"kernel/fork.c:20:2: warning: bar"],
+            [u"Section mismatch in reference from baz"],
+        )
+
+        # Use small chunks to also check the lines split across chunks.
+        for chunk_size in [7, 64, 1024]:
+            classifier = lparser.BuildLogClassifier(chunk_size=chunk_size)
+            self.assertEqual(
+                expected, classifier.parse_stream(io.BytesIO(data)))
+
+    def test_classifier_parse_file(self):
+        log_file = os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            "assets", "build_log_0.log")
+
+        e_l, w_l, m_l = lparser.BuildLogClassifier().parse_file(log_file)
+
+        self.assertEqual(22, len(e_l))
+        self.assertEqual(8, len(w_l))
+        self.assertEqual(0, len(m_l))
+        self.assertEqual(
+            "kernel/time/tick-internal.h:114:5: error: "
+            "dereferencing pointer to incomplete type", e_l[0])
+
+    @mock.patch("utils.db.get_db_connection")
+    def test_save_summary_new(self, mock_db):
+        mock_db.return_value = self.db
+        build_doc = mbuild.BuildDocument(
+            "job", "kernel", "defconfig", "branch", "build_environment")
+        errors = {"foo": 1, "bar": 2}
+        warnings = {u"warn \u2018w\u2019": 1}
+
+        status = lparser._save_summary(
+            errors, warnings, {}, "job-id", build_doc, {})
+        self.assertEqual(200, status)
+
+        summary = self.db["errors_summary"].find_one({"job_id": "job-id"})
+        self.assertEqual("job", summary["job"])
+        self.assertEqual("kernel", summary["kernel"])
+        self.assertEqual("branch", summary["git_branch"])
+        self.assertEqual("1.2", summary["version"])
+
+        utils.logs.summary.to_lists(summary)
+        self.assertListEqual([[2, "bar"], [1, "foo"]], summary["errors"])
+        self.assertListEqual(
+            [[1, u"warn \u2018w\u2019"]], summary["warnings"])
+        self.assertListEqual([], summary["mismatches"])
+        self.assertNotIn("errors_lines", summary)
+
+    @mock.patch("utils.db.get_db_connection")
+    def test_save_summary_increments(self, mock_db):
+        mock_db.return_value = self.db
+        build_doc = mbuild.BuildDocument(
+            "job", "kernel", "defconfig", "branch", "build_environment")
+
+        lparser._save_summary(
+            {"foo": 1, "baz": 2}, {"warn": 2}, {}, "job-id", build_doc, {})
+        lparser._save_summary(
+            {"foo": 1, "foobar": 3}, {}, {"mism": 1},
+            "job-id", build_doc, {})
+        lparser._save_summary({}, {}, {}, "job-id", build_doc, {})
+
+        self.assertEqual(1, self.db["errors_summary"].count_documents({}))
+        summary = utils.logs.summary.to_lists(
+            self.db["errors_summary"].find_one())
+        self.assertListEqual(
+            [[3, "foobar"], [2, "foo"], [2, "baz"]], summary["errors"])
+        self.assertListEqual([[2, "warn"]], summary["warnings"])
+        self.assertListEqual([[1, "mism"]], summary["mismatches"])
+
+    @mock.patch("utils.db.get_db_connection")
+    def test_save_summary_prev_version(self, mock_db):
+        mock_db.return_value = self.db
+        build_doc = mbuild.BuildDocument(
+            "job", "kernel", "defconfig", "branch", "build_environment")
+        self.db["errors_summary"].insert_one({
+            "job_id": "job-id",
+            "job": "job",
+            "kernel": "kernel",
+            "git_branch": "branch",
+            "version": "1.1",
             "warnings": [
-                (2, "warn")
+                [2, "warn"]
             ],
             "errors": [
-                (1, "foo"), (2, "baz"), (3, "foobar")
+                [3, "foobar"], [2, "baz"], [1, "foo"]
             ],
             "mismatches": [
-                (1, "foo"), (2, "bar")
+                [2, "bar"], [1, "foo"]
             ]
-        }
+        })
         warnings = {
             "warn": 3,
             "new-warn": 1
@@ -277,16 +292,29 @@ class TestBuildLogParser(unittest.TestCase):
             "baz": 1
         }
         expected_warn_list = [
-            (5, "warn"), (1, "new-warn")
+            [5, "warn"], [1, "new-warn"]
         ]
         expected_err_list = [
-            (3, "foobar"), (2, "baz"), (1, "foo"), (1, "bazfoo")
+            [3, "foobar"], [2, "baz"], [1, "foo"], [1, "bazfoo"]
         ]
         expected_mism_list = [
-            (4, "foo"), (2, "bar"), (1, "baz")
+            [4, "foo"], [2, "bar"], [1, "baz"]
         ]
-        lparser._update_prev_summary(
-            prev_doc, errors, warnings, mismatches, self.db)
-        self.assertListEqual(expected_err_list, prev_doc["errors"])
-        self.assertListEqual(expected_mism_list, prev_doc["mismatches"])
-        self.assertListEqual(expected_warn_list, prev_doc["warnings"])
+
+        lparser._save_summary(
+            errors, warnings, mismatches, "job-id", build_doc, {})
+
+        summary = utils.logs.summary.to_lists(
+            self.db["errors_summary"].find_one())
+        self.assertListEqual(expected_err_list, summary["errors"])
+        self.assertListEqual(expected_mism_list, summary["mismatches"])
+        self.assertListEqual(expected_warn_list, summary["warnings"])
+
+    def test_summary_get_fields(self):
+        self.assertIsNone(utils.logs.summary.get_fields(None))
+        self.assertListEqual(
+            ["errors", "job", "errors_lines"],
+            utils.logs.summary.get_fields(["errors", "job"]))
+        self.assertDictEqual(
+            {"warnings": False, "warnings_lines": False, "job": True},
+            utils.logs.summary.get_fields({"warnings": False, "job": True}))
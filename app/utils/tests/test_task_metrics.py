@@ -0,0 +1,200 @@
+# Copyright (C) Collabora Limited 2019
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import fakeredis
+import logging
+import mock
+import redis
+import threading
+import unittest
+
+import utils.task_metrics as task_metrics
+
+CHAIN = "lava-test>kcidb-tests>find-regression"
+
+
+class TestTaskMetrics(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.redis = fakeredis.FakeStrictRedis()
+        self.redis.flushall()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_get_chain_name(self):
+        body = {
+            "task": "import-build",
+            "callbacks": [
+                {
+                    "task": "kcidb-build",
+                    "options": {
+                        "link": [
+                            {"task": "parse-single-build-log", "options": {}},
+                        ],
+                    },
+                },
+            ],
+        }
+        self.assertEqual(
+            "import-build>kcidb-build>parse-single-build-log",
+            task_metrics.get_chain_name(body))
+        self.assertEqual(
+            "send-report",
+            task_metrics.get_chain_name(
+                {"task": "send-report", "callbacks": None}))
+
+    @mock.patch("time.time")
+    def test_set_publish_headers(self, mock_time):
+        mock_time.return_value = 100.0
+        headers = {}
+        task_metrics.set_publish_headers({"task": "lava-test"}, headers)
+        self.assertEqual(
+            {"kci_published": 100.0, "kci_chain": "lava-test"}, headers)
+
+        headers = {}
+        task_metrics.set_publish_headers(
+            {"task": "kcidb-tests"}, headers, {"kci_chain": CHAIN})
+        self.assertEqual(CHAIN, headers["kci_chain"])
+
+    @mock.patch("utils.db.get_command_metrics")
+    @mock.patch("time.time")
+    def test_task_finished(self, mock_time, mock_db_metrics):
+        mock_db_metrics.return_value = {"calls": 12, "time": 0.25}
+        metrics = task_metrics.TaskMetrics(self.redis)
+
+        for task_id, start in [("1", 100.0), ("2", 110.0)]:
+            mock_time.return_value = start
+            metrics.task_started(
+                task_id, {"kci_published": start - 2, "kci_chain": CHAIN})
+            mock_time.return_value = start + 0.3
+            metrics.task_finished(task_id, "kcidb-tests", "SUCCESS")
+
+        text = task_metrics.get_prometheus_text(self.redis)
+        labels = 'task="kcidb-tests",chain="{}"'.format(CHAIN)
+
+        self.assertIn(
+            "kernelci_tasks_total{{{},state=\"SUCCESS\"}} 2".format(labels),
+            text)
+        self.assertIn(
+            "# TYPE kernelci_task_queue_wait_seconds histogram", text)
+        self.assertIn(
+            "kernelci_task_queue_wait_seconds_bucket"
+            "{{{},le=\"1\"}} 0".format(labels), text)
+        self.assertIn(
+            "kernelci_task_queue_wait_seconds_bucket"
+            "{{{},le=\"5\"}} 2".format(labels), text)
+        self.assertIn(
+            "kernelci_task_queue_wait_seconds_bucket"
+            "{{{},le=\"+Inf\"}} 2".format(labels), text)
+        self.assertIn(
+            "kernelci_task_queue_wait_seconds_sum{{{}}} 4".format(labels),
+            text)
+        self.assertIn(
+            "kernelci_task_run_seconds_bucket"
+            "{{{},le=\"0.5\"}} 2".format(labels), text)
+        self.assertIn(
+            "kernelci_task_run_seconds_count{{{}}} 2".format(labels), text)
+        self.assertIn(
+            "kernelci_task_db_seconds_total{{{}}} 0.5".format(labels), text)
+        self.assertIn(
+            "kernelci_task_db_calls_total{{{}}} 24".format(labels), text)
+
+    @mock.patch("time.time")
+    def test_task_finished_no_headers(self, mock_time):
+        mock_time.return_value = 100.0
+        metrics = task_metrics.TaskMetrics(self.redis)
+
+        metrics.task_started("1", None)
+        metrics.task_finished("1", "send-report", "FAILURE")
+        # Not started: ignored.
+        metrics.task_finished("2", "send-report", "SUCCESS")
+
+        text = task_metrics.get_prometheus_text(self.redis)
+        self.assertIn(
+            "kernelci_tasks_total{task=\"send-report\",chain=\"send-report\","
+            "state=\"FAILURE\"} 1", text)
+        self.assertNotIn("SUCCESS", text)
+        self.assertNotIn("kernelci_task_queue_wait_seconds", text)
+
+    @mock.patch("utils.LOG")
+    @mock.patch("time.time")
+    def test_slow_task(self, mock_time, mock_log):
+        metrics = task_metrics.TaskMetrics(self.redis, slow_threshold=30)
+
+        mock_time.return_value = 100.0
+        metrics.task_started("1", {})
+        mock_time.return_value = 110.0
+        metrics.task_finished("1", "send-report", "SUCCESS")
+        self.assertFalse(mock_log.warn.called)
+
+        metrics.task_started("2", {})
+        mock_time.return_value = 150.0
+        metrics.task_finished("2", "send-report", "SUCCESS")
+        self.assertTrue(mock_log.warn.called)
+
+    def test_record_error(self):
+        mock_redis = mock.Mock()
+        mock_redis.pipeline.return_value.execute.side_effect = \
+            redis.exceptions.ConnectionError()
+        metrics = task_metrics.TaskMetrics(mock_redis)
+
+        metrics.record("send-report", "send-report", "SUCCESS", 1, 2, 0, 0)
+
+    def test_get_prometheus_text_empty(self):
+        self.assertEqual("", task_metrics.get_prometheus_text(self.redis))
+
+    def test_escape_label(self):
+        self.assertEqual(
+            'task="x\\ny",chain="a\\"b\\\\c"',
+            task_metrics._format_labels(("task", "x\ny"), ("chain", 'a"b\\c')))
+
+    def test_kcidb_metrics(self):
+        metrics = task_metrics.TaskMetrics(self.redis)
+        metrics.record_kcidb(
+            "host:12", {"queue_depth": 3, "batches": 2, "restarts": 0})
+        metrics.record_kcidb(
+            "host:34", {"queue_depth": 0, "batches": 5, "restarts": 1})
+
+        text = task_metrics.get_prometheus_text(self.redis)
+        self.assertIn("# TYPE kernelci_kcidb_queue_depth gauge", text)
+        self.assertIn(
+            "kernelci_kcidb_queue_depth{worker=\"host:12\"} 3", text)
+        self.assertIn(
+            "kernelci_kcidb_batches_total{worker=\"host:34\"} 5", text)
+        self.assertNotIn("kernelci_kcidb_errors_total", text)
+
+        metrics.record_kcidb("host:12", None)
+        metrics.record_kcidb("host:34", None)
+        self.assertEqual("", task_metrics.get_prometheus_text(self.redis))
+
+    def test_kcidb_metrics_recorder(self):
+        recorded = threading.Event()
+        metrics = mock.Mock()
+        metrics.record_kcidb.side_effect = \
+            lambda worker, values: recorded.set()
+        kcidb_buffer = mock.Mock()
+        kcidb_buffer.get_metrics.return_value = {"queue_depth": 1}
+
+        recorder = task_metrics.KcidbMetricsRecorder(
+            metrics, "host:12", kcidb_buffer, interval=0.01)
+        recorder.start()
+        self.assertTrue(recorded.wait(5))
+        recorder.stop()
+
+        metrics.record_kcidb.assert_any_call("host:12", {"queue_depth": 1})
+        metrics.record_kcidb.assert_called_with("host:12", None)